@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def measure(function, repeat=3):
+    """Run the function several times, return the best elapsed time in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(function):
+    """Run the function in a forked process, return how much its peak
+    resident memory grows in KiB (Linux only)"""
+    import resource
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = function()
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write, str(after - before).encode())
+        del result
+        os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read) as f:
+        growth = int(f.read())
+    os.waitpid(pid, 0)
+    return growth
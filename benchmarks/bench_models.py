@@ -0,0 +1,40 @@
+"""
+Benchmark of the model objects: memory per object, and throughput of the
+conversions from/to the data saved in the database.
+
+Usage: python -m benchmarks.bench_models [count]
+"""
+from __future__ import print_function
+
+import sys
+
+from benchmarks import measure, peak_memory
+from models.trip import Destination, Spent
+
+
+SAMPLES = [
+    (Destination, {
+        'name': 'Place', 'address': '1 Main Street', 'latitude': 10.5, 'longitude': 20.5,
+        'phone_number': '+1 555 0100', 'website_uri': 'http://example.com', 'rating': 4.5,
+        'day': 3, 'time': '10:00', 'transportation': 'bus',
+    }),
+    (Spent, {'content': 'food', 'spent': 12}),
+]
+
+
+def main(count=100000):
+    for model, data in SAMPLES:
+        keys = ['-K{:06d}'.format(i) for i in range(count)]
+        objects = [model.from_dict(data, key) for key in keys]
+
+        memory = peak_memory(lambda: [model.from_dict(data, key) for key in keys])
+        load = measure(lambda: [model.from_dict(data, key) for key in keys])
+        dump = measure(lambda: [obj.to_dict() for obj in objects])
+
+        print('{:<11}: {:6.0f} bytes/object, from_dict {:9,.0f} objects/sec, '
+              'to_dict {:9,.0f} objects/sec'.format(
+                  model.__name__, memory * 1024.0 / count, count / load, count / dump))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
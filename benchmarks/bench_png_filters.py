@@ -0,0 +1,53 @@
+"""
+Benchmark of the scanline filters of png.Writer: encode time and size of
+a QR code and of the images of data/images without filter (the former
+behaviour), with each filter type, and with the adaptive filter selection.
+The filters are computed with NumPy if it is installed.
+
+Usage: python -m benchmarks.bench_png_filters [repeat]
+"""
+from __future__ import print_function
+
+import io
+import os
+import sys
+
+import png
+from benchmarks import ROOT, measure
+from benchmarks.bench_qr_png import qr_matrix
+
+IMAGES = ('background.png', 'powered_by_google_dark.png', 'powered_by_google_light.png')
+
+
+def images():
+    """Yield the name, the rows and the arguments of png.Writer of the
+    images to encode"""
+    qr = qr_matrix(10)
+    yield 'QR code version 10', [[0 if module else 1 for module in row] for row in qr], \
+        dict(width=len(qr), height=len(qr), greyscale=True, bitdepth=1)
+    for name in IMAGES:
+        width, height, rows, info = png.Reader(filename=os.path.join(ROOT, 'data', 'images', name)).read()
+        yield name, [list(row) for row in rows], \
+            dict(width=width, height=height, greyscale=info['greyscale'], alpha=info['alpha'],
+                 bitdepth=info['bitdepth'])
+
+
+def main(repeat=3):
+    print('NumPy filters:', 'yes' if png.numpy is not None else 'no')
+    for name, rows, options in images():
+        for filter_type in (None,) + png.FILTER_TYPES[1:] + (png.ADAPTIVE,):
+            writer = png.Writer(filter_type=filter_type, **options)
+
+            def encode():
+                f = io.BytesIO()
+                writer.write(f, rows)
+                return f
+
+            size = len(encode().getvalue())
+            elapsed = measure(encode, repeat)
+            print('{} filter {}: {:.1f} ms, {} bytes'.format(
+                name, filter_type or 'none', elapsed * 1000, size))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
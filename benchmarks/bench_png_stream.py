@@ -0,0 +1,81 @@
+"""
+Benchmark of the streaming PNG encoder: throughput and size of a scaled QR
+code, of the background image and of a tall photo-like image by zlib
+compression level and strategy, and growth of the peak memory when the
+rows of images of increasing height are generated while they are encoded.
+
+Usage: python -m benchmarks.bench_png_stream [repeat]
+"""
+from __future__ import print_function
+
+import random
+import sys
+
+import config
+import png
+from benchmarks import measure, peak_memory
+from benchmarks.bench_png_filters import images
+from benchmarks.bench_qr_png import qr_matrix
+
+STRATEGIES = (('default', None), ('filtered', png.Z_FILTERED), ('rle', png.Z_RLE))
+LEVELS = (1, 6, 9)
+
+
+class Sink(object):
+    """Output file counting the bytes written to it"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def photo_rows(width, height):
+    """Generate the rows of a noisy gradient"""
+    rand = random.Random(1)
+    for y in range(height):
+        yield [(x + y + rand.randint(0, 7)) % 256 for x in range(width * 3)]
+
+
+def scaled_qr():
+    qr = qr_matrix(10)
+    size = (len(qr) + 2 * config.QR_BORDER) * config.QR_SCALE
+    blank = [1] * size
+    rows = [blank] * (config.QR_BORDER * config.QR_SCALE)
+    for row in qr:
+        pixels = [1] * (config.QR_BORDER * config.QR_SCALE)
+        for module in row:
+            pixels.extend([0 if module else 1] * config.QR_SCALE)
+        pixels.extend([1] * (config.QR_BORDER * config.QR_SCALE))
+        rows.extend([pixels] * config.QR_SCALE)
+    rows.extend([blank] * (config.QR_BORDER * config.QR_SCALE))
+    return rows, dict(width=size, height=size, greyscale=True, bitdepth=1)
+
+
+def main(repeat=3):
+    qr_rows, qr_options = scaled_qr()
+    background = [image for image in images() if image[0] == 'background.png'][0]
+    cases = [('QR code x{}'.format(config.QR_SCALE), qr_rows, qr_options, None),
+             (background[0], background[1], background[2], png.ADAPTIVE),
+             ('photo 512x1024', list(photo_rows(512, 1024)), dict(width=512, height=1024), png.ADAPTIVE)]
+
+    for name, rows, options, filter_type in cases:
+        raw = len(rows) * (len(rows[0]) * options.get('bitdepth', 8) // 8 + 1)
+        for strategy_name, strategy in STRATEGIES:
+            for level in LEVELS:
+                writer = png.Writer(compression=level, strategy=strategy, filter_type=filter_type, **options)
+                sink = Sink()
+                writer.write(sink, rows)
+                elapsed = measure(lambda: writer.write(Sink(), rows), repeat)
+                print('{} {} level {}: {:.1f} MB/s, {} bytes'.format(
+                    name, strategy_name, level, raw / elapsed / 1e6, sink.size))
+
+    for height in (1000, 4000, 16000):
+        writer = png.Writer(512, height)
+        growth = peak_memory(lambda: writer.write(Sink(), photo_rows(512, height)))
+        print('streamed 512x{}: peak memory +{} KiB'.format(height, growth))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,29 @@
+"""
+Microbenchmark of the local generation of push keys.
+
+Usage: python -m benchmarks.bench_push_keys [count]
+"""
+from __future__ import print_function
+
+import sys
+
+from benchmarks import measure
+from pyrebase.pyrebase import Database
+
+
+def main(count=100000):
+    db = Database(None, None, 'https://example.firebaseio.com', None)
+    keys = []
+
+    def generate():
+        del keys[:]
+        keys.extend(db.generate_key() for _ in range(count))
+
+    elapsed = measure(generate)
+    assert len(set(keys)) == count, 'duplicated keys'
+    assert keys == sorted(keys), 'keys are not ordered'
+    print('push keys: {:,.0f} keys/sec ({} keys in {:.3f}s)'.format(count / elapsed, count, elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
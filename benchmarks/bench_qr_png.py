@@ -0,0 +1,56 @@
+"""
+Microbenchmark of the PNG images of the QR codes at common sizes (versions
+1, 4, 10 and 25): the former png_qr, which mapped the matrix to a list of
+pixels encoded by png.Writer, against encode_qr at the same scale, at the
+scale of the uploaded images, and memoized by share URL.
+
+Usage: python -m benchmarks.bench_qr_png [images]
+"""
+from __future__ import print_function
+
+import io
+import random
+import sys
+
+import config
+import png
+from benchmarks import measure
+from utils.qrimage import encode_qr
+
+VERSIONS = (1, 4, 10, 25)
+
+
+def qr_matrix(version):
+    size = 17 + 4 * version
+    rand = random.Random(version)
+    return [[rand.random() < 0.5 for _ in range(size)] for _ in range(size)]
+
+
+def former_png_qr(qr_matrix):
+    data = [[0 if x else 1 for x in row] for row in qr_matrix]
+    f = io.BytesIO()
+    png.Writer(len(data), len(data), greyscale=True, bitdepth=1).write(f, data)
+    return io.BytesIO(f.getvalue())
+
+
+def main(count=200):
+    for version in VERSIONS:
+        qr = qr_matrix(version)
+        url = 'http://example.com/u/t{}?trip'.format(version)
+        cases = (
+            ('png.Writer', lambda: former_png_qr(qr)),
+            ('encode_qr', lambda: encode_qr(qr)),
+            ('encode_qr x{}'.format(config.QR_SCALE),
+             lambda: encode_qr(qr, config.QR_SCALE, config.QR_BORDER)),
+            ('memoized x{}'.format(config.QR_SCALE),
+             lambda: encode_qr(qr, config.QR_SCALE, config.QR_BORDER, key=url)),
+        )
+        for name, function in cases:
+            size = len(function() if name != 'png.Writer' else function().getvalue())
+            elapsed = measure(lambda: [function() for _ in range(count)])
+            print('version {} ({}x{}) {}: {:,.0f} images/sec, {} bytes'.format(
+                version, len(qr), len(qr), name, count / elapsed, size))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,52 @@
+"""
+Microbenchmark of the results of ordered queries: the children returned
+by the server are sorted and read with `items`, then `val` is called twice,
+against pyrebase's former response made of a Pyre object per child whose
+OrderedDict was rebuilt by each call of `val`.
+
+Usage: python -m benchmarks.bench_query_result [children]
+"""
+from __future__ import print_function
+
+import random
+import sys
+from collections import OrderedDict
+
+from benchmarks import measure
+from pyrebase.pyrebase import QueryResult, convert_to_pyre
+
+
+def children(count):
+    rand = random.Random(1)
+    return dict(('-K{:08d}'.format(i), {'name': str(i), 'day': rand.randint(1, 30)})
+                for i in range(count))
+
+
+def main(count=50000):
+    data = children(count)
+
+    def former():
+        pyres = convert_to_pyre(sorted(data.items(), key=lambda item: item[1]['day']))
+        keys = [pyre.key() for pyre in pyres]
+        for _ in range(2):
+            OrderedDict((pyre.key(), pyre.val()) for pyre in pyres)
+        return keys
+
+    def result():
+        response = QueryResult.from_dict(data, 'n', 'day')
+        keys = [key for key, _ in response.items()]
+        response.val()
+        response.val()
+        return keys
+
+    days = [data[key]['day'] for key in result()]
+    assert days == sorted(days), 'children are not ordered'
+
+    for name, function in (('pyre objects', former), ('query result', result)):
+        elapsed = measure(function)
+        print('{}: {:,.0f} children/sec ({} children in {:.3f}s)'.format(
+            name, count / elapsed, count, elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,59 @@
+"""
+Benchmark of building a trip with many destinations from its raw data, as
+read from the database: construction time and peak memory when only the
+trip is used (e.g. the trip list), and when every destination, note and
+spent is used.
+
+Usage: python -m benchmarks.bench_trip_hydration [destinations]
+"""
+from __future__ import print_function
+
+import sys
+
+from benchmarks import measure, peak_memory
+from models.trip import Trip
+
+
+def trip_data(destinations, children=5):
+    """Return the raw data of a trip"""
+    return {
+        'name': 'Benchmark', 'days': 30, 'active': False,
+        'destinations': dict(('-D{:05d}'.format(d), {
+            'name': 'Place {}'.format(d), 'address': '{} Main Street'.format(d),
+            'latitude': 10.0 + d, 'longitude': 20.0 + d, 'phone_number': '+1 555 0100',
+            'website_uri': 'http://example.com/{}'.format(d), 'rating': 4.5,
+            'day': d % 30, 'time': '10:00', 'transportation': 'bus',
+            'notes': dict(('-N{}'.format(n), {'content': 'note {}'.format(n)})
+                          for n in range(children)),
+            'spents': dict(('-S{}'.format(s), {'content': 'spent {}'.format(s), 'spent': s})
+                           for s in range(children)),
+        }) for d in range(destinations)),
+    }
+
+
+def hydrate(trip):
+    """Use every child of the trip"""
+    for destination in trip._destinations:
+        for note in destination._notes or []:
+            note.content
+        for spent in destination._spents or []:
+            spent.spent
+    return trip
+
+
+def main(destinations=1000):
+    data = trip_data(destinations)
+
+    scenarios = [
+        ('trip only', lambda: Trip(**data)),
+        ('all children', lambda: hydrate(Trip(**data))),
+    ]
+    for name, build in scenarios:
+        elapsed = measure(build, repeat=5)
+        memory = peak_memory(build)
+        print('{} destinations, {:<12}: {:8.2f}ms, peak memory +{:,} KiB'.format(
+            destinations, name, elapsed * 1000, memory))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
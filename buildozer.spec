@@ -22,7 +22,7 @@ source.include_patterns = data/*
 #source.exclude_exts = spec
 
 # (list) List of directory to exclude (let empty to not exclude anything)
-source.exclude_dirs = tests,bin,utils/libs,zbar/libs
+source.exclude_dirs = tests,benchmarks,bin,utils/libs,zbar/libs
 
 # (list) List of exclusions using pattern matching
 #source.exclude_patterns = license,images/*/*.jpg
@@ -36,7 +36,7 @@ version.filename = %(source.dir)s/main.py
 
 # (list) Application requirements
 # comma seperated e.g. requirements = sqlite3,kivy
-requirements = kivy,android,pyjnius,requests,qrcode,sseclient,gcloud,oauth2client,openssl
+requirements = kivy,android,pyjnius,requests,qrcode,sseclient,gcloud,oauth2client,openssl,futures,pil
 
 # (str) Custom source folders for requirements
 # Sets custom source for any requirements with recipes
@@ -1,10 +1,18 @@
 import config
 import pyrebase
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from kivy.event import EventDispatcher
 from kivy.properties import BooleanProperty
 from kivy.storage.jsonstore import JsonStore
 
+from .cache import PathCache, MemoryCache, DiskCache
+from .executor import BackgroundExecutor, ui_dispatch
+from .image_cache import ImageCache
+from .oplog import OperationLog
+from .streams import StreamManager
+from .sync import SyncWorker
 from .trip_manager import TripManager
 from .trip_tracker import TripTracker
 from .share_manager import ShareManager
@@ -39,15 +47,44 @@ class BackEndClient(EventDispatcher):
 
         # An instance of FirebaseApplication for accessing the
         # Firebase database. This is created after logged in
-        firebase = pyrebase.initialize_app(config.FIREBASE)
+        firebase = pyrebase.initialize_app(dict(config.FIREBASE,
+                                                poolConnections=config.HTTP_POOL_HOSTS,
+                                                poolMaxsize=config.HTTP_POOL_SIZE))
+        self._firebase = firebase
         self._auth = firebase.auth()
+
+        # The queries of pyrebase's Database are immutable references, so a
+        # single object is shared by the threads; Storage keeps the path
+        # being built in its state, so each thread uses its own object
         self._db = firebase.database()
-        self._storage = firebase.storage()
+        self._thread_local = threading.local()
+
+        # Executor running the backend requests out of the UI thread
+        self._executor = BackgroundExecutor(max_workers=config.BACKEND_WORKERS)
+
+        # Threads uploading several files at once
+        self._uploads = ThreadPoolExecutor(max_workers=config.UPLOAD_WORKERS)
+
+        # Images downloaded from the storage, kept between sessions
+        self._image_cache = ImageCache(config.IMAGE_CACHE_DIR, config.IMAGE_CACHE_SIZE,
+                                       firebase.requests, max_age=config.IMAGE_CACHE_TTL)
+
+        # Log of the writes to be synchronized in background
+        self._oplog = OperationLog(config.SYNC_LOG) if config.SYNC_LOG else None
+        self._sync = None
+
+        # Cache of the data read from the Firebase database
+        disk = DiskCache(config.CACHE_FILE, ttl=config.CACHE_TTL) if config.CACHE_FILE else None
+        self._cache = PathCache(MemoryCache(max_size=config.CACHE_SIZE,
+                                            ttl=config.CACHE_TTL), disk)
 
         # Save the authenticated user
         self._uid = None        # UID of the user
         self._token = None      # Access token
 
+        # Streams of the nodes followed in realtime, for the authenticated user
+        self._streams = None
+
         # Reference to the collections for the authenticated user
         self._trip_manager = None
         self._trip_tracker = None
@@ -56,7 +93,22 @@ class BackEndClient(EventDispatcher):
     def on_authenticated(self, instance, authenticated):
         """Callback after authentication success to create necessary
         objects for authenticated user"""
+        if self._sync is not None:
+            self._sync.stop(timeout=1)
+            self._sync = None
+        if self._streams is not None:
+            self._streams.close()
+            self._streams = None
+
         if authenticated:
+            if self._oplog is not None:
+                self._sync = SyncWorker(self._oplog, self._db,
+                                        self._token, self._cache)
+                self._sync.start()
+
+            self._streams = StreamManager(config.FIREBASE['databaseURL'],
+                                          token=lambda: self._token,
+                                          dispatch=ui_dispatch)
             self._trip_manager = TripManager(self)
             self._trip_tracker = TripTracker(self)
             self._share_manager = ShareManager(self)
@@ -65,25 +117,62 @@ class BackEndClient(EventDispatcher):
             self._trip_tracker = None
             self._share_manager = None
 
-    def auto_login(self):
+    def restore_session(self):
         """
-        Check local storage if a login session is valid.
+        Restore the login session saved on the device without contacting
+        the server, return False if there is no session to restore.
+
+        The token may have expired meanwhile: it must be checked with
+        `validate_token` and `lookup_account`, which can run concurrently
+        with the first requests of the user data.
         """
-        if self._local.exists('session'):
-            self._token = self._local['session']['token']
+        token, uid = self.session('token'), self.session('uid')
+        if token is None or uid is None:
+            return False
 
-            # test if the token is still valid
-            self._db.child("active").get(token=self._token)
+        self._token = token
+        self._uid = uid
+        return True
 
-            # get the user id
-            resp = self._auth.get_account_info(self._token)
-            self._uid = resp['users'][0]['localId']
+    def validate_token(self):
+        """Test if the token is still valid with a shallow read"""
+        self.db.child("active").shallow().get(token=self._token)
 
-            self.authenticated = True
+    def lookup_account(self):
+        """Return the user id of the account owning the token"""
+        resp = self._auth.get_account_info(self._token)
+        return resp['users'][0]['localId']
 
-        else:
+    def auto_login(self):
+        """
+        Check local storage if a login session is valid.
+        """
+        if not self.restore_session():
             raise Exception("Session Expired")
 
+        self.validate_token()
+        if self.lookup_account() != self._uid:
+            raise Exception("Session Expired")
+
+        self.authenticated = True
+
+    def snapshot(self):
+        """Return the trips (full data) saved by the last `save_snapshot`
+        for the authenticated user, None if there is no snapshot"""
+        if self._local.exists('snapshot'):
+            snapshot = self._local['snapshot']
+            if snapshot.get('uid') == self._uid:
+                return snapshot['trips']
+        return None
+
+    def save_snapshot(self, trips):
+        """Save the trips of the authenticated user on the device, so that
+        they can be shown as soon as the app starts"""
+        self._local['snapshot'] = {
+            'uid': self._uid,
+            'trips': [trip.full_data() for trip in trips]
+        }
+
     def login(self, email, password):
         """
         Signing in the back-end service using the given email/password.
@@ -95,10 +184,17 @@ class BackEndClient(EventDispatcher):
             self._uid = user['localId']
             self._token = user['idToken']
 
+            # cached data of another user must not be reused
+            if self.session('uid') != self._uid:
+                self._cache.clear()
+                if self._oplog is not None:
+                    self._oplog.clear()
+
             # Save login session in local preference
             self._local['session'] = {
                 'token': self._token,
-                'email': email
+                'email': email,
+                'uid': self._uid
             }
 
             self.authenticated = True
@@ -134,8 +230,12 @@ class BackEndClient(EventDispatcher):
     def sign_out(self):
         """Invalidate the authentication token """
         if self._local.exists('session'):
-            if 'token' in self._local['session']:
-                del self._local['session']['token']
+            session = dict(self._local['session'])
+            session.pop('token', None)
+            self._local['session'] = session
+        if self._local.exists('snapshot'):
+            self._local.delete('snapshot')
+        self._cache.clear()
         self._uid = None
         self._token = None
         self.authenticated = False
@@ -150,11 +250,52 @@ class BackEndClient(EventDispatcher):
 
     @property
     def db(self):
+        """The Firebase database object, shared by the threads"""
         return self._db
 
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def sync(self):
+        return self._sync
+
     @property
     def storage(self):
-        return self._storage
+        """The Firebase storage object for the current thread"""
+        if not hasattr(self._thread_local, 'storage'):
+            self._thread_local.storage = self._firebase.storage()
+        return self._thread_local.storage
+
+    @property
+    def image_cache(self):
+        """The ImageCache of the images downloaded from the storage"""
+        return self._image_cache
+
+    @property
+    def executor(self):
+        return self._executor
+
+    @property
+    def uploads(self):
+        """The thread pool uploading files, see CollectionManager.put_files"""
+        return self._uploads
+
+    @property
+    def connection_stats(self):
+        """Counters of the HTTP connections opened and reused"""
+        return self._firebase.connection_stats
+
+    @property
+    def streams(self):
+        """The StreamManager following nodes of the database in realtime,
+        None if not authenticated"""
+        return self._streams
+
+    def run(self, function, *args, **kwargs):
+        """Call the function out of the UI thread, see BackgroundExecutor.run"""
+        return self._executor.run(function, *args, **kwargs)
 
     @property
     def trip_manager(self):
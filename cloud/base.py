@@ -1,4 +1,47 @@
+import threading
 import urllib
+from collections import OrderedDict
+
+import requests
+from pyrebase.pyrebase import PyreResponse, QueryResult, PreconditionFailed
+
+from .batch import WriteBatch
+from .cache import MISSING, normalize_path
+
+
+# Methods of pyrebase's references setting the parameters of a query
+QUERY_METHODS = {
+    'orderBy': 'order_by_child',
+    'equalTo': 'equal_to',
+    'startAt': 'start_at',
+    'endAt': 'end_at',
+    'limitToFirst': 'limit_to_first',
+    'limitToLast': 'limit_to_last',
+}
+
+# Query under which the ETag of a node is cached, so that it is invalidated
+# with the cached value of the node
+ETAG_QUERY = {'etag': True}
+
+
+class ConflictError(Exception):
+    """Exception raised by a checked write of a node which has been changed
+    by another device, with the current value and ETag of the node"""
+
+    def __init__(self, path, value, etag=None):
+        super(ConflictError, self).__init__('{} has been changed by another device'.format(path))
+        self.path = path
+        self.value = value
+        self.etag = etag
+
+
+def make_response(value, key, order_by=None):
+    """Wrap a (cached) value into the response object returned by pyrebase,
+    the children of a dict are kept in their order"""
+    if isinstance(value, dict):
+        return QueryResult(list(value.items()), key, order_by)
+    return PyreResponse(value, key)
+
 
 class CollectionManager(object):
     """
@@ -8,60 +51,323 @@ class CollectionManager(object):
 
     def __init__(self, backend, *path):
         self._backend = backend
-        self._db = backend.db
-        self._storage = backend.storage
         self._token = backend.token
         self._path = list(path)
 
+        # Local cache of the data read from the database
+        self._cache = backend.cache
+
+        # Worker writing the data in background, None to write immediately
+        self._sync = backend.sync
+
+    @property
+    def _db(self):
+        return self._backend.db
+
+    @property
+    def _storage(self):
+        return self._backend.storage
+
+    @property
+    def image_cache(self):
+        return self._backend.image_cache
+
     def child(self, *path):
         return self._db.child(*self._path).child(*path)
 
-    def push(self, data, *path):
-        """Wrapper for FirebaseDatabase's push method"""
-        resp = self.child(*path).push(data, token=self._token)
-        return resp['name']
+    def full_path(self, *path):
+        """Return the normalized path of a node under this collection"""
+        return normalize_path(*(self._path + list(path)))
 
-    def set(self, data, *path):
+    def _write(self, type, full_path, *args):
+        """Write the node at the path using the FirebaseDatabase's method of
+        the given type. With a sync worker, the operation is recorded to be
+        sent in background; otherwise the request is issued immediately, and
+        the cached node is dropped if it fails so that the next read shows
+        the actual data on the server"""
+        if self._sync is not None:
+            self._sync.enqueue(type, full_path, *args)
+            return args[0] if args else None
+
+        try:
+            return getattr(self._db.child(full_path), type)(*args, token=self._token)
+        except Exception:
+            self._cache.invalidate(full_path)
+            raise
+
+    def batch(self):
+        """Return a new batch to write several nodes in one request"""
+        return WriteBatch(self._db, self._token, self._cache, self._sync)
+
+    def push(self, data, *path, **kwargs):
+        """Add a new child node with a key generated locally, which saves
+        waiting for the response of a POST request to know the key"""
+        if kwargs.get('batch') is not None:
+            return kwargs['batch'].push(self.full_path(*path), data)
+        key = self._db.generate_key()
+        self.set(data, *(path + (key,)))
+        return key
+
+    def set(self, data, *path, **kwargs):
         """Wrapper for FirebaseDatabase's set method"""
-        return self.child(*path).set(data, token=self._token)
+        full_path = self.full_path(*path)
+        if kwargs.get('batch') is not None:
+            return kwargs['batch'].set(full_path, data)
+        resp = self._write('set', full_path, data)
+        self._cache.write(full_path, data)
+        return resp
 
-    def update(self, data, *path):
+    def update(self, data, *path, **kwargs):
         """Wrapper for FirebaseDatabase's update method"""
-        return self.child(*path).update(data, token=self._token)
+        full_path = self.full_path(*path)
+        if kwargs.get('batch') is not None:
+            return kwargs['batch'].update(full_path, data)
+        resp = self._write('update', full_path, data)
+        self._cache.merge(full_path, data)
+        return resp
 
-    def remove(self, *path):
+    def remove(self, *path, **kwargs):
         """Wrapper for FirebaseDatabase's remove method"""
-        return self.child(*path).remove(token=self._token)
+        full_path = self.full_path(*path)
+        if kwargs.get('batch') is not None:
+            return kwargs['batch'].remove(full_path)
+        resp = self._write('remove', full_path)
+        self._cache.write(full_path, None)
+        return resp
+
+    def get(self, *path, **kwargs):
+        """Wrapper for FirebaseDatabase's get method. With the keyword
+        argument `etag`, a cached node is not returned as is but revalidated
+        with a conditional request (see `get_if_modified`)"""
+        full_path = self.full_path(*path)
+        value = self._cache.get(full_path)
+        if kwargs.get('etag') and (self._sync is None or not self._sync.is_pending(full_path)):
+            return self.get_if_modified(value, *path)
+        if value is not MISSING:
+            return make_response(value, full_path.split('/')[-1])
+
+        resp = self.child(*path).get(token=self._token)
+        if self._sync is not None and self._sync.is_pending(full_path):
+            # show the writes which have not been synchronized yet
+            resp = make_response(self._sync.overlay(full_path, resp.val()), resp.key())
+        self._cache.put(full_path, resp.val())
+        return resp
+
+    def get_if_modified(self, value, *path):
+        """Read the node with its ETag, return the cached value of the node
+        if the server answers that it has not changed since it was cached"""
+        full_path = self.full_path(*path)
+        etag = MISSING if value is MISSING else self._cache.get(full_path, ETAG_QUERY)
+        resp, etag = self.child(*path).get_if_modified(None if etag is MISSING else etag,
+                                                       token=self._token)
+        if resp is None:
+            return make_response(value, full_path.split('/')[-1])
+
+        self._cache.put(full_path, resp.val())
+        if etag:
+            self._cache.put(full_path, etag, ETAG_QUERY)
+        return resp
+
+    def val_with_etag(self, *path):
+        """
+        Return the value of the node and its ETag, which is kept by the
+        caller until the node is written (see `check_unchanged` and
+        `compare_and_set`). The ETag is None if the node has writes which
+        have not been synchronized yet, as it is not the ETag of the value.
+        """
+        full_path = self.full_path(*path)
+        if self._sync is not None and self._sync.is_pending(full_path):
+            return self.val(*path), None
+        value = self.val(*path, etag=True)
+        etag = self._cache.get(full_path, ETAG_QUERY)
+        return value, (None if etag is MISSING else etag)
+
+    def check_unchanged(self, etag, *path):
+        """
+        Check that the node has not been changed since its ETag was read
+        (see `val_with_etag`) with a conditional request, so that it can be
+        written in a batch.
 
-    def get(self, *path):
-        """Wrapper for FirebaseDatabase's get method"""
-        return self.child(*path).get(token=self._token)
+        Raise a ConflictError with the current value of the node if it has
+        changed. Return False if the node cannot be checked, i.e. it has
+        writes which have not been synchronized yet or the server cannot be
+        reached: it is then written like any other node, the write being
+        queued if the device is offline.
+        """
+        full_path = self.full_path(*path)
+        if self._sync is not None and self._sync.is_pending(full_path):
+            return False
+        try:
+            resp, new_etag = self.child(*path).get_if_modified(etag, token=self._token)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            return False
+        if resp is None:
+            return True
 
-    def val(self, *path):
+        self._cache.put(full_path, resp.val())
+        if new_etag:
+            self._cache.put(full_path, new_etag, ETAG_QUERY)
+        raise ConflictError(full_path, resp.val(), new_etag)
+
+    def compare_and_set(self, data, etag, *path):
+        """
+        Set the node if it has not been changed since the ETag was read
+        (see `val_with_etag`). Return the new ETag of the node.
+
+        Raise a ConflictError if the node has changed, the current value of
+        the node being cached and in the error.
+        """
+        full_path = self.full_path(*path)
+        try:
+            etag = self.child(*path).set_if_match(data, etag, token=self._token)
+        except PreconditionFailed as e:
+            self._cache.write(full_path, e.value)
+            if e.etag:
+                self._cache.put(full_path, e.etag, ETAG_QUERY)
+            raise ConflictError(full_path, e.value, e.etag)
+        except Exception:
+            self._cache.invalidate(full_path)
+            raise
+
+        self._cache.write(full_path, data)
+        if etag:
+            self._cache.put(full_path, etag, ETAG_QUERY)
+        return etag
+
+    def val(self, *path, **kwargs):
         """Wrapper for FirebaseDatabase's get's val method"""
-        data = self.child(*path).get(token=self._token)
+        data = self.get(*path, **kwargs)
         return data.val()
 
-    def list(self, *path):
+    def list(self, *path, **kwargs):
         """Wrapper for FirebaseDatabase's get's each method"""
-        items = self.child(*path).get(token=self._token).each()
+        items = self.get(*path, **kwargs).each()
         if not items:
             items = []
         return items
 
-    def list_by(self, key, value, *path):
-        """Wrapper for FirebaseDatabase's get method with
-        order_by_child and equal_to"""
+    def iter_children(self, *path):
+        """Yield the (key, value) pairs of the children of the node, while
+        the response is downloaded if the node is not cached. The node is
+        cached once all its children have been read"""
+        full_path = self.full_path(*path)
+        value = self._cache.get(full_path)
+        if value is MISSING and self._sync is not None and self._sync.is_pending(full_path):
+            # show the writes which have not been synchronized yet
+            value = self.get(*path).val()
+        if value is not MISSING:
+            for item in (value.items() if isinstance(value, dict) else ()):
+                yield item
+            return
 
-        items = self.child(*path).order_by_child(key)\
-                .equal_to(value).get(token=self._token).each()
-        if not items:
-            items = []
-        return items
+        children = OrderedDict()
+        for key, child in self.child(*path).iter_children(token=self._token):
+            children[key] = child
+            yield key, child
+        self._cache.put(full_path, children or None)
+
+    def list_by(self, key, value, *path, **kwargs):
+        """
+        Return the children of the node ordered by the child `key` ("$key"
+        and "$value" order by the keys/values of the children), whose child
+        equals `value`, or with a value None, is between the keyword
+        arguments `start` and `end` included. The keyword argument `limit`
+        keeps the first children, or the last ones if it is negative.
+
+        The children are filtered by the server and sorted once: the result
+        is a QueryResult, which yields (key, value) pairs and whose `each`
+        returns the items of pyrebase.
+        """
+        full_path = self.full_path(*path)
+        query = {'orderBy': key}
+        if value is not None:
+            query['equalTo'] = value
+        else:
+            if kwargs.get('start') is not None:
+                query['startAt'] = kwargs['start']
+            if kwargs.get('end') is not None:
+                query['endAt'] = kwargs['end']
+        limit = kwargs.get('limit')
+        if limit is not None:
+            query['limitToLast' if limit < 0 else 'limitToFirst'] = abs(limit)
+
+        name = full_path.split('/')[-1]
+        cached = self._cache.get(full_path, query)
+        if cached is not MISSING:
+            return make_response(cached or OrderedDict(), name, key)
+
+        ref = self.child(*path)
+        for param, arg in query.items():
+            ref = getattr(ref, QUERY_METHODS[param])(arg)
+        resp = ref.get(token=self._token)
+        if isinstance(resp, QueryResult):
+            value = resp.val()
+        else:
+            value = resp.val() or OrderedDict()
+            resp = make_response(value, name, key)
+
+        if self._sync is None or not self._sync.is_pending(full_path):
+            self._cache.put(full_path, value, query)
+        return resp
+
+    def keys(self, *path):
+        """Return the sorted keys of the children of the node, with a
+        shallow query which does not download the data of the children"""
+        full_path = self.full_path(*path)
+        query = {'shallow': True}
+        keys = self._cache.get(full_path, query)
+        if keys is not MISSING:
+            return keys
 
-    def put(self, file, *path):
-        """Wrapper for FirebaseStorage's put method"""
-        resp = self._storage.child(*self._path).child(*path).put(file, token=self._token)
+        keys = self.child(*path).shallow().get(token=self._token).each() or []
+        if self._sync is not None and self._sync.is_pending(full_path):
+            # add/remove the children written but not synchronized yet
+            children = OrderedDict((key, True) for key in keys)
+            keys = list(self._sync.overlay(full_path, children) or [])
+        else:
+            self._cache.put(full_path, sorted(keys), query)
+        return sorted(keys)
+
+    def list_page(self, limit, start_at=None, *path):
+        """Wrapper for FirebaseDatabase's get method with order_by_key,
+        start_at and limit_to_first: return the items of the first `limit`
+        children whose keys are not lower than `start_at`"""
+
+        full_path = self.full_path(*path)
+        query = {'orderBy': '$key', 'limitToFirst': limit}
+        if start_at is not None:
+            query['startAt'] = str(start_at)
+
+        cached = self._cache.get(full_path, query)
+        if cached is not MISSING:
+            return make_response(cached, full_path.split('/')[-1]).each() or []
+
+        ref = self.child(*path).order_by_child("$key")
+        if start_at is not None:
+            ref = ref.start_at(str(start_at))
+        value = ref.limit_to_first(limit).get(token=self._token).val()
+
+        if self._sync is not None and self._sync.is_pending(full_path):
+            # show the writes which have not been synchronized yet
+            value = self._sync.overlay(full_path, value) or OrderedDict()
+            keys = sorted(key for key in value if start_at is None or key >= start_at)
+            value = OrderedDict((key, value[key]) for key in keys[:limit])
+        else:
+            self._cache.put(full_path, value, query)
+
+        return make_response(value, full_path.split('/')[-1]).each() or []
+
+    def stream(self, handler, *path, **kwargs):
+        """Call the handler with the events changing the node, return the
+        Subscription (see StreamManager.subscribe), the keyword argument
+        `initial` sends the data of the node as the first event"""
+        return self._backend.streams.subscribe(self.full_path(*path), handler,
+                                               initial=kwargs.get('initial', True))
+
+    def put(self, file, *path, **kwargs):
+        """Wrapper for FirebaseStorage's put method, the keyword arguments
+        `chunk_size` and `progress` are passed to it"""
+        resp = self._storage.child(*self._path).child(*path).put(file, token=self._token, **kwargs)
         if 'name' in resp:
             return self._storage.child(*self._path).child(*path).get_url()
         else:
@@ -70,6 +376,41 @@ class CollectionManager(object):
         #                                          urllib.quote(resp['name'], safe=''),
         #                                          resp['downloadTokens'])
 
+    def put_files(self, files, chunk_size=None, progress=None):
+        """
+        Upload several files at once in the upload thread pool of the
+        backend, `files` being a list of (file, path) pairs. Return the list
+        of the URLs of the files, or of the exceptions raised by their
+        uploads.
+
+        `progress` is called with the number of bytes sent and the size of
+        all the files, from the upload threads.
+        """
+        lock = threading.Lock()
+        sent = [0] * len(files)
+        sizes = [0] * len(files)
+
+        def on_progress(index, count, size):
+            with lock:
+                sent[index], sizes[index] = count, size
+                total = sum(sent), sum(sizes)
+            if progress is not None:
+                progress(*total)
+
+        def upload(index, file, path):
+            return self.put(file, *path, chunk_size=chunk_size,
+                            progress=lambda count, size: on_progress(index, count, size))
+
+        futures = [self._backend.uploads.submit(upload, index, file, path)
+                   for index, (file, path) in enumerate(files)]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
     def get_file(self, *path):
         """Wrapper for FirebaseStorage's get method"""
         resp = self._storage.child(*path).get()
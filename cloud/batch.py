@@ -0,0 +1,103 @@
+import copy
+
+from .cache import normalize_path, is_related, apply_update
+
+
+class WriteBatch(object):
+    """
+    Accumulate set/update/remove operations on several paths of the database
+    and commit them as a single multi-location update, with None for the
+    removed nodes.
+
+    Paths given to a batch are full paths from the root of the database,
+    see `CollectionManager.full_path`. When a sync worker is given, committing
+    the batch records its operations to be written in the background.
+    """
+
+    def __init__(self, db, token, cache, sync=None):
+        self._db = db
+        self._token = token
+        self._cache = cache
+        self._sync = sync
+
+        # Pending values to write, by their normalized path
+        self._ops = {}
+        # Keys generated by push operations
+        self._keys = []
+
+    def __len__(self):
+        return len(self._ops)
+
+    def _add(self, path, value):
+        """Add the operation writing the value at the path"""
+        for other in list(self._ops):
+            if other == path or not is_related(path, other):
+                continue
+            if len(other) > len(path):
+                # the node written before is overwritten by this operation
+                del self._ops[other]
+            else:
+                # an ancestor is already written, write the value inside it
+                data = copy.deepcopy(self._ops[other])
+                self._ops[other] = apply_update(data, {path[len(other) + 1:]: value})
+                return
+        self._ops[path] = value
+
+    def set(self, path, data):
+        """Set the node at the path"""
+        self._add(normalize_path(path), data)
+
+    def update(self, path, data):
+        """Update children of the node at the path"""
+        for key, value in data.items():
+            self._add(normalize_path(path, key), value)
+
+    def remove(self, path):
+        """Remove the node at the path"""
+        self._add(normalize_path(path), None)
+
+    def push(self, path, data):
+        """Add a new child to the node at the path, return the key of the child"""
+        key = self._db.generate_key()
+        self._add(normalize_path(path, key), data)
+        self._keys.append(key)
+        return key
+
+    def commit(self):
+        """Write all operations in one request, return the generated keys"""
+        ops, keys = self._ops, self._keys
+        self._ops, self._keys = {}, []
+        if not ops:
+            return keys
+
+        if self._sync is not None:
+            for path, value in ops.items():
+                if value is None:
+                    self._sync.enqueue('remove', path)
+                else:
+                    self._sync.enqueue('set', path, value)
+                self._cache.write(path, value)
+            return keys
+
+        # all operations are sent to the deepest common parent of their paths
+        parents = [path.split('/')[:-1] for path in ops]
+        root = []
+        for parts in zip(*parents):
+            if any(part != parts[0] for part in parts):
+                break
+            root.append(parts[0])
+        root = '/'.join(root)
+        data = dict((path[len(root):].lstrip('/'), value) for path, value in ops.items())
+
+        try:
+            self._db.child(root).update(data, token=self._token)
+        except Exception:
+            if self._cache is not None:
+                for path in ops:
+                    self._cache.invalidate(path)
+            raise
+
+        if self._cache is not None:
+            for path, value in ops.items():
+                self._cache.write(path, value)
+        return keys
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+# Marker returned by the caches when a key is not cached. This is different
+# from None, which is a valid cached value (e.g. a removed node)
+MISSING = object()
+
+
+def normalize_path(*path):
+    """Return the normalized form of a database path, i.e. its components
+    joined by '/' without leading, trailing or duplicated slashes"""
+    parts = []
+    for part in path:
+        parts.extend(p for p in str(part).split('/') if p)
+    return '/'.join(parts)
+
+
+def cache_key(path, query=None):
+    """Return the key used to cache the result of a query at the given path"""
+    if not query:
+        return path
+    params = '&'.join('{}={}'.format(k, query[k]) for k in sorted(query))
+    return path + '?' + params
+
+
+def key_path(key):
+    """Return the path part of a cache key"""
+    return key.partition('?')[0]
+
+
+def is_related(path, other):
+    """Return True if the two paths are the same, or one of them is an
+    ancestor of the other"""
+    if path == other or not path or not other:
+        return True
+    if len(path) < len(other):
+        return other.startswith(path + '/')
+    return path.startswith(other + '/')
+
+
+def dumps(value):
+    """Serialize a value to be cached"""
+    return json.dumps(value, separators=(',', ':'))
+
+
+def loads(data):
+    """Deserialize a cached value, preserving the order of the children"""
+    return json.loads(data, object_pairs_hook=OrderedDict)
+
+
+def apply_update(node, data):
+    """Return the node after applying an update of its children, where keys
+    of the data may be paths to its descendants and None removes a child"""
+    node = node if isinstance(node, dict) else OrderedDict()
+    for key, value in data.items():
+        parts = normalize_path(key).split('/')
+        parent = node
+        for part in parts[:-1]:
+            if not isinstance(parent.get(part), dict):
+                if value is None:
+                    break
+                parent[part] = OrderedDict()
+            parent = parent[part]
+        else:
+            if value is None:
+                parent.pop(parts[-1], None)
+            else:
+                parent[parts[-1]] = value
+    return node
+
+
+class MemoryCache(object):
+    """
+    In-memory LRU cache. Entries are evicted when the cache holds more than
+    `max_size` entries, or when they are older than `ttl` seconds.
+    """
+
+    def __init__(self, max_size=256, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the cached value of the key, MISSING if not found or expired"""
+        try:
+            stored, value = self._entries.pop(key)
+        except KeyError:
+            return MISSING
+
+        if self.ttl is not None and time.time() - stored > self.ttl:
+            self.evictions += 1
+            return MISSING
+
+        # re-insert to mark the entry as the most recently used
+        self._entries[key] = (stored, value)
+        return value
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time(), value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def clear(self):
+        self._entries.clear()
+
+    def sync(self):
+        pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache(object):
+    """
+    Persistent cache tier saved to a JSON file. Changes are kept in memory
+    until `sync` is called, so that an operation touching many entries only
+    rewrites the file once. Entries older than `ttl` seconds are expired.
+    """
+
+    def __init__(self, filename, ttl=None):
+        self.filename = filename
+        self.ttl = ttl
+        self._changed = False
+        self._entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    self._entries = json.load(f)
+            except ValueError:
+                self._changed = True
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+
+        stored, value = entry
+        if self.ttl is not None and time.time() - stored > self.ttl:
+            self.delete(key)
+            return MISSING
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.time(), value)
+        self._changed = True
+
+    def delete(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._changed = True
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def clear(self):
+        self._entries = {}
+        self._changed = True
+
+    def sync(self):
+        """Write the changes to the file"""
+        if not self._changed:
+            return
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._entries, f)
+        os.rename(tmp, self.filename)
+        self._changed = False
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PathCache(object):
+    """
+    Write-through cache of database nodes, keyed by the normalized path of a
+    node and the query used to read it.
+
+    Writing a node updates its cached value locally and invalidates every
+    cached ancestor/descendant of that node, as their values contain (or are
+    contained by) the written data. Values are stored serialized, so callers
+    always get their own copy of the cached data.
+    """
+
+    def __init__(self, memory=None, disk=None):
+        self._memory = memory if memory is not None else MemoryCache()
+        self._disk = disk
+        self._lock = threading.RLock()
+
+        # Counters to measure the round trips saved by the cache
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def tiers(self):
+        return [self._memory] if self._disk is None else [self._memory, self._disk]
+
+    @property
+    def stats(self):
+        """Return the counters of the cache"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+            'evictions': self._memory.evictions,
+            'size': len(self._memory),
+        }
+
+    def _lookup(self, key):
+        data = self._memory.get(key)
+        if data is MISSING and self._disk is not None:
+            data = self._disk.get(key)
+            if data is not MISSING:
+                self._memory.set(key, data)
+        return data
+
+    def _store(self, key, value):
+        data = dumps(value)
+        for tier in self.tiers:
+            tier.set(key, data)
+
+    def _invalidate(self, path):
+        for tier in self.tiers:
+            for key in tier.keys():
+                if is_related(path, key_path(key)):
+                    tier.delete(key)
+
+    def _sync(self):
+        if self._disk is not None:
+            self._disk.sync()
+
+    def get(self, path, query=None):
+        """Return the cached value at the path, MISSING if not cached"""
+        with self._lock:
+            data = self._lookup(cache_key(path, query))
+            if data is MISSING:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+        return loads(data)
+
+    def put(self, path, value, query=None):
+        """Cache the value read from the path"""
+        with self._lock:
+            self._store(cache_key(path, query), value)
+            self._sync()
+
+    def write(self, path, value):
+        """Update the cache after the node at the path has been set to the
+        value, None if the node has been removed"""
+        with self._lock:
+            self._invalidate(path)
+            self._store(path, value)
+            self._sync()
+
+    def merge(self, path, data):
+        """Update the cache after the children of the node at the path have
+        been updated with the given data"""
+        with self._lock:
+            current = self._lookup(path)
+            self._invalidate(path)
+            if current is not MISSING:
+                self._store(path, apply_update(loads(current), data))
+            self._sync()
+
+    def invalidate(self, path):
+        """Drop cached values of the path, its ancestors and its descendants"""
+        with self._lock:
+            self._invalidate(path)
+            self._sync()
+
+    def clear(self):
+        """Drop all cached values"""
+        with self._lock:
+            for tier in self.tiers:
+                tier.clear()
+            self._sync()
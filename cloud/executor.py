@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+from utils.metrics import LatencyHistogram, Timer
+
+
+def ui_dispatch(call):
+    """Call the function on the UI thread"""
+    Clock.schedule_once(lambda dt: call())
+
+
+class BackgroundExecutor(object):
+    """
+    Run the (blocking) backend requests in a bounded thread pool, so that the
+    UI thread stays responsive, and deliver their results back on the UI
+    thread via Clock.schedule_once.
+
+    Two histograms measure the effect: `work` records how long each call
+    takes, i.e. how long the UI thread was blocked when calling it directly,
+    and `ui_blocked` records the time now spent on the UI thread to submit
+    the call and to run its callbacks.
+    """
+
+    def __init__(self, max_workers=4):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.work = LatencyHistogram('backend call (blocking before)')
+        self.ui_blocked = LatencyHistogram('UI thread blocked (after)')
+
+    def submit(self, function, *args, **kwargs):
+        """Call the function in the thread pool, return a Future"""
+
+        def call():
+            with Timer(self.work):
+                try:
+                    return function(*args, **kwargs)
+                except Exception:
+                    Logger.exception('BackgroundExecutor: %s', getattr(function, '__name__', function))
+                    raise
+
+        return self._pool.submit(call)
+
+    def run(self, function, *args, **kwargs):
+        """
+        Call the function in the thread pool, return a Future.
+
+        The keyword arguments `on_success` and `on_error` are not passed to
+        the function: they are callbacks called on the UI thread with the
+        result of the function or the exception it raised.
+        """
+        on_success = kwargs.pop('on_success', None)
+        on_error = kwargs.pop('on_error', None)
+
+        with Timer(self.ui_blocked):
+            future = self.submit(function, *args, **kwargs)
+
+        def deliver(dt):
+            with Timer(self.ui_blocked):
+                error = future.exception()
+                if error is not None:
+                    if on_error is not None:
+                        on_error(error)
+                elif on_success is not None:
+                    on_success(future.result())
+
+        future.add_done_callback(lambda f: Clock.schedule_once(deliver))
+        return future
+
+    def report(self):
+        """Return the latency histograms as a text"""
+        return self.work.report() + '\n' + self.ui_blocked.report()
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait)
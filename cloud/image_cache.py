@@ -0,0 +1,215 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from urllib.parse import urlparse, unquote
+except ImportError:
+    from urlparse import urlparse
+    from urllib import unquote
+
+from kivy.logger import Logger
+
+
+def url_extension(url):
+    """Return the extension of the file of a Storage URL, e.g. '.jpg' for
+    .../o/u%2Ftrips%2Fn1.jpg?alt=media"""
+    return os.path.splitext(unquote(urlparse(url).path))[1].lower()
+
+
+class ImageCache(object):
+    """
+    Disk cache of the images of Firebase Storage, i.e. the photos of the
+    notes and the QR codes, so that an image is downloaded once across
+    sessions instead of each time it is shown.
+
+    The files are content-addressed: they are named after the SHA-1 of their
+    data, so that the URLs of identical images share one file, and an index
+    maps the URLs to the files. The least recently used files are evicted
+    when their total size exceeds `max_bytes`. A URL is downloaded again
+    after `max_age` seconds in case its file has been replaced on the
+    server, its file not being written again if its data has not changed.
+
+    Concurrent requests of a URL share a single download.
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, directory, max_bytes, session, max_age=None, clock=time.time):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._session = session
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # size of the files by name, least recently used first, and name of
+        # the file of the URLs with the time they were downloaded
+        self._files = OrderedDict()
+        self._urls = {}
+        self._loading = {}
+
+        # Counters of the downloads saved by the cache
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+        self.evictions = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load_index()
+
+    @property
+    def size(self):
+        """Total size of the cached files in bytes"""
+        return sum(self._files.values())
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_index(self):
+        try:
+            with open(self.path(self.INDEX)) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return
+        for name, size in index.get('files', []):
+            if os.path.exists(self.path(name)):
+                self._files[name] = size
+        self._urls = dict((url, tuple(entry)) for url, entry in index.get('urls', {}).items()
+                          if entry[0] in self._files)
+
+    def _save_index(self):
+        tmp = self.path(self.INDEX + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'files': list(self._files.items()), 'urls': self._urls}, f)
+        os.rename(tmp, self.path(self.INDEX))
+
+    def _cached(self, url):
+        """Return the name of the file of the URL, None if it is not cached
+        or is too old"""
+        entry = self._urls.get(url)
+        if entry is None or entry[0] not in self._files:
+            return None
+        if self.max_age is not None and self._clock() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    def __contains__(self, url):
+        with self._lock:
+            return self._cached(url) is not None
+
+    def get(self, url):
+        """Return the path of the cached file of the image, which is
+        downloaded if it is not cached"""
+        while True:
+            with self._lock:
+                name = self._cached(url)
+                if name is not None:
+                    self._files[name] = self._files.pop(name)    # most recently used
+                    self.hits += 1
+                    self.bytes_saved += self._files[name]
+                    return self.path(name)
+
+                loading = self._loading.get(url)
+                if loading is None:
+                    self._loading[url] = threading.Event()
+                    self.misses += 1
+                    break
+            # wait for the download of another thread
+            loading.wait()
+            with self._lock:
+                if self._cached(url) is None:
+                    # the download has failed
+                    raise IOError('cannot download {}'.format(url))
+
+        try:
+            response = self._session.get(url)
+            response.raise_for_status()
+            self.bytes_downloaded += len(response.content)
+            return self.put(url, response.content)
+        finally:
+            with self._lock:
+                self._loading.pop(url).set()
+
+    def put(self, url, data):
+        """Cache the data of the image at the URL, e.g. after uploading it,
+        return the path of its file"""
+        name = hashlib.sha1(data).hexdigest() + url_extension(url)
+        with self._lock:
+            if name in self._files:
+                self._files[name] = self._files.pop(name)
+            else:
+                tmp = self.path(name + '.tmp')
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.rename(tmp, self.path(name))
+                self._files[name] = len(data)
+            self._urls[url] = (name, self._clock())
+            self._evict()
+            self._save_index()
+            return self.path(name)
+
+    def _evict(self):
+        """Remove the least recently used files, keeping the last one"""
+        size = self.size
+        while size > self.max_bytes and len(self._files) > 1:
+            name, file_size = self._files.popitem(last=False)
+            size -= file_size
+            self.evictions += 1
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+            for url in [url for url, entry in self._urls.items() if entry[0] == name]:
+                del self._urls[url]
+
+    def open(self, url):
+        """Return the data of the image as a read-only memory map of its
+        cached file, which is paged in when read instead of being copied"""
+        path = self.get(url)
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def prefetch(self, urls, executor):
+        """Download the images which are not cached with the executor"""
+        def fetch(url):
+            try:
+                self.get(url)
+            except Exception:
+                Logger.exception('ImageCache: prefetch %s', url)
+
+        for url in set(urls):
+            if url and url not in self:
+                executor.submit(fetch, url)
+
+    def sync(self):
+        """Save the order of the files used since the last download"""
+        with self._lock:
+            self._save_index()
+
+    @property
+    def stats(self):
+        """Return the counters of the cache"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+            'bytes_saved': self.bytes_saved,
+            'bytes_downloaded': self.bytes_downloaded,
+            'evictions': self.evictions,
+            'size': self.size,
+        }
+
+    def report(self):
+        stats = self.stats
+        return ('Image cache: {hits} hits, {misses} misses ({hit_rate:.0%}), {bytes_saved} bytes saved, '
+                '{bytes_downloaded} bytes downloaded, {evictions} evictions, {size} bytes'.format(**stats))
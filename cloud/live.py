@@ -0,0 +1,201 @@
+import copy
+from collections import namedtuple
+
+from kivy.logger import Logger
+
+from .cache import apply_update, normalize_path
+from models.trip import Trip, Destination, Note, Spent
+
+
+# A change of a model applied from a stream event: the path of the model
+# from the trip, e.g. ('destinations', <key>, 'spents', <key>), and whether
+# it was added, changed or removed
+Change = namedtuple('Change', 'path action')
+
+ADDED, CHANGED, REMOVED = 'added', 'changed', 'removed'
+
+# The lists of children of the models, by the key of their data: the model
+# class of the children and the methods of the parent adding/removing one
+CHILDREN = {
+    Trip: {'destinations': (Destination, 'add_destination', 'remove_destination')},
+    Destination: {'notes': (Note, 'add_note', 'remove_note'),
+                  'spents': (Spent, 'add_spent', 'remove_spent')},
+}
+
+# Fields computed from the children, which are not set from the events
+DERIVED = frozenset(['budget'])
+
+
+def split_path(path):
+    """Return the keys of a path of the database"""
+    path = normalize_path(path)
+    return tuple(path.split('/')) if path else ()
+
+
+def apply_event(trip, event, path, data):
+    """
+    Apply an event of a stream of the trip's node to the trip, return the
+    list of changes of the models, empty if the event does not change them
+    (e.g. the echo of a write of this device).
+
+    A `put` event replaces the node at the path by the data, a `patch` event
+    updates the children of the node, the keys of the data being paths.
+    """
+    keys = split_path(path)
+    if event == 'put':
+        changes = put(trip, keys, data)
+    elif event == 'patch':
+        changes = []
+        for key, value in (data or {}).items():
+            changes.extend(put(trip, keys + split_path(key), value))
+    else:
+        return []
+
+    # report each model once
+    seen = set()
+    return [change for change in changes if change not in seen and not seen.add(change)]
+
+
+def put(model, keys, data, path=(), parent=None):
+    """Replace the node at the path of the keys under the model by the data"""
+    if not keys:
+        if data is None:
+            return [Change(path, REMOVED)]
+        return replace(model, data, path, parent)
+
+    name = keys[0]
+    children = CHILDREN.get(type(model), {})
+    if name not in children:
+        return put_field(model, keys, data, path, parent)
+
+    if len(keys) == 1:
+        return put_children(model, name, data or {}, path)
+
+    child = find_child(model, name, keys[1])
+    if len(keys) == 2 or child is None:
+        if len(keys) > 2:
+            # a field of a child which is not known yet
+            if data is None:
+                return []
+            data = apply_update({}, {'/'.join(keys[2:]): data})
+        return put_child(model, name, keys[1], child, data, path)
+    return put(child, keys[2:], data, path + keys[:2], model)
+
+
+def replace(model, data, path, parent=None):
+    """Set the fields and the children of the model to the data"""
+    changes = []
+    for field in model._fields:
+        if field not in DERIVED and data.get(field) != getattr(model, field):
+            changes.extend(put_field(model, (field,), data.get(field), path, parent))
+    for name in CHILDREN.get(type(model), {}):
+        changes.extend(put_children(model, name, data.get(name) or {}, path))
+    return changes
+
+
+def put_field(model, keys, data, path, parent):
+    """Set a field of the model, or a descendant of a field"""
+    field = keys[0]
+    if field not in model._field_set or field in DERIVED:
+        return []
+
+    value = data
+    if len(keys) > 1:
+        node = {field: copy.deepcopy(getattr(model, field))}
+        value = apply_update(node, {'/'.join(keys): data}).get(field)
+    if value == getattr(model, field):
+        return []
+
+    if isinstance(model, Spent) and field == 'spent' and parent is not None:
+        # keep the budgets up to date
+        parent.update_spent(model, value)
+    else:
+        model.set(**{field: value})
+    return [Change(path, CHANGED)]
+
+
+def find_child(model, name, key):
+    for child in getattr(model, '_' + name) or []:
+        if child._id == key:
+            return child
+    return None
+
+
+def put_child(model, name, key, child, data, path):
+    """Add, replace or remove a child of the model"""
+    cls, add, remove = CHILDREN[type(model)][name]
+    path = path + (name, key)
+    if data is None:
+        if child is None:
+            return []
+        getattr(model, remove)(child)
+        return [Change(path, REMOVED)]
+
+    if child is None:
+        getattr(model, add)(cls.from_dict(data, key))
+        return [Change(path, ADDED)]
+    return replace(child, data, path, model)
+
+
+def put_children(model, name, data, path):
+    """Replace the children of the model by the data of the children"""
+    changes = []
+    for child in list(getattr(model, '_' + name) or []):
+        if child._id not in data:
+            changes.extend(put_child(model, name, child._id, child, None, path))
+    for key, value in data.items():
+        changes.extend(put_child(model, name, key, find_child(model, name, key), value, path))
+    return changes
+
+
+class LiveTrip(object):
+    """
+    Keep a trip in sync with its node on the server over a single long-lived
+    stream, instead of downloading the destinations, notes and spents again:
+    the writes of every device are delivered as `put`/`patch` events, which
+    are applied to the models on the UI thread. The listeners are then
+    called with the list of changes (see `apply_event`).
+
+    The first event holds the data of the node, so that the writes done
+    before the stream is connected are applied too.
+    """
+
+    def __init__(self, manager, trip):
+        self.trip = trip
+        self._listeners = []
+        self._stream = manager.stream(self._on_event, trip._id)
+
+    def bind(self, listener):
+        """Call the listener with the list of changes of each event"""
+        self._listeners.append(listener)
+
+    def unbind(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _on_event(self, message):
+        """Handle an event, called on the UI thread (see BackEndClient.streams)"""
+        self.apply(message['event'], message['path'], message['data'])
+
+    def apply(self, event, path, data):
+        """Apply the event to the trip and notify the listeners"""
+        if self._stream is None:
+            return []   # closed
+
+        try:
+            changes = apply_event(self.trip, event, path, data)
+        except Exception:
+            Logger.exception('LiveTrip: %s %s', event, path)
+            return []
+
+        if changes:
+            for listener in list(self._listeners):
+                listener(changes)
+        return changes
+
+    def close(self):
+        """Stop following the trip"""
+        stream, self._stream = self._stream, None
+        self._listeners = []
+        if stream is not None:
+            stream.close()
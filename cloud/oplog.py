@@ -0,0 +1,128 @@
+import os
+import copy
+import json
+import threading
+from collections import OrderedDict
+
+from .cache import normalize_path, is_related, apply_update
+
+
+def flatten(type, path, data=None):
+    """Return the (path, value) pairs written by an operation, where None
+    is the value of a removed node"""
+    if type == 'update':
+        return [(normalize_path(path, key), value) for key, value in data.items()]
+    if type == 'remove':
+        return [(path, None)]
+    return [(path, data)]
+
+
+def overlay_value(path, value, written_path, written):
+    """Return the value of the node at the path after the node at
+    `written_path` has been written"""
+    if written_path == path:
+        return copy.deepcopy(written)
+
+    if written_path.startswith(path + '/') or not path:
+        # a descendant is written
+        rel = written_path[len(path):].lstrip('/')
+        return apply_update(value, {rel: copy.deepcopy(written)})
+
+    if path.startswith(written_path + '/') or not written_path:
+        # an ancestor is written, find the node inside it
+        node = written
+        for part in path[len(written_path):].lstrip('/').split('/'):
+            node = node.get(part) if isinstance(node, dict) else None
+        return copy.deepcopy(node)
+
+    return value
+
+
+class OperationLog(object):
+    """
+    Persistent, append-only log of the write operations which have not been
+    synchronized to the database yet.
+
+    Each operation is appended to the file as a JSON line. When operations
+    are synchronized an acknowledgement line is appended, and the file is
+    truncated once no operation is pending.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._seq = 0
+        self._pending = []      # list of (seq, type, path, data)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return
+
+        acked = 0
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line, object_pairs_hook=OrderedDict)
+                except ValueError:
+                    # the last line may be incomplete after a crash
+                    continue
+                if 'ack' in record:
+                    acked = max(acked, record['ack'])
+                else:
+                    self._pending.append((record['seq'], record['type'],
+                                          record['path'], record.get('data')))
+                    self._seq = max(self._seq, record['seq'])
+
+        self._pending = [op for op in self._pending if op[0] > acked]
+
+    def _write(self, record):
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def append(self, type, path, data=None):
+        """Record an operation, return its sequence number"""
+        with self._lock:
+            self._seq += 1
+            self._write({'seq': self._seq, 'type': type, 'path': path, 'data': data})
+            self._pending.append((self._seq, type, path, copy.deepcopy(data)))
+            return self._seq
+
+    def pending(self, limit=None):
+        """Return the operations which are not synchronized, oldest first"""
+        with self._lock:
+            return list(self._pending[:limit])
+
+    def ack(self, seq):
+        """Mark the operations up to the given sequence number as synchronized"""
+        with self._lock:
+            self._pending = [op for op in self._pending if op[0] > seq]
+            if self._pending:
+                self._write({'ack': seq})
+            else:
+                self.clear()
+
+    def clear(self):
+        """Drop all pending operations"""
+        with self._lock:
+            self._pending = []
+            open(self.filename, 'w').close()
+
+    def is_pending(self, path):
+        """Return True if there are pending writes related to the path"""
+        with self._lock:
+            return any(is_related(path, written_path)
+                       for _, type, op_path, data in self._pending
+                       for written_path, _ in flatten(type, op_path, data))
+
+    def overlay(self, path, value):
+        """Return the value read from the database at the path with the
+        pending operations applied on it"""
+        with self._lock:
+            for _, type, op_path, data in self._pending:
+                for written_path, written in flatten(type, op_path, data):
+                    value = overlay_value(path, value, written_path, written)
+            return value
+
+    def __len__(self):
+        return len(self._pending)
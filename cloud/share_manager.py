@@ -1,20 +1,88 @@
+import hashlib
+import threading
 import config
 from urlparse import urlparse
+from concurrent.futures import Future
+from kivy.storage.jsonstore import JsonStore
 from utils import png_qr
 
 from .base import CollectionManager
+from .cache import MemoryCache, MISSING
 from models.trip import Trip, Destination, Note
 
 
+# Kinds of the shared objects, in the order of the components of their key
+SHARE_TYPES = ('trip', 'destination', 'note')
+
+
+def parse_share_url(url):
+    """
+    Return the kind of the object shared by the URL generated by
+    `ShareManager.share_url`, and its key: the tuple (uid, trip_id,
+    destination_id, note_id) where the ids below the object are None.
+
+    Raise a ValueError if the URL is not a share URL.
+    """
+    r = urlparse(url)
+    if r.netloc == config.BACKEND_DOMAIN and r.query in SHARE_TYPES:
+        parts = r.path.split('/')
+        if len(parts) == SHARE_TYPES.index(r.query) + 3 and parts[0] == '' and all(parts[1:]):
+            return r.query, tuple(parts[1:] + [None] * (4 - len(parts[1:])))
+    raise ValueError('invalid url')
+
+
+def share_path(key):
+    """Return the database path of the shared object of the key"""
+    uid, trip_id, destination_id, note_id = key
+    path = [uid, 'trips', trip_id]
+    if destination_id is not None:
+        path += ['destinations', destination_id]
+    if note_id is not None:
+        path += ['notes', note_id]
+    return path
+
+
+def share_object(key, data):
+    """Build the Trip, Destination or Note of the key from its data"""
+    if data is None:
+        raise ValueError('{} is not shared'.format('/'.join(share_path(key))))
+    if key[3] is not None:
+        return Note.from_dict(data, key[3])
+    if key[2] is not None:
+        return Destination.from_dict(data, key[2])
+    return Trip.from_dict(data, key[1])
+
+
+def child_data(data, *path):
+    """Return the descendant of the data read from the database, None if
+    it does not exist"""
+    for part in path:
+        data = data.get(part) if isinstance(data, dict) else None
+    return data
+
+
 class ShareManager(CollectionManager):
     """
     Provide a manager object that is used to access the trips database
     shared by all users
+
+    The data of the shared objects are cached for SHARE_CACHE_TTL seconds,
+    so that a QR code scanned again (e.g. by each member of a group) is
+    resolved without a request, and the concurrent resolutions of an object
+    share a single request.
     """
 
-    def __init__(self, backend):
-        """Create an instance of ShareManager"""
+    def __init__(self, backend, manifest=config.QR_MANIFEST):
+        """Create an instance of ShareManager, `manifest` being the file
+        recording the uploaded QR codes"""
         super(ShareManager, self).__init__(backend)
+        self._shared = MemoryCache(max_size=config.SHARE_CACHE_SIZE, ttl=config.SHARE_CACHE_TTL)
+        self._loading = {}
+        self._lock = threading.Lock()
+
+        # Share URL, SHA-1 and URL of the image of the QR code of each object
+        self._manifest = JsonStore(manifest) if manifest else None
+        self._manifest_lock = threading.Lock()
 
     def share_url(self, trip, destination=None, note=None):
         """Get the url for sharing the given object, e.i. trip, destination, or note"""
@@ -31,44 +99,125 @@ class ShareManager(CollectionManager):
         return config.BACKEND_URL + '/'.join(path) + '?' + query
 
     def get_by_url(self, url, validation=None):
-        """Get the object given in the URL, which is generated by 'share_url' method"""
-        r = urlparse(url)
-        if r.netloc == config.BACKEND_DOMAIN:
-            if r.query == 'trip':
-                # path to access the trip
-                _, uid, trip_id = r.path.split('/')
-                if validation is not None and validation == 'trip':
-                    return True
-
-                # Query the Trip object at given path
-                data = self.val(uid, 'trips', trip_id)
-                return Trip(_id=trip_id, **data)
-
-            elif r.query == 'destination':
-                # path to access the destination
-                _, uid, trip_id, destination_id = r.path.split('/')
-                if validation is not None and validation == 'destination':
-                    return True
-
-                # Query the Destination object at given path
-                data = self.val(uid, 'trips', trip_id,
-                                'destinations', destination_id)
-                return Destination(_id=destination_id, **data)
-
-            elif r.query == 'note':
-                # path to access the note
-                _, uid, trip_id, destination_id, note_id = r.path.split('/')
-                if validation is not None and validation == 'note':
-                    return True
-
-                # Query the Note object at given path
-                data = self.val(uid, 'trips', trip_id,
-                                'destinations', destination_id,
-                                'notes', note_id)
-                return Note(_id=note_id, **data)
-
-        raise ValueError, 'invalid url'
-
-    def upload_qrcode(self, obj_id, qr_matrix):
-        img = png_qr(qr_matrix)
-        return self.put(img, 'shared', obj_id + '.png')
+        """Get the object given in the URL, which is generated by 'share_url'
+        method, or return True if it shares an object of the kind given in
+        `validation`"""
+        kind, key = parse_share_url(url)
+        if validation is not None and validation == kind:
+            return True
+        return share_object(key, self._resolve(key))
+
+    def get_by_urls(self, urls):
+        """
+        Get the objects given in several URLs. The objects of a trip are
+        read with the trip in a single request if the trip is shared too, or
+        if several of its objects are shared. Return the list of the
+        objects, or of the exceptions raised by invalid URLs or missing
+        objects.
+        """
+        keys = []
+        for url in urls:
+            try:
+                keys.append(parse_share_url(url)[1])
+            except ValueError as e:
+                keys.append(e)
+
+        # objects which are not cached, by trip
+        trips = {}
+        for key in keys:
+            if not isinstance(key, Exception) and self._cached(key) is MISSING:
+                trips.setdefault(key[:2], set()).add(key)
+        errors = {}
+        for trip_key, shared in trips.items():
+            if len(shared) > 1 or trip_key + (None, None) in shared:
+                try:
+                    self._resolve_trip(trip_key, shared)
+                except Exception as e:
+                    errors[trip_key] = e
+
+        results = []
+        for key in keys:
+            try:
+                if isinstance(key, Exception):
+                    raise key
+                if key[:2] in errors:
+                    raise errors[key[:2]]
+                results.append(share_object(key, self._resolve(key)))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _cached(self, key):
+        with self._lock:
+            return self._shared.get(key)
+
+    def _resolve(self, key):
+        """Return the data of the shared object, read from the database if
+        it is not cached or if another thread is not already reading it"""
+        with self._lock:
+            data = self._shared.get(key)
+            if data is not MISSING:
+                return data
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+
+        if not owner:
+            return future.result()
+        try:
+            data = self.val(*share_path(key))
+            with self._lock:
+                self._shared.set(key, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+    def _resolve_trip(self, trip_key, keys):
+        """Read the trip once, and cache the data of its shared objects"""
+        trip = self._resolve(trip_key + (None, None))
+        with self._lock:
+            for key in keys:
+                self._shared.set(key, child_data(trip, *share_path(key)[3:]))
+
+    def upload_qrcode(self, obj_id, qr_matrix, url=None):
+        """
+        Upload the image of the QR code of the object, encoded once for its
+        share URL, return the URL of the image.
+
+        The uploaded codes are recorded in the manifest: the URL of the
+        image is returned without uploading it again while the share URL of
+        the object is unchanged, and a code rendered again (e.g. because
+        the share URLs have changed) is not uploaded if its image has not.
+        """
+        with self._manifest_lock:
+            entry = self._uploaded_qrcode(obj_id)
+        if entry is not None and url is not None and entry['share_url'] == url:
+            return entry['image']
+
+        img = png_qr(qr_matrix, config.QR_SCALE, config.QR_BORDER, key=url)
+        digest = hashlib.sha1(img.getvalue()).hexdigest()
+        if entry is not None and entry['digest'] == digest:
+            image = entry['image']
+        else:
+            image = self.put(img, 'shared', obj_id + '.png')
+            if not image:
+                return image
+            self.image_cache.put(image, img.getvalue())
+
+        if self._manifest is not None:
+            with self._manifest_lock:
+                self._manifest.put(obj_id, share_url=url, digest=digest, image=image)
+        return image
+
+    def _uploaded_qrcode(self, obj_id):
+        """Return the manifest entry of the QR code of the object, None if
+        it has not been uploaded"""
+        if self._manifest is None or not self._manifest.exists(obj_id):
+            return None
+        return self._manifest.get(obj_id)
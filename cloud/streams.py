@@ -0,0 +1,420 @@
+import copy
+import json
+import random
+import threading
+import time
+
+import requests
+from kivy.logger import Logger
+
+from .cache import apply_update, normalize_path
+from utils.metrics import LatencyHistogram
+
+
+def join_path(path, key):
+    """Return the path of an event, e.g. '/a/b', for a key under a path"""
+    return '/' + normalize_path(path, key)
+
+
+def relative_path(path, ancestor):
+    """Return the path relative to the ancestor, both normalized"""
+    return path[len(ancestor):].lstrip('/') if ancestor else path
+
+
+def is_under(path, ancestor):
+    """Test if the normalized path is the ancestor or one of its descendants"""
+    return path == ancestor or not ancestor or path.startswith(ancestor + '/')
+
+
+def get_node(root, path):
+    """Return the node at the normalized path under the root, None if missing"""
+    node = root
+    for key in path.split('/') if path else ():
+        node = node.get(key) if isinstance(node, dict) else None
+    return node
+
+
+def put_node(root, path, value):
+    """Return the root after replacing the node at the normalized path"""
+    if not path:
+        return value
+    return apply_update(root, {path: value})
+
+
+def is_empty(node):
+    return node is None or node == {}
+
+
+def diff(old, new, path='/'):
+    """
+    Return the list of (path, data) put events changing the node `old` into
+    `new`, a put of each changed leaf or of the subtree which appears or
+    disappears, no event if they are equal.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        puts = []
+        for key in old:
+            if key not in new and not is_empty(old[key]):
+                puts.append((join_path(path, key), None))
+        for key, value in new.items():
+            puts.extend(diff(old.get(key), value, join_path(path, key)))
+        return puts
+
+    if old == new or (is_empty(old) and is_empty(new)):
+        return []
+    return [(path, new)]
+
+
+def parse_events(chunks):
+    """Return the (event, data) of the server-sent events read from the
+    chunks of the text of a stream"""
+    pending = ''
+    event, data = None, []
+    for chunk in chunks:
+        if isinstance(chunk, bytes) and not isinstance(chunk, str):
+            chunk = chunk.decode('utf-8')
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            line = line.rstrip('\r')
+            if not line:
+                if event is not None or data:
+                    yield event or 'message', '\n'.join(data)
+                event, data = None, []
+            elif line.startswith(':'):
+                continue    # comment
+            else:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
+
+
+class Backoff(object):
+    """
+    Jittered exponential backoff: the n-th consecutive retry waits a random
+    time between 0 and min(`max_delay`, `base` * 2 ** n) seconds, so that
+    the clients disconnected at the same time do not reconnect at once.
+    """
+
+    def __init__(self, base=0.5, max_delay=30.0, random=random.random):
+        self.base = base
+        self.max_delay = max_delay
+        self.random = random
+
+    def delay(self, attempt):
+        return self.random() * min(self.max_delay, self.base * 2 ** attempt)
+
+
+class Subscription(object):
+    """
+    A listener of the events of a node, see `StreamManager.subscribe`. The
+    rate of the events and their lag, from being read off the connection to
+    the end of the call of the handler, are recorded for each subscription.
+    """
+
+    def __init__(self, manager, path, handler, initial):
+        self.path = path
+        self.handler = handler
+        self.initial = initial
+        self.active = True
+        self.events = 0
+        self.started = time.time()
+        self.lag = LatencyHistogram('stream /{} lag'.format(path))
+        self._manager = manager
+
+    @property
+    def rate(self):
+        """Number of events per second since the subscription"""
+        elapsed = time.time() - self.started
+        return self.events / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        """Stop receiving the events"""
+        self._manager.unsubscribe(self)
+
+    def report(self):
+        return '/{}: {} events, {:.2f}/s, lag mean {:.1f}ms, max {:.1f}ms'.format(
+            self.path, self.events, self.rate, self.lag.mean, self.lag.max)
+
+
+class Connection(object):
+    """
+    A stream of a node of the database, shared by the subscriptions of the
+    node and of its descendants.
+
+    The data of the node are kept up to date from the events: when the
+    connection is lost, it reconnects after a backoff delay and the new
+    snapshot of the node sent by the server is compared with them, so that
+    the subscriptions get only the changes made while disconnected.
+    """
+
+    def __init__(self, manager, path):
+        self.path = path
+        self.subscriptions = []
+        self.data = None
+        self.synced = False     # whether `data` holds the current snapshot
+        self.snapshots = 0
+        self.connected = False
+        self.reconnects = 0
+        self.events = 0
+
+        # Last data of the subscriptions moved from another connection,
+        # compared with the first snapshot of this connection
+        self.seeds = {}
+
+        self._manager = manager
+        self._closed = threading.Event()
+        self._response = None
+        self._thread = threading.Thread(target=self._run, name='stream /' + path)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        """Stop the stream, the thread ends when the blocking read returns"""
+        self._closed.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def _run(self):
+        manager = self._manager
+        session = requests.Session()
+        attempt = 0
+        while not self.closed:
+            try:
+                self._response = session.get(manager.url(self.path), stream=True,
+                                             headers={'Accept': 'text/event-stream'},
+                                             timeout=manager.timeout)
+                self._response.raise_for_status()
+                self.connected = True
+                for event, data in parse_events(self._response.iter_content(chunk_size=None)):
+                    if self.closed:
+                        break
+                    attempt = 0
+                    if not self._on_event(event, data, time.time()):
+                        break
+            except Exception as e:
+                if not self.closed:
+                    Logger.warning('Stream: /%s: %s', self.path, e)
+            finally:
+                self.connected = False
+                if self._response is not None:
+                    self._response.close()
+
+            if not self.closed:
+                # the stream ended (e.g. the network went down): resume it
+                with manager.lock:
+                    self.synced = False
+                self.reconnects += 1
+                self._closed.wait(manager.backoff.delay(attempt))
+                attempt += 1
+
+        session.close()
+
+    def _on_event(self, event, text, received):
+        """Handle an event read from the stream, return False to reconnect"""
+        if event in ('put', 'patch'):
+            message = json.loads(text)
+            with self._manager.lock:
+                if not self.closed:
+                    self.events += 1
+                    self._apply(event, normalize_path(message['path']), message['data'], received)
+        elif event == 'auth_revoked':
+            # the token has expired, reconnect with the current one
+            return False
+        elif event == 'cancel':
+            # e.g. no permission to read the node
+            Logger.warning('Stream: /%s cancelled: %s', self.path, text)
+            self._manager.unsubscribe_all(self)
+        return True
+
+    def _apply(self, event, path, data, received):
+        """Apply the event at the path relative to the node to its data and
+        deliver it to the subscriptions"""
+        if not self.synced and event == 'put' and not path:
+            self._on_snapshot(data, received)
+            return
+
+        # the nodes replaced by the event: a patch replaces each child given
+        if event == 'put':
+            replaced = [(path, data)]
+        else:
+            replaced = [(normalize_path(path, key), value) for key, value in data.items()]
+
+        deliveries = []
+        for subscription in self.subscriptions:
+            sub_path = relative_path(subscription.path, self.path)
+            if is_under(path, sub_path):
+                # the event is at or below the node of the subscription
+                deliveries.append((subscription, event, '/' + relative_path(path, sub_path), data))
+                continue
+            for node_path, value in replaced:
+                if is_under(node_path, sub_path):
+                    deliveries.append((subscription, 'put', '/' + relative_path(node_path, sub_path), value))
+                elif is_under(sub_path, node_path):
+                    # an ancestor of the node is replaced: compare the node,
+                    # which is left out of the data, with the new one
+                    deliveries.append((subscription, None, None, get_node(self.data, sub_path)))
+
+        for node_path, value in replaced:
+            self.data = put_node(self.data, node_path, copy.deepcopy(value))
+
+        for subscription, event, path, data in deliveries:
+            if event is None:
+                self._deliver_diff(subscription, data, received)
+            else:
+                self._manager.deliver(subscription, event, path, data, received)
+
+    def _on_snapshot(self, data, received):
+        """Handle the snapshot of the node sent when (re)connected"""
+        old, resumed = self.data, self.snapshots > 0
+        self.data, self.synced = copy.deepcopy(data), True
+        self.snapshots += 1
+        for subscription in self.subscriptions:
+            sub_path = relative_path(subscription.path, self.path)
+            if subscription in self.seeds:
+                self._deliver_diff(subscription, self.seeds.pop(subscription), received)
+            elif resumed:
+                self._deliver_diff(subscription, get_node(old, sub_path), received)
+            elif subscription.initial:
+                self._manager.deliver(subscription, 'put', '/', get_node(data, sub_path), received)
+
+    def _deliver_diff(self, subscription, old, received):
+        new = get_node(self.data, relative_path(subscription.path, self.path))
+        for path, data in diff(old, new):
+            self._manager.deliver(subscription, 'put', path, copy.deepcopy(data), received)
+
+
+class StreamManager(object):
+    """
+    Multiplex the listeners of the nodes of a Firebase database over a few
+    streams: the listeners of a node and of its descendants share a single
+    connection, which reconnects with a jittered exponential backoff and
+    resumes without replaying the snapshot of the node (see Connection).
+
+    The handlers are called with the events as pyrebase's Stream does, a
+    dict of the `event`, the `path` relative to the node of the listener
+    and the `data`, by the `dispatch` function, e.g. on the UI thread.
+    """
+
+    def __init__(self, database_url, token=None, dispatch=None, backoff=None, timeout=(10, 90)):
+        """`token` returns the access token of the requests, `timeout` is
+        the connect and read timeouts of the streams (Firebase sends a
+        keep-alive event every 30 seconds)"""
+        self.database_url = database_url.rstrip('/')
+        self.token = token
+        self.dispatch = dispatch or (lambda call: call())
+        self.backoff = backoff or Backoff()
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.connections = []
+
+    def url(self, path):
+        """Return the URL of the stream of the node at the path"""
+        url = '{}/{}.json'.format(self.database_url, path)
+        token = self.token() if self.token is not None else None
+        return url + '?auth=' + token if token else url
+
+    def subscribe(self, path, handler, initial=True):
+        """
+        Call the handler with the events changing the node at the path,
+        return the Subscription.
+
+        The first event holds the data of the node if `initial` is true,
+        the node is otherwise assumed to be known up to the subscription.
+        """
+        path = normalize_path(path)
+        subscription = Subscription(self, path, handler, initial)
+        with self.lock:
+            for connection in self.connections:
+                if is_under(path, connection.path):
+                    connection.subscriptions.append(subscription)
+                    if connection.synced and initial:
+                        data = get_node(connection.data, relative_path(path, connection.path))
+                        self.deliver(subscription, 'put', '/', copy.deepcopy(data), time.time())
+                    return subscription
+
+            connection = Connection(self, path)
+            connection.subscriptions.append(subscription)
+
+            # the connections of the descendants are merged into this one
+            for other in [c for c in self.connections if is_under(c.path, path)]:
+                self.connections.remove(other)
+                other.close()
+                for moved in other.subscriptions:
+                    connection.subscriptions.append(moved)
+                    if other.synced:
+                        connection.seeds[moved] = get_node(
+                            other.data, relative_path(moved.path, other.path))
+
+            self.connections.append(connection)
+        connection.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop calling the handler of the subscription, the connection is
+        closed when it has no subscription left"""
+        with self.lock:
+            subscription.active = False
+            for connection in self.connections:
+                if subscription in connection.subscriptions:
+                    connection.subscriptions.remove(subscription)
+                    connection.seeds.pop(subscription, None)
+                    if not connection.subscriptions:
+                        self.connections.remove(connection)
+                        connection.close()
+                    break
+
+    def unsubscribe_all(self, connection):
+        with self.lock:
+            for subscription in list(connection.subscriptions):
+                self.unsubscribe(subscription)
+
+    def deliver(self, subscription, event, path, data, received):
+        """Call the handler of the subscription with an event"""
+        message = {'event': event, 'path': path, 'data': data}
+
+        def call():
+            if not subscription.active:
+                return
+            subscription.events += 1
+            try:
+                subscription.handler(message)
+            except Exception:
+                Logger.exception('Stream: /%s', subscription.path)
+            subscription.lag.record(time.time() - received)
+
+        self.dispatch(call)
+
+    def close(self):
+        """Close all the streams"""
+        with self.lock:
+            connections, self.connections = self.connections, []
+            for connection in connections:
+                for subscription in connection.subscriptions:
+                    subscription.active = False
+                connection.close()
+
+    def report(self):
+        """Return the state of the streams and the rates and lags of the
+        events of the subscriptions as a text"""
+        lines = []
+        with self.lock:
+            for connection in self.connections:
+                lines.append('/{}: {}, {} events, {} reconnects'.format(
+                    connection.path, 'connected' if connection.connected else 'disconnected',
+                    connection.events, connection.reconnects))
+                lines.extend('  ' + s.report() for s in connection.subscriptions)
+        return '\n'.join(lines) or 'no streams'
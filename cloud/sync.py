@@ -0,0 +1,144 @@
+import time
+import threading
+
+from kivy.logger import Logger
+from requests.exceptions import HTTPError
+
+from .batch import WriteBatch
+
+
+class SyncWorker(object):
+    """
+    Background worker replaying the operations recorded in an OperationLog
+    to the database.
+
+    Pending operations are coalesced into a single multi-location update per
+    round, so repeated updates of the same path are only sent once. When the
+    database cannot be reached, the worker retries with an exponential
+    backoff while the operations stay in the log.
+    """
+
+    def __init__(self, log, db, token, cache, batch_size=500, max_backoff=60):
+        self._log = log
+        self._db = db
+        self._token = token
+        self._cache = cache
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._backoff = 0
+
+        # Counters
+        self.enqueued = 0       # operations recorded
+        self.synced = 0         # operations written to the database
+        self.coalesced = 0      # operations merged into another one
+        self.dropped = 0        # operations rejected by the database
+        self.requests = 0       # requests sent
+        self.failures = 0       # failed requests
+        self._sync_time = 0.0   # time spent sending requests
+
+    @property
+    def stats(self):
+        """Return the counters of the worker"""
+        return {
+            'depth': len(self._log),
+            'enqueued': self.enqueued,
+            'synced': self.synced,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'requests': self.requests,
+            'failures': self.failures,
+            'throughput': self.synced / self._sync_time if self._sync_time else 0.0,
+        }
+
+    def start(self):
+        """Start replaying operations in a background thread"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='SyncWorker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread, pending operations stay in the log"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def enqueue(self, type, path, data=None):
+        """Record a write operation ('set', 'update' or 'remove') at the path"""
+        self._log.append(type, path, data)
+        with self._cond:
+            self.enqueued += 1
+            self._backoff = 0
+            self._cond.notify_all()
+
+    def is_pending(self, path):
+        return self._log.is_pending(path)
+
+    def overlay(self, path, value):
+        return self._log.overlay(path, value)
+
+    def flush(self):
+        """Send the pending operations in one request, return the number of
+        synchronized operations"""
+        ops = self._log.pending(self.batch_size)
+        if not ops:
+            return 0
+
+        batch = WriteBatch(self._db, self._token, None)
+        for _, type, path, data in ops:
+            if type == 'remove':
+                batch.remove(path)
+            else:
+                getattr(batch, type)(path, data)
+
+        paths = len(batch)
+        start = time.time()
+        self.requests += 1
+        try:
+            batch.commit()
+        except HTTPError as e:
+            if not str(e.args[0]).startswith('400'):
+                raise
+            # the database rejects the data, retrying would not help
+            Logger.exception('SyncWorker: drop %d operations', len(ops))
+            for _, type, path, data in ops:
+                self._cache.invalidate(path)
+            self.dropped += len(ops)
+            self._log.ack(ops[-1][0])
+            return 0
+        finally:
+            self._sync_time += time.time() - start
+
+        self._log.ack(ops[-1][0])
+        self.synced += len(ops)
+        self.coalesced += len(ops) - paths
+        return len(ops)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not len(self._log):
+                    self._cond.wait()
+                if not self._running:
+                    return
+
+            try:
+                self.flush()
+                self._backoff = 0
+            except Exception as e:
+                self.failures += 1
+                self._backoff = min(max(1, self._backoff * 2), self.max_backoff)
+                Logger.info('SyncWorker: %s, retry in %ds', str(e), self._backoff)
+                with self._cond:
+                    if self._running:
+                        self._cond.wait(self._backoff)
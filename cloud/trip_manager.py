@@ -1,9 +1,11 @@
-import os
+import io
 
-from .base import UserCollectionManager
+import config
+from .base import UserCollectionManager, ConflictError
 from kivy.logger import Logger
 
 from models.trip import Trip,  Destination, Note, Spent
+from utils.images import prepare_image
 
 
 def path_destinations(trip):
@@ -16,109 +18,360 @@ def path_destination(trip, destination):
     return "{}/destinations/{}".format(trip._id, destination._id)
 
 
+def trip_header(trip):
+    """Return the data of the trip shown in the trip list, i.e. the trip
+    without its destinations"""
+    return trip.attrs
+
+
+def upload_note_images(manager, uploads, progress=None):
+    """
+    Upload the photos of several notes at once with the manager, `uploads`
+    being a list of (note, file path) pairs. Each photo is downscaled and
+    uploaded with its thumbnail (see prepare_image).
+
+    The image and the thumbnail of the notes whose uploads succeeded are
+    set and written to the image cache, then the error of the first failed upload is raised, if any.
+    """
+    images = [prepare_image(file_path) for _, file_path in uploads]
+    files = []
+    for (note, _), image in zip(uploads, images):
+        files.append((io.BytesIO(image.image.data), (note._id + image.image.ext,)))
+        if image.thumbnail is not None:
+            files.append((io.BytesIO(image.thumbnail.data), (note._id + '_thumb' + image.thumbnail.ext,)))
+    results = iter(manager.put_files(files, config.UPLOAD_CHUNK_SIZE, progress))
+
+    errors = []
+    for (note, _), image in zip(uploads, images):
+        thumbnail = image.thumbnail or image.image
+        urls = [next(results) for _ in range(1 if image.thumbnail is None else 2)]
+        failed = [url for url in urls if isinstance(url, Exception)]
+        if failed:
+            errors.extend(failed)
+            continue
+
+        note.set(image=urls[0], thumbnail=urls[-1])
+        # the photo is shown from the cache without being downloaded back
+        manager.image_cache.put(note.image, image.image.data)
+        if image.thumbnail is not None:
+            manager.image_cache.put(note.thumbnail, image.thumbnail.data)
+        Logger.info('upload_image: %s: %d bytes uploaded instead of %d, preview of %d bytes instead of %d',
+                    note._id, len(image.image.data) + (len(thumbnail.data) if image.thumbnail else 0),
+                    image.original_size, len(thumbnail.data), image.original_size)
+    if errors:
+        raise errors[0]
+
+
 class TripManager(UserCollectionManager):
     """
     Provide a manager object that is used to access the trips database
+
+    The header of each trip, i.e. the trip without its destinations, is
+    also saved under "trip_headers", so that the trip list is loaded without
+    downloading the destinations of every trip.
     """
 
     def __init__(self, backend):
         """Create a manager to access the trips list of the authenticated user"""
         super(TripManager, self).__init__(backend, "trips")
+        self._headers = UserCollectionManager(backend, "trip_headers")
+        self._active = UserCollectionManager(backend, "active_trip")
+
+        # ETag of the header of the trips read to be edited, by trip id,
+        # until they are saved (see update_trip)
+        self._etags = {}
 
     def get_user_trips(self):
-        """Return all trips created by the authenticated user"""
-        trips = []
-        for item in self.list():
+        """Yield the trips created by the authenticated user, each trip
+        being built as soon as its data has been downloaded"""
+        for key, value in self.iter_children():
             try:
-                trip = Trip(**item.val())
-                trip._id = item.key()
-                trips.append(trip)
+                yield Trip.from_dict(value, key)
             except Exception:
                 Logger.exception("get_user_trips")
 
-        return trips
+    def get_trips_page(self, start_after=None, page_size=config.TRIPS_PAGE_SIZE):
+        """
+        Return a page of the trips created by the authenticated user, newest
+        first and without their destinations (see `load_destinations`), and
+        the key to pass as `start_after` to get the next page, None if this
+        is the last page.
+        """
+        keys = [key for key in reversed(self.keys())
+                if start_after is None or key < start_after]
+        page = keys[:page_size]
+        if not page:
+            return [], None
+
+        headers = dict((item.key(), item.val())
+                       for item in self._headers.list_page(len(page), min(page)))
 
-    def add_trip(self, trip):
+        trips = []
+        for key in page:
+            try:
+                header = headers.get(key)
+                if header is None:
+                    header = self._backfill_header(key)
+                trips.append(Trip(_id=key, **header))
+            except Exception:
+                Logger.exception("get_trips_page")
+
+        return trips, (page[-1] if len(keys) > page_size else None)
+
+    def _backfill_header(self, key):
+        """Save the header of a trip created before the headers were saved"""
+        header = trip_header(Trip(**self.val(key)))
+        self._headers.set(header, key)
+        return header
+
+    def get_active_trip(self):
+        """Return the trip set as active (without its destinations), None
+        if no trip is active"""
+        key = self._active.val()
+        if key is None:
+            return None
+
+        header = self._read_header(key)
+        if header is None:
+            header = self._backfill_header(key)
+        return Trip(_id=key, **header)
+
+    def _read_header(self, key):
+        """Return the header of the trip, keeping its ETag to check that it
+        has not been changed by another device when it is saved"""
+        header, etag = self._headers.val_with_etag(key)
+        if etag is not None:
+            self._etags[key] = etag
+        else:
+            self._etags.pop(key, None)
+        return header
+
+    def read_header(self, trip):
+        """Read the header of the listed trip again before it is edited,
+        see update_trip"""
+        header = self._read_header(trip._id)
+        if header is not None:
+            trip.set(**header)
+        return trip
+
+    def load_destinations(self, trip):
+        """Load the destinations of a trip listed without them"""
+        if trip._destinations is None:
+            trip._destinations = list(self.trip_destinations(trip))
+        return trip._destinations
+
+    def add_trip(self, trip, batch=None):
         """Create a new node for the given trip created by the authenticated user"""
-        # Create new data node under "trips" path
-        trip._id = self.push(trip.attrs)
+        commit = batch is None
+        if commit:
+            batch = self.batch()
+
+        # Create new data node under "trips" path, and its header
+        trip._id = self.push(trip.attrs, batch=batch)
+        self._headers.set(trip_header(trip), trip._id, batch=batch)
+
+        if commit:
+            batch.commit()
         return trip
 
-    def update_trip(self, trip, full_data=False):
-        """Update data of the trip"""
+    def update_trip(self, trip, full_data=False, batch=None, check=False):
+        """
+        Update data of the trip. With `check`, the trip is only written if
+        its header has not been changed by another device since it was read
+        (see read_header and get_active_trip): otherwise a ConflictError is
+        raised and the trip gets the header saved by the other device.
+
+        The header cannot be checked if it has writes which have not been
+        synchronized yet, if the device is offline, or if it was not read
+        with its ETag: the trip is then written as without `check`.
+        """
+        if check:
+            self._check_header(trip)
+
+        commit = batch is None
+        if commit:
+            batch = self.batch()
+
+        self._headers.update(trip_header(trip), trip._id, batch=batch)
         attrs = trip.full_data() if full_data else trip.attrs
-        self.update(attrs, trip._id)
+        self.update(attrs, trip._id, batch=batch)
 
-    def delete_trip(self, trip):
+        if commit:
+            batch.commit()
+
+    def _check_header(self, trip):
+        """Raise a ConflictError if the header of the trip has been changed
+        since it was read, see update_trip"""
+        etag = self._etags.pop(trip._id, None)
+        if etag is None:
+            Logger.info("update_trip: %s is written without check, its header was not read", trip._id)
+            return
+        try:
+            self._headers.check_unchanged(etag, trip._id)
+        except ConflictError as e:
+            if e.etag:
+                self._etags[trip._id] = e.etag
+            if e.value is not None:
+                trip.set(**e.value)
+            raise
+
+    def delete_trip(self, trip, batch=None):
         """Remove the trip"""
-        self.remove(trip._id)
+        commit = batch is None
+        if commit:
+            batch = self.batch()
+
+        self.remove(trip._id, batch=batch)
+        self._headers.remove(trip._id, batch=batch)
 
-    def set_active_trip(self, trip, active=True):
+        if commit:
+            batch.commit()
+
+    def set_active_trip(self, trip, active=True, batch=None):
         """Set the trip as active"""
+        commit = batch is None
+        if commit:
+            batch = self.batch()
+
         trip.set(active=active)
-        self.update({'active': active}, trip._id)
+        self.update({'active': active}, trip._id, batch=batch)
+        self._headers.update({'active': active}, trip._id, batch=batch)
+        if active:
+            self._active.set(trip._id, batch=batch)
+        else:
+            self._active.remove(batch=batch)
 
-    def trip_destinations(self, trip):
-        """Get destinations of the given trip"""
+        if commit:
+            batch.commit()
 
-        destinations = []
-        for item in self.list(path_destinations(trip)):
+    def trip_destinations(self, trip):
+        """Yield the destinations of the given trip, each destination being
+        built as soon as its data has been downloaded"""
+        for key, value in self.iter_children(path_destinations(trip)):
             try:
-                dest = Destination(**item.val())
-                dest._id = item.key()
-                destinations.append(dest)
+                yield Destination.from_dict(value, key)
             except Exception:
                 Logger.exception("trip_destinations")
 
-        return destinations
-
-    def add_destination(self, trip, destination):
+    def add_destination(self, trip, destination, batch=None):
         """Add a new destination for the given trip"""
-        destination._id = self.push(destination.attrs, path_destinations(trip))
+        destination._id = self.push(destination.attrs, path_destinations(trip), batch=batch)
         return destination
 
-    def update_destination(self, trip, destination):
+    def update_destination(self, trip, destination, batch=None):
         """Update the destination for the given trip"""
-        self.update(destination.attrs, path_destination(trip, destination))
+        self.update(destination.attrs, path_destination(trip, destination), batch=batch)
+
+    def delete_destination(self, trip, destination, batch=None):
+        """Remove the destination from the given trip, and its spents from
+        the budget of the trip"""
+        commit = batch is None
+        if commit:
+            batch = self.batch()
 
-    def delete_destination(self, trip, destination):
-        """Remove the destination from the given trip"""
-        self.remove(path_destination(trip, destination))
+        loaded = destination._trip is trip
+        if loaded:
+            trip.remove_destination(destination)
+        try:
+            self.remove(path_destination(trip, destination), batch=batch)
+            if destination.budget:
+                self.update({'budget': trip.budget}, trip._id, batch=batch)
+                self._headers.update({'budget': trip.budget}, trip._id, batch=batch)
+            if commit:
+                batch.commit()
+        except Exception:
+            if loaded:
+                trip.add_destination(destination)
+            raise
 
-    def add_note(self, trip, destination, note):
+    def add_note(self, trip, destination, note, batch=None):
         """Add a note to the destination"""
-        note._id = self.push(note.attrs, trip._id, 'destinations',
-                             destination._id, 'notes')
+        destination.add_note(note)
+        try:
+            note._id = self.push(note.attrs, trip._id, 'destinations',
+                                 destination._id, 'notes', batch=batch)
+        except Exception:
+            destination.remove_note(note)
+            raise
 
-    def remove_note(self, trip, destination, note):
+    def remove_note(self, trip, destination, note, batch=None):
         """Remove the note"""
-        self.remove(trip._id, 'destinations', destination._id,
-                    'notes', note._id)
+        destination.remove_note(note)
+        try:
+            self.remove(trip._id, 'destinations', destination._id,
+                        'notes', note._id, batch=batch)
+        except Exception:
+            destination.add_note(note)
+            raise
 
-    def update_note(self, trip, destination, note):
+    def update_note(self, trip, destination, note, batch=None):
         """Update note's picture"""
         self.update(note.attrs, trip._id,
                     'destinations', destination._id,
-                    'notes', note._id)
+                    'notes', note._id, batch=batch)
 
-    def upload_image(self, note, file_path):
-        """Upload images for a note"""
-        _, ext = os.path.splitext(file_path)
-        return self.put(file_path, note._id + ext)
+    def upload_image(self, note, file_path, progress=None):
+        """Upload images for a note, see `upload_note_images`"""
+        upload_note_images(self, [(note, file_path)], progress)
+        return note.image
 
-    def add_spent(self, trip, destination, spent):
+    def upload_images(self, uploads, progress=None):
+        """Upload the images of several notes at once, see `upload_note_images`"""
+        upload_note_images(self, uploads, progress)
+
+    def _save_budget(self, trip, destination, batch):
+        """Save the budgets of the destination and of the trip"""
+        self.update({'budget': destination.budget}, path_destination(trip, destination), batch=batch)
+        self.update({'budget': trip.budget}, trip._id, batch=batch)
+        self._headers.update({'budget': trip.budget}, trip._id, batch=batch)
+
+    def _change_spent(self, trip, destination, write, undo, batch):
+        """Write a spent changed in the destination, with the budgets updated
+        by its amount, undo the change of the models if the write fails"""
+        commit = batch is None
+        if commit:
+            batch = self.batch()
+
+        try:
+            write(batch)
+            self._save_budget(trip, destination, batch)
+            if commit:
+                batch.commit()
+        except Exception:
+            undo()
+            raise
+
+    def add_spent(self, trip, destination, spent, batch=None):
         """Add a spent to the destination"""
-        spent._id = self.push(spent.attrs, trip._id, 'destinations',
-                              destination._id, 'spents')
+        destination.add_spent(spent)
+
+        def write(batch):
+            spent._id = self.push(spent.attrs, trip._id, 'destinations',
+                                  destination._id, 'spents', batch=batch)
+
+        self._change_spent(trip, destination, write, lambda: destination.remove_spent(spent), batch)
 
-    def remove_spent(self, trip, destination, spent):
+    def remove_spent(self, trip, destination, spent, batch=None):
         """Remove the spent"""
-        self.remove(trip._id,
-                    'destinations', destination._id,
-                    'spents', spent._id)
+        destination.remove_spent(spent)
 
-    def update_spent(self, trip, destination, spent):
-        """Update spent"""
-        self.update(spent.attrs, trip._id,
-                    'destinations', destination._id,
-                    'spents', spent._id)
+        def write(batch):
+            self.remove(trip._id,
+                        'destinations', destination._id,
+                        'spents', spent._id, batch=batch)
+
+        self._change_spent(trip, destination, write, lambda: destination.add_spent(spent), batch)
+
+    def update_spent(self, trip, destination, spent, amount=None, batch=None):
+        """Update spent, with its new amount if given"""
+        previous = spent.spent
+        if amount is not None:
+            destination.update_spent(spent, amount)
+
+        def write(batch):
+            self.update(spent.attrs, trip._id,
+                        'destinations', destination._id,
+                        'spents', spent._id, batch=batch)
+
+        self._change_spent(trip, destination, write,
+                           lambda: destination.update_spent(spent, previous), batch)
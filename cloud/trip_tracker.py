@@ -1,10 +1,9 @@
 from .base import UserCollectionManager
+from .trip_manager import upload_note_images
 from kivy.logger import Logger
 
 from models.trip import Trip,  Destination, Note, Spent
 
-import os
-
 
 class TripTracker(UserCollectionManager):
     """
@@ -14,10 +13,10 @@ class TripTracker(UserCollectionManager):
     def __init__(self, backend):
         super(TripTracker, self).__init__(backend, 'active')
 
-    def start_trip(self, trip):
+    def start_trip(self, trip, batch=None):
         """Set the given trip as active"""
         data = trip.full_data()
-        self.set(data)
+        self.set(data, batch=batch)
         return Trip(**data)
 
     def get_active_trip(self):
@@ -28,38 +27,38 @@ class TripTracker(UserCollectionManager):
         else:
             return None
 
-    def update_destination(self, destination):
+    def update_destination(self, destination, batch=None):
         """Update the destination to the active trip"""
-        self.update(destination.attrs, 'destinations', destination._id)
+        self.update(destination.attrs, 'destinations', destination._id, batch=batch)
 
-    def add_note(self, destination, note):
+    def add_note(self, destination, note, batch=None):
         """Add a note to the destination"""
-        note._id = self.push(note.attrs, 'destinations', destination._id, 'notes')
+        note._id = self.push(note.attrs, 'destinations', destination._id, 'notes', batch=batch)
 
-    def remove_note(self, destination, note):
+    def remove_note(self, destination, note, batch=None):
         """Remove the note"""
-        self.remove('destinations', destination._id, 'notes', note._id)
+        self.remove('destinations', destination._id, 'notes', note._id, batch=batch)
 
-    def update_note(self, destination, note):
+    def update_note(self, destination, note, batch=None):
         """Update note's picture"""
-        self.update(note.attrs, 'destinations', destination._id, 'notes', note._id)
+        self.update(note.attrs, 'destinations', destination._id, 'notes', note._id, batch=batch)
 
-    def upload_image(self, note, file_path):
-        """Upload images for a note"""
-        _, ext = os.path.splitext(file_path)
-        return self.put(file_path, note._id + ext)
+    def upload_image(self, note, file_path, progress=None):
+        """Upload images for a note, see `upload_note_images`"""
+        upload_note_images(self, [(note, file_path)], progress)
+        return note.image
 
-    def add_spent(self, destination, spent):
+    def add_spent(self, destination, spent, batch=None):
         """Add a spent to the destination"""
-        spent._id = self.push(spent.attrs, 'destinations', destination._id, 'spents')
+        spent._id = self.push(spent.attrs, 'destinations', destination._id, 'spents', batch=batch)
 
-    def remove_spent(self, destination, spent):
+    def remove_spent(self, destination, spent, batch=None):
         """Remove the spent"""
-        self.remove('destinations', destination._id, 'spents', spent._id)
+        self.remove('destinations', destination._id, 'spents', spent._id, batch=batch)
 
-    def update_spent(self, destination, spent):
+    def update_spent(self, destination, spent, batch=None):
         """Update spent"""
-        self.update(spent.attrs, 'destinations', destination._id, 'spents', spent._id)
+        self.update(spent.attrs, 'destinations', destination._id, 'spents', spent._id, batch=batch)
 
 
 
@@ -93,6 +92,18 @@ class TripTracker(UserCollectionManager):
 
         return destinations
 
-    def add_destination(self, destination):
+    def finish_trip(self, trip_manager, trip, batch=None):
+        """Save the full data of the active trip to the user's trips and stop
+        tracking it, in a single request"""
+        commit = batch is None
+        if commit:
+            batch = self.batch()
+        trip_manager.set_active_trip(trip, active=False, batch=batch)
+        trip_manager.update_trip(trip, full_data=True, batch=batch)
+        self.remove(batch=batch)
+        if commit:
+            batch.commit()
+
+    def add_destination(self, destination, batch=None):
         """Add a destination to the active trip"""
-        self.set(destination.attrs, 'destinations/' + str(destination._id))
+        self.set(destination.attrs, 'destinations/' + str(destination._id), batch=batch)
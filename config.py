@@ -25,3 +25,60 @@ FIREBASE = {
     "databaseURL": "https://online-travel-bd8d2.firebaseio.com",
     "storageBucket": "online-travel-bd8d2.appspot.com",
 }
+
+# Local cache of the data read from the Firebase database: maximum number of
+# cached nodes and the time (in seconds) a cached node is considered valid
+CACHE_SIZE = 256
+CACHE_TTL = 300
+
+# File to persist the cached nodes between sessions, None to only cache in memory
+CACHE_FILE = None
+
+# File logging the writes to the Firebase database which are synchronized in
+# background, so that the app can be used offline. None to write immediately
+SYNC_LOG = "onlinetravel.oplog.json"
+
+# Number of threads sending requests to the backend out of the UI thread
+BACKEND_WORKERS = 4
+
+# HTTP connections kept alive for the Firebase requests: number of hosts,
+# and number of connections by host (the backend workers and the sync worker)
+HTTP_POOL_HOSTS = 4
+HTTP_POOL_SIZE = BACKEND_WORKERS + 1
+
+# Number of trips loaded at once in the trip list
+TRIPS_PAGE_SIZE = 20
+
+# Uploads of the note images: files larger than the chunk size are sent in
+# chunks which are retried on failure, and several images are uploaded at
+# once by this number of threads
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_WORKERS = 3
+
+# Photos of the notes are downscaled to this maximum width/height (pixels)
+# and recompressed with this JPEG quality before their upload, with a
+# thumbnail shown in place of the photo in the views
+IMAGE_MAX_SIZE = 1600
+IMAGE_QUALITY = 85
+THUMBNAIL_SIZE = 480
+
+# Directory caching the images downloaded from Firebase Storage (photos of
+# the notes and QR codes), the maximum size of its files in bytes and the
+# time (in seconds) after which an image is downloaded again
+IMAGE_CACHE_DIR = "onlinetravel.images"
+IMAGE_CACHE_SIZE = 50 * 1024 * 1024
+IMAGE_CACHE_TTL = 7 * 24 * 3600
+
+# Number of shared trips, destinations and notes resolved from their share
+# URL which are kept in memory, and the time (in seconds) they are kept
+SHARE_CACHE_SIZE = 64
+SHARE_CACHE_TTL = 300
+
+# Images of the shared QR codes: pixels by module, and modules of the quiet
+# zone around the code
+QR_SCALE = 8
+QR_BORDER = 4
+
+# File recording the QR codes uploaded to the storage, so that the code of
+# an object is uploaded once. None to upload a code each time it is shared
+QR_MANIFEST = "onlinetravel.qrcodes.json"
@@ -5,7 +5,9 @@ from kivy.logger import Logger
 from kivy.properties import ObjectProperty, ListProperty, StringProperty
 
 import cloud
+from cloud.live import Change, LiveTrip, REMOVED
 from models.trip import Trip, Destination
+from utils.metrics import PhaseTimer
 
 from ui.popup import Alert, ConfirmPopup
 
@@ -15,7 +17,7 @@ from ui.home import Home
 from ui.trip_manager import TripManager
 from ui.destination_manager import DestinationManager
 from ui.destination_editor import DestinationEditor
-from ui.destination_notes import DestinationNotes
+from ui.destination_notes import DestinationNotes, prefetch_images
 from ui.destination_spents import DestinationSpents
 
 
@@ -31,9 +33,12 @@ class MainApp(App):
     # The destination that is being tracked
     tracked_destination = ObjectProperty(None, baseclass=Destination, allownone=True)
 
-    # List of trips created by the user
+    # List of trips created by the user, loaded page by page
     trips = ListProperty()
 
+    # Key to load the next page of trips, None if all trips are loaded
+    trips_cursor = StringProperty(None, allownone=True)
+
     # The trip that is being updated
     trip = ObjectProperty(None, baseclass=Trip, allownone=True)
 
@@ -49,6 +54,16 @@ class MainApp(App):
     def __init__(self, **kwargs):
         super(MainApp, self).__init__(kv_directory="ui", **kwargs)
 
+        # Time of the phases of the start up, None once reported
+        self.startup = PhaseTimer('Cold start')
+
+        # The active trip read from the server, which may not be in the
+        # loaded pages of the trip list
+        self._active_header = None
+
+        # Stream keeping the active trip in sync with the server
+        self.live_trip = None
+
     def build(self):
         """
         Build the application by adding all the screens required by
@@ -68,13 +83,29 @@ class MainApp(App):
                             DestinationManager, DestinationEditor,
                             DestinationNotes, DestinationSpents)
 
-        # Detect login session
-        try:
-            self.backend.auto_login()
-            self.show(Home, True)
-        except Exception as e:
-            Logger.info('auto_login: %s', str(e))
+        # Restore the login session and show the trips saved on the device
+        # at once, the requests to the server are then run concurrently
+        with self.startup.phase('restore session'):
+            restored = self.backend.restore_session()
+
+        if not restored:
+            self.startup = None
             sm.show(Login)
+            return
+
+        with self.startup.phase('cached snapshot'):
+            self.trips = [Trip(**data) for data in self.backend.snapshot() or []]
+            self.active_trip = self._find_active_trip()
+        self.show(Home, True)
+
+        # validate the token while the user data are loaded
+        self.backend.run(self.startup_phase('token validation', self.backend.validate_token),
+                         on_success=self.startup_done,
+                         on_error=self.session_error)
+        self.backend.run(self.startup_phase('account lookup', self.backend.lookup_account),
+                         on_success=self.check_account,
+                         on_error=self.session_error)
+        self.backend.authenticated = True
 
     def on_pause(self):
         return True
@@ -82,6 +113,19 @@ class MainApp(App):
     def on_resume(self):
         pass
 
+    def on_stop(self):
+        """Report the time spent on backend calls and stop the workers"""
+        if self.live_trip is not None:
+            self.live_trip.close()
+        if self.backend.streams is not None:
+            Logger.info('Streams:\n%s', self.backend.streams.report())
+        Logger.info('Backend latency:\n%s', self.backend.executor.report())
+        Logger.info('Backend: %s', self.backend.connection_stats.report())
+        Logger.info('Backend: %s', self.backend.image_cache.report())
+        self.backend.image_cache.sync()
+        self.backend.executor.shutdown()
+        self.backend.uploads.shutdown(wait=False)
+
     def current_screen(self):
         """Return the current screen from the screen manager"""
         return self.root.ids.sm.current_screen
@@ -107,18 +151,131 @@ class MainApp(App):
         if authenticated:
             trip_manager = self.backend.trip_manager
 
-            try:
-                self.trips = trip_manager.get_user_trips()
-                for trip in self.trips:
-                    if trip.active:
-                        self.active_trip = trip
-                        break
-
-            except Exception as e:
-                Logger.exception('load_user_data')
+            def load_trips():
+                trips, cursor = trip_manager.get_trips_page()
+                self.backend.save_snapshot(trips)
+                return trips, cursor
+
+            # the first page of trips and the active trip are requested concurrently
+            self.backend.run(self.startup_phase('trips', load_trips),
+                             on_success=self.set_trips,
+                             on_error=self.session_error)
+            self.backend.run(self.startup_phase('active trip', trip_manager.get_active_trip),
+                             on_success=self.set_active_header,
+                             on_error=self.session_error)
         else:
+            self._active_header = None
             self.trips = []
+            self.trips_cursor = None
+            self.active_trip = None
+
+    def set_trips(self, page):
+        """Show the first page of trips, and the active one on the Home screen"""
+        self.trips, self.trips_cursor = page
+        self.active_trip = self._find_active_trip()
+        self.startup_done()
+
+    def load_more_trips(self):
+        """Append the next page of trips to the trip list"""
+        cursor, self.trips_cursor = self.trips_cursor, None
+
+        def on_success(page):
+            trips, self.trips_cursor = page
+            self.trips.extend(trips)
+            self.active_trip = self._find_active_trip()
+
+        def on_error(error):
+            self.trips_cursor = cursor
+            Alert(title="Trips", text=str(error))
+
+        self.backend.run(self.backend.trip_manager.get_trips_page, cursor,
+                         on_success=on_success, on_error=on_error)
+
+    def set_active_header(self, trip):
+        """Show the active trip before its page of the trip list is loaded"""
+        self._active_header = trip
+        self.active_trip = self._find_active_trip()
+        self.startup_done()
+
+    def _find_active_trip(self):
+        """Return the trip of the list which is active, or the active trip
+        read from the server if its page is not loaded"""
+        header = self._active_header
+        for trip in self.trips:
+            if header is not None and trip._id == header._id:
+                return trip
+        for trip in self.trips:
+            if trip.active:
+                return trip
+        return header
+
+    def on_tracked_destination(self, instance, destination):
+        """Download the images of the notes of the tracked destination
+        while its screen is shown"""
+        if destination is not None:
+            prefetch_images(destination)
+
+    def on_active_trip(self, instance, trip):
+        """Follow the changes of the active trip made on every device"""
+        if self.live_trip is not None:
+            if self.live_trip.trip is trip:
+                return
+            self.live_trip.close()
+            self.live_trip = None
+
+        if trip is not None and trip._id is not None and self.backend.authenticated:
+            self.live_trip = LiveTrip(self.backend.trip_manager, trip)
+            self.live_trip.bind(self.on_trip_changes)
+
+    def on_trip_changes(self, changes):
+        """Show the changes of the active trip made on other devices"""
+        trip = self.active_trip
+        if Change((), REMOVED) in changes or not trip.active:
+            # finished or deleted
             self.active_trip = None
+            return
+
+        self.property('active_trip').dispatch(self)
+        if self.trip is trip and any(len(change.path) <= 2 for change in changes):
+            self.destinations = sorted(trip._destinations or [])
+        self.current_screen().on_trip_changes(changes)
+
+    def check_account(self, uid):
+        """Sign out if the token belongs to another account"""
+        self.startup_done()
+        if uid != self.backend.uid:
+            self.session_expired()
+
+    def session_error(self, error):
+        """Sign out if the request is rejected because the saved session
+        has expired, other errors (e.g. offline) keep the shown data"""
+        self.startup_done()
+        message = str(error.args[0] if error.args else error)
+        if message[:3] in ('400', '401', '403'):
+            self.session_expired()
+        else:
+            Logger.info('load_user_data: %s', message)
+
+    def session_expired(self):
+        """Go back to the Login screen"""
+        if not self.backend.authenticated:
+            return  # already signed out
+
+        self.backend.sign_out()
+        self.screen_manager.show(Login, True)
+        Alert(title="Login", text="Your session has expired, please login again.")
+
+    def startup_phase(self, phase, function):
+        """Record the time of the function as a phase of the start up"""
+        if self.startup is None:
+            return function
+        return self.startup.wrap(phase, function)
+
+    def startup_done(self, *args):
+        """Report the time of the start up phases once they are all done"""
+        if self.startup is not None and self.startup.finished:
+            Logger.info('Startup: %s', self.startup.report())
+            self.startup = None
 
     def sign_out(self):
         """Clear the login session"""
@@ -137,6 +294,17 @@ class MainApp(App):
         self.destinations = trip._destinations if trip and trip._destinations else []
         self.destinations.sort()
 
+        if trip is not None and trip._destinations is None:
+            # the trip is listed without its destinations, load them now
+            def on_success(destinations):
+                if self.trip is trip:
+                    self.destinations = sorted(destinations)
+                    self.current_screen().reload()
+
+            self.backend.run(self.backend.trip_manager.load_destinations, trip,
+                             on_success=on_success,
+                             on_error=lambda e: Alert(title=trip.name, text=str(e)))
+
 
 if __name__ == '__main__':
     # Run the app
@@ -1,23 +1,159 @@
+class LazyChildren(object):
+    """
+    Descriptor of a list of child models (e.g. the destinations of a trip)
+    which keeps the raw data of the children, a dict of their data by their
+    ids, and builds the model objects on first access.
+    """
+
+    def __init__(self, name, factory, parent=None, on_set=None):
+        """Create the descriptor of the children given in the `name` argument
+        of `set`, `factory` returns the model class of the children.
+
+        The children get a reference to the model object in their `parent`
+        attribute, if given. `on_set` is called with the model object when a
+        list of children objects is assigned"""
+        self.name = name
+        self.factory = factory
+        self.parent = parent
+        self.on_set = on_set
+        self._raw = '_raw_' + name
+        self._items = '_items_' + name
+
+    def _link(self, obj, items):
+        if self.parent is not None:
+            for item in items:
+                setattr(item, self.parent, obj)
+
+    @property
+    def slots(self):
+        """Names of the slots storing the children in the model object"""
+        return self._raw, self._items
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+
+        items = getattr(obj, self._items)
+        if items is None:
+            raw = getattr(obj, self._raw)
+            if raw is None:
+                return None
+            model = self.factory()
+            items = [model.from_dict(val, key) for key, val in raw.iteritems()]
+            self._link(obj, items)
+            setattr(obj, self._raw, None)
+            setattr(obj, self._items, items)
+        return items
+
+    def __set__(self, obj, items):
+        setattr(obj, self._raw, None)
+        setattr(obj, self._items, items)
+        if items is not None:
+            self._link(obj, items)
+        if self.on_set is not None:
+            self.on_set(obj)
+
+    def load(self, obj, raw):
+        """Replace the children by the given raw data"""
+        setattr(obj, self._items, None)
+        setattr(obj, self._raw, raw)
+
+    def raw(self, obj):
+        """Return the raw data of the children, None if the objects have
+        been built"""
+        return getattr(obj, self._raw)
+
+
+def _compile(source, name):
+    """Return the function defined in the source code"""
+    namespace = {}
+    exec source in namespace
+    return namespace[name]
+
+
+class ModelMeta(type):
+    """
+    Metaclass building the schema of a model class from the names of the
+    fields listed in its FIELDS attribute, in addition to the fields of its
+    base classes. The fields, the children (see LazyChildren) and the
+    private attributes listed in SLOTS are stored in slots instead of a
+    __dict__.
+
+    Like namedtuple, the functions copying the fields from/to a dict are
+    generated for each class, which saves looping over the field names.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        fields = tuple(namespace.get('FIELDS', ()))
+        if '__slots__' not in namespace:
+            children = [value for value in namespace.values() if isinstance(value, LazyChildren)]
+            namespace['__slots__'] = (fields + tuple(namespace.get('SLOTS', ())) +
+                                      tuple(slot for c in children for slot in c.slots))
+
+        cls = super(ModelMeta, mcs).__new__(mcs, name, bases, namespace)
+
+        # the fields of the schema, in the order of the class hierarchy
+        cls._fields = getattr(cls, '_fields', ()) + fields
+        cls._field_set = frozenset(cls._fields)
+
+        cls._assign = _compile('def _assign(self, data):\n'
+                               '    get = data.get\n' +
+                               ''.join('    self.{0} = get({0!r})\n'.format(f) for f in cls._fields),
+                               '_assign')
+        cls.to_dict = _compile('def to_dict(self):\n'
+                               '    """Return the fields which are set, to be saved to the database"""\n'
+                               '    data = {}\n' +
+                               ''.join('    value = self.{0}\n'
+                                       '    if value is not None: data[{0!r}] = value\n'.format(f)
+                                       for f in cls._fields) +
+                               '    return data\n', 'to_dict')
+        return cls
+
 
 class ModelBase(object):
     """Base class for all model objects"""
 
+    __metaclass__ = ModelMeta
+    __slots__ = ('_id',)
+
+    # Names of the fields saved to the database, a field which is not set
+    # is None and is not saved
+    FIELDS = ()
+
     def __init__(self, **kwargs):
         """Create an object with an id/key"""
         self._id = kwargs.get('_id', None)
-        self.set(**kwargs)
+        self._assign(kwargs)
+        self.set_children(kwargs)
+
+    @classmethod
+    def from_dict(cls, data, _id=None):
+        """Create an object from the data read from the database"""
+        obj = cls.__new__(cls)
+        obj._id = _id
+        obj._assign(data)
+        obj.set_children(data)
+        return obj
 
     def set(self, **kwargs):
+        """Set the fields given in the arguments, other arguments are ignored"""
+        fields = self._field_set
+        for name, value in kwargs.iteritems():
+            if name in fields:
+                setattr(self, name, value)
+        self.set_children(kwargs)
+
+    def set_children(self, data):
+        """Set the children given in the data, implemented by the models
+        which have children"""
         pass
 
     def __getattr__(self, name):
-        """Return an attribute of this object, None if the attribute does not exist"""
-        try:
-            return self.__dict__[name]
-        except KeyError:
-            return None
+        """Return None for an attribute which is not set"""
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
 
     @property
     def attrs(self):
-        return dict((k, v) for k, v in self.__dict__.iteritems()
-                    if not k.startswith('_'))
+        return self.to_dict()
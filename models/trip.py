@@ -1,40 +1,120 @@
-from base import ModelBase
+from base import ModelBase, LazyChildren
 
 
 TRANSPORTATIONS = ['plane', 'train', 'ship', 'bus', 'car',
                    'motorcycle', 'bicycle', 'taxi', 'subway', 'walk']
 
 
+def raw_spents_budget(spents):
+    """Return the total of the raw data of spents"""
+    return sum(spent.get('spent') or 0 for spent in spents.itervalues())
+
+
+def raw_destination_budget(destination):
+    """Return the budget of the raw data of a destination"""
+    if 'spents' in destination:
+        return raw_spents_budget(destination['spents'] or {})
+    return destination.get('budget') or 0
+
+
+def add_to(totals, key, amount):
+    """Add the amount to the total of the key, dropping the totals of 0"""
+    total = totals.get(key, 0) + amount
+    if total:
+        totals[key] = total
+    else:
+        totals.pop(key, None)
+
+
 class Trip(ModelBase):
-    """Represent data of a trip"""
+    """
+    Represent data of a trip
 
-    def set(self, **kwargs):
-        """Set data of a trip given its name, budget and stay days"""
-        super(Trip, self).set(**kwargs)
+    The budget of the trip, i.e. the total of the spents of its destinations,
+    and its rollups by day and by transportation of the destinations are
+    running totals: a spent added, updated or removed through its destination
+    (see Destination.add_spent) adds the difference to them.
+    """
 
-        if 'name' in kwargs: self.name = kwargs['name']
-        if 'days' in kwargs: self.days = kwargs['days']
-        if 'active' in kwargs: self.active = kwargs['active']
+    FIELDS = ('name', 'days', 'active', 'budget')
+    SLOTS = ('_budget_by_day', '_budget_by_transportation')
 
-        if 'destinations' in kwargs:
-            self._destinations = [Destination(_id=key, **val)
-                                  for key, val in kwargs['destinations'].iteritems()]
-            self.calculate_budget()
+    # Destination objects are built from the raw data on first access
+    _destinations = LazyChildren('destinations', lambda: Destination, parent='_trip',
+                                 on_set=lambda trip: trip.rollup_budget())
+
+    def set_children(self, data):
+        """Set the destinations of the trip, and its budget"""
+        if 'destinations' in data:
+            destinations = data['destinations']
+            Trip._destinations.load(self, destinations)
+
+            self._reset_budget()
+            for destination in destinations.itervalues():
+                self._add_budget(destination.get('day'), destination.get('transportation'),
+                                 raw_destination_budget(destination))
 
     def full_data(self, with_id=True):
         data = dict(**self.attrs)
         if with_id:
             data['_id'] = self._id
-        if self._destinations:
-            data['destinations'] = dict((d._id, d.full_data(with_id=False)) for d in self._destinations)
+        destinations = Trip._destinations.raw(self)
+        if destinations is None and self._destinations:
+            destinations = dict((d._id, d.full_data(with_id=False)) for d in self._destinations)
+        if destinations:
+            data['destinations'] = destinations
         return data
 
-    def calculate_budget(self):
-        """Recalculate budget base on actual spents"""
+    def add_destination(self, destination):
+        """Add a destination to the trip, and its spents to the budget"""
+        if self._destinations is None:
+            self._destinations = []
+        self._destinations.append(destination)
+        destination._trip = self
+        self._add_budget(destination.day, destination.transportation, destination.budget or 0)
+
+    def remove_destination(self, destination):
+        """Remove a destination from the trip, and its spents from the budget"""
+        self._destinations.remove(destination)
+        destination._trip = None
+        self._add_budget(destination.day, destination.transportation, -(destination.budget or 0))
+
+    @property
+    def budget_by_day(self):
+        """Return the total of the spents by day"""
+        return dict(self._budget_by_day or {})
+
+    @property
+    def budget_by_transportation(self):
+        """Return the total of the spents by transportation"""
+        return dict(self._budget_by_transportation or {})
+
+    def _reset_budget(self):
         self.budget = 0
+        self._budget_by_day = {}
+        self._budget_by_transportation = {}
+
+    def _add_budget(self, day, transportation, amount):
+        """Add an amount spent at a destination to the running totals"""
+        if self._budget_by_day is None:
+            self._reset_budget()
+        self.budget = (self.budget or 0) + amount
+        add_to(self._budget_by_day, day, amount)
+        add_to(self._budget_by_transportation, transportation, amount)
+
+    def rollup_budget(self):
+        """Compute the running totals from the budgets of the destinations"""
+        if self._destinations is None:
+            return
+        self._reset_budget()
         for destination in self._destinations:
+            self._add_budget(destination.day, destination.transportation, destination.budget or 0)
+
+    def calculate_budget(self):
+        """Recalculate budget base on actual spents"""
+        for destination in self._destinations or []:
             destination.calculate_budget()
-            self.budget += destination.budget
+        self.rollup_budget()
 
     def __str__(self):
         return self.name + ", stays: " + str(self.days)
@@ -43,59 +123,99 @@ class Trip(ModelBase):
 class Place(ModelBase):
     """Wrapper for data of a place returned by Google Places API"""
 
-    def set(self, **kwargs):
-        """Set a place data with provided data"""
-        super(Place, self).set(**kwargs)
-
-        if 'address' in kwargs: self.address = kwargs['address']
-        if 'attributions' in kwargs: self.attributions = kwargs['attributions']
-        if 'id' in kwargs: self.id = kwargs['id']
-        if 'latitude' in kwargs: self.latitude = kwargs['latitude']
-        if 'longitude' in kwargs: self.longitude = kwargs['longitude']
-        if 'name' in kwargs: self.name = kwargs['name']
-        if 'phone_number' in kwargs: self.phone_number = kwargs['phone_number']
-        if 'place_types' in kwargs: self.place_types = kwargs['place_types']
-        if 'price_level' in kwargs: self.price_level = kwargs['price_level']
-        if 'rating' in kwargs: self.rating = kwargs['rating']
-        if 'website_uri' in kwargs: self.website_uri = kwargs['website_uri']
+    FIELDS = ('address', 'attributions', 'id', 'latitude', 'longitude', 'name',
+              'phone_number', 'place_types', 'price_level', 'rating', 'website_uri')
 
 
 class Destination(Place):
     """Represent data of a destination, e.g. a place to visit/stay, in a trip"""
 
-    def set(self, **kwargs):
-        """Set a destination given its name, budget and stay days"""
-        super(Destination, self).set(**kwargs)
+    FIELDS = ('day', 'time', 'transportation', 'budget')
+
+    # The trip of the destination, if it is in the destinations of a trip
+    SLOTS = ('_trip',)
 
-        if 'day' in kwargs: self.day = kwargs['day']
-        if 'time' in kwargs: self.time = kwargs['time']
-        if 'transportation' in kwargs: self.transportation = kwargs['transportation']
+    # Note and Spent objects are built from the raw data on first access
+    _notes = LazyChildren('notes', lambda: Note)
+    _spents = LazyChildren('spents', lambda: Spent,
+                           on_set=lambda destination: destination.calculate_budget())
 
-        if 'notes' in kwargs:
-            self._notes = [Note(_id=key, **val)
-                           for key, val in kwargs['notes'].iteritems()]
+    def set(self, **kwargs):
+        """Set data of the destination, and move its budget to its new day
+        or transportation in the rollups of its trip"""
+        day, transportation = self.day, self.transportation
+        super(Destination, self).set(**kwargs)
 
-        if 'spents' in kwargs:
-            self._spents = [Spent(_id=key, **val)
-                           for key, val in kwargs['spents'].iteritems()]
-            self.calculate_budget()
+        trip = self._trip
+        if trip is not None and trip._budget_by_day is not None and \
+                (self.day != day or self.transportation != transportation):
+            trip._add_budget(day, transportation, -(self.budget or 0))
+            trip._add_budget(self.day, self.transportation, self.budget or 0)
+
+    def set_children(self, data):
+        """Set the notes and spents of the destination, and its budget"""
+        if 'notes' in data:
+            Destination._notes.load(self, data['notes'])
+
+        if 'spents' in data:
+            Destination._spents.load(self, data['spents'])
+            self._add_budget(raw_spents_budget(data['spents'] or {}) - (self.budget or 0))
+
+    def add_note(self, note):
+        """Add a note to the destination"""
+        if self._notes is None:
+            self._notes = []
+        self._notes.append(note)
+
+    def remove_note(self, note):
+        """Remove a note from the destination"""
+        self._notes.remove(note)
+
+    def add_spent(self, spent):
+        """Add a spent to the destination, and its amount to the budgets"""
+        if self._spents is None:
+            self._spents = []
+        self._spents.append(spent)
+        self._add_budget(spent.spent or 0)
+
+    def remove_spent(self, spent):
+        """Remove a spent from the destination, and its amount from the budgets"""
+        self._spents.remove(spent)
+        self._add_budget(-(spent.spent or 0))
+
+    def update_spent(self, spent, amount):
+        """Change the amount of a spent of the destination, and the budgets"""
+        delta = (amount or 0) - (spent.spent or 0)
+        spent.set(spent=amount)
+        self._add_budget(delta)
+
+    def _add_budget(self, amount):
+        """Add an amount to the budget of the destination and of its trip"""
+        self.budget = (self.budget or 0) + amount
+        trip = self._trip
+        if trip is not None and trip._budget_by_day is not None:
+            trip._add_budget(self.day, self.transportation, amount)
 
     def full_data(self, with_id=True):
         data = dict(**self.attrs)
         if with_id:
             data['_id'] = self._id
-        if self._notes:
-            data['notes'] = dict((d._id, d.attrs) for d in self._notes)
-        if self._spents:
-            data['spents'] = dict((d._id, d.attrs) for d in self._spents)
+        notes = Destination._notes.raw(self)
+        if notes is None and self._notes:
+            notes = dict((d._id, d.attrs) for d in self._notes)
+        if notes:
+            data['notes'] = notes
+        spents = Destination._spents.raw(self)
+        if spents is None and self._spents:
+            spents = dict((d._id, d.attrs) for d in self._spents)
+        if spents:
+            data['spents'] = spents
         return data
 
     def calculate_budget(self):
         """Recalculate budget base on actual spents"""
-        self.budget = 0
-        if self._spents:
-            for spent in self._spents:
-                self.budget += spent.spent
+        budget = sum(spent.spent or 0 for spent in self._spents or [])
+        self._add_budget(budget - (self.budget or 0))
 
     def __cmp__(self, other):
         """Compare this destination with the other by the the time order"""
@@ -112,20 +232,43 @@ class Destination(Place):
 class Note(ModelBase):
     """Represent a note for a trip's destination"""
 
-    def set(self, **kwargs):
-        """Create a note given its content"""
-        super(Note, self).set(**kwargs)
-
-        if 'content' in kwargs: self.content = kwargs['content']
-        if 'image' in kwargs: self.image = kwargs['image']
+    FIELDS = ('content', 'image', 'thumbnail')
 
 
 class Spent(ModelBase):
     """Represent a spent for a trip's destination"""
 
-    def set(self, **kwargs):
-        """Create a spent given its content"""
-        super(Spent, self).set(**kwargs)
-
-        if 'content' in kwargs: self.content = kwargs['content']
-        if 'spent' in kwargs: self.spent = kwargs['spent']
+    FIELDS = ('content', 'spent')
+
+
+def compute_budget(trip):
+    """Return the budget of the trip, and its totals by destination, by day
+    and by transportation, computed from all the spents"""
+    budget, by_destination, by_day, by_transportation = 0, {}, {}, {}
+    for destination in trip._destinations or []:
+        amount = sum(spent.spent or 0 for spent in destination._spents or [])
+        budget += amount
+        add_to(by_destination, destination._id, amount)
+        add_to(by_day, destination.day, amount)
+        add_to(by_transportation, destination.transportation, amount)
+    return budget, by_destination, by_day, by_transportation
+
+
+def budget_errors(trip):
+    """Check the running totals of the budget of the trip against the totals
+    computed from all the spents, return the differences found"""
+    budget, by_destination, by_day, by_transportation = compute_budget(trip)
+
+    errors = []
+    if (trip.budget or 0) != budget:
+        errors.append('trip budget {} != {}'.format(trip.budget, budget))
+    for destination in trip._destinations or []:
+        if (destination.budget or 0) != by_destination.get(destination._id, 0):
+            errors.append('destination {} budget {} != {}'.format(
+                destination._id, destination.budget, by_destination.get(destination._id, 0)))
+    if trip.budget_by_day != by_day:
+        errors.append('budget by day {} != {}'.format(trip.budget_by_day, by_day))
+    if trip.budget_by_transportation != by_transportation:
+        errors.append('budget by transportation {} != {}'.format(
+            trip.budget_by_transportation, by_transportation))
+    return errors
@@ -170,10 +170,30 @@ try:
 except ImportError:
     pass
 
+try:
+    # If NumPy is installed, the encoder filters the scanlines with
+    # operations on whole rows (see `filter_scanline`).
+    import numpy
+except ImportError:
+    numpy = None
+
 
-__all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array']
+__all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array',
+           'ADAPTIVE', 'IdatStream', 'Z_FILTERED', 'Z_HUFFMAN_ONLY', 'Z_RLE',
+           'Z_FIXED']
 
 
+# zlib compression strategies (the constants of the zlib module, which
+# does not define all of them in Python 2).
+Z_FILTERED = 1
+Z_HUFFMAN_ONLY = 2
+Z_RLE = 3
+Z_FIXED = 4
+
+# zlib's default memory level, the argument of `zlib.compressobj`
+# preceding the strategy.
+DEF_MEM_LEVEL = 8
+
 # The PNG signature.
 # http://www.w3.org/TR/PNG/#5PNG-file-signature
 _signature = struct.pack('8B', 137, 80, 78, 71, 13, 10, 26, 10)
@@ -194,7 +214,10 @@ def isarray(x):
     return isinstance(x, array)
 
 def tostring(row):
-    return row.tostring()
+    try:
+        return row.tobytes()
+    except AttributeError:
+        return row.tostring()
 
 def interleave_planes(ipixels, apixels, ipsize, apsize):
     """
@@ -340,7 +363,10 @@ class Writer:
                  chunk_limit=2**20,
                  x_pixels_per_unit = None,
                  y_pixels_per_unit = None,
-                 unit_is_meter = False):
+                 unit_is_meter = False,
+                 filter_type=None,
+                 strategy=None,
+                 idat_size=2**16):
         """
         Create a PNG encoder object.
 
@@ -367,10 +393,15 @@ class Writer:
         compression
           zlib compression level: 0 (none) to 9 (more compressed);
           default: -1 or None.
+        strategy
+          zlib compression strategy, e.g. :data:`Z_RLE`; default:
+          ``Z_DEFAULT_STRATEGY`` or None.
         interlace
           Create an interlaced image.
         chunk_limit
           Write multiple ``IDAT`` chunks to save memory.
+        idat_size
+          Size in bytes of the ``IDAT`` chunks.
         x_pixels_per_unit
           Number of pixels a unit along the x axis (write a
           `pHYs` chunk).
@@ -468,8 +499,24 @@ class Writer:
           to be processed in working memory.
 
         `chunk_limit` is used to limit the amount of memory used whilst
-        compressing the image.  In order to avoid using large amounts of
-        memory, multiple ``IDAT`` chunks may be created.
+        compressing the image: the rows are compressed by batches of
+        about `chunk_limit` bytes as they are supplied, and the compressed
+        data is written in ``IDAT`` chunks of `idat_size` bytes (the last
+        one may be smaller), so that the memory used does not depend on
+        the height of the image.
+
+        `strategy` tunes the zlib compression to the data: ``Z_FILTERED``
+        for filtered scanlines (see `filter_type`), ``Z_RLE`` for images
+        made of long runs of the same bytes, which is much faster than the
+        default strategy but does not find repeated rows,
+        ``Z_HUFFMAN_ONLY`` for data which cannot be compressed otherwise.
+
+        `filter_type` specifies the filter applied to each scanline before
+        compression: a filter type from 0 (none, the default) to 4, or
+        ``'adaptive'`` (:data:`ADAPTIVE`) to choose the filter of each
+        scanline by the minimum sum of absolute differences heuristic,
+        which usually produces the smallest images.  The scanlines of an
+        interlaced image are not filtered.
         """
 
         # At the moment the `planes` argument is ignored;
@@ -493,6 +540,10 @@ class Writer:
             raise ValueError(
                 "transparent colour not allowed with alpha channel")
 
+        if filter_type not in (None, ADAPTIVE) + FILTER_TYPES:
+            raise ValueError(
+                "filter_type must be 0 to 4 or %r" % ADAPTIVE)
+
         if bytes_per_sample is not None:
             warnings.warn('please use bitdepth instead of bytes_per_sample',
                           DeprecationWarning)
@@ -568,6 +619,9 @@ class Writer:
         self.x_pixels_per_unit = x_pixels_per_unit
         self.y_pixels_per_unit = y_pixels_per_unit
         self.unit_is_meter = bool(unit_is_meter)
+        self.filter_type = filter_type
+        self.strategy = strategy
+        self.idat_size = idat_size
 
         self.color_type = 4*self.alpha + 2*(not greyscale) + 1*self.colormap
         assert self.color_type in (0,2,3,4,6)
@@ -700,10 +754,8 @@ class Writer:
             write_chunk(outfile, b'pHYs', struct.pack("!LLB",*tup))
 
         # http://www.w3.org/TR/PNG/#11IDAT
-        if self.compression is not None:
-            compressor = zlib.compressobj(self.compression)
-        else:
-            compressor = zlib.compressobj()
+        idat = IdatStream(outfile, self.idat_size, self.compression,
+                          self.strategy)
 
         # Choose an extend function based on the bitdepth.  The extend
         # function packs/decomposes the pixel values into bytes and
@@ -748,7 +800,23 @@ class Writer:
         enumrows = enumerate(rows)
         del rows
 
+        # The scanlines of an interlaced image are not filtered, as we do
+        # not mark the first row of a reduced pass image; that means we
+        # could accidentally compute the wrong filtered scanline if we
+        # used "up", "average", or "paeth" on such a line.
+        filter_row = None
+        if self.filter_type and not self.interlace:
+            # Filter offset: the size of a pixel in bytes, at least 1.
+            fo = max(1, self.bitdepth * self.planes // 8)
+            if self.filter_type == ADAPTIVE:
+                filter_row = lambda line, prev: adaptive_filter(line, fo, prev)
+            else:
+                filter_row = lambda line, prev, type=self.filter_type: \
+                    filter_scanline(type, line, fo, prev)
+        prev = None
+
         # First row's filter type.
+        start = len(data)
         data.append(0)
         # :todo: Certain exceptions in the call to ``.next()`` or the
         # following try would indicate no row data supplied.
@@ -767,31 +835,33 @@ class Writer:
             extend = wrapmapint(extend)
             del wrapmapint
             extend(row)
+        if filter_row is not None:
+            # Replace the scanline by its filtered form.
+            prev = data[start+1:]
+            del data[start:]
+            data.extend(filter_row(prev, None))
 
         for i,row in enumrows:
-            # Add "None" filter type.  Currently, it's essential that
-            # this filter type be used for every scanline as we do not
-            # mark the first row of a reduced pass image; that means we
-            # could accidentally compute the wrong filtered scanline if
-            # we used "up", "average", or "paeth" on such a line.
+            # Add "None" filter type, the scanline is filtered once its
+            # bytes have been packed.
+            start = len(data)
             data.append(0)
             extend(row)
+            if filter_row is not None:
+                line = data[start+1:]
+                del data[start:]
+                data.extend(filter_row(line, prev))
+                prev = line
             if len(data) > self.chunk_limit:
-                compressed = compressor.compress(tostring(data))
-                if len(compressed):
-                    write_chunk(outfile, b'IDAT', compressed)
+                idat.write(tostring(data))
                 # Because of our very witty definition of ``extend``,
                 # above, we must re-use the same ``data`` object.  Hence
                 # we use ``del`` to empty this one, rather than create a
                 # fresh one (which would be my natural FP instinct).
                 del data[:]
         if len(data):
-            compressed = compressor.compress(tostring(data))
-        else:
-            compressed = b''
-        flushed = compressor.flush()
-        if len(compressed) or len(flushed):
-            write_chunk(outfile, b'IDAT', compressed + flushed)
+            idat.write(tostring(data))
+        idat.close()
         # http://www.w3.org/TR/PNG/#11IEND
         write_chunk(outfile, b'IEND')
         return i+1
@@ -955,6 +1025,42 @@ def write_chunk(outfile, tag, data=b''):
     checksum &= 2**32-1
     outfile.write(struct.pack("!I", checksum))
 
+class IdatStream:
+    """
+    File-like object compressing the scanlines written to it into
+    ``IDAT`` chunks of `size` bytes written to the output file as soon as
+    they are full, so that at most one chunk of compressed data is kept
+    in memory.  `level` and `strategy` are the zlib compression level
+    and strategy, None for the defaults.  :meth:`close` writes the last
+    chunk.
+    """
+
+    def __init__(self, outfile, size=2**16, level=None, strategy=None):
+        self.outfile = outfile
+        self.size = size
+        self.compressor = zlib.compressobj(
+            -1 if level is None else level, zlib.DEFLATED, zlib.MAX_WBITS,
+            DEF_MEM_LEVEL,
+            zlib.Z_DEFAULT_STRATEGY if strategy is None else strategy)
+        self.buffer = bytearray()
+        self.chunks = 0
+
+    def write(self, data):
+        self.buffer.extend(self.compressor.compress(data))
+        while len(self.buffer) >= self.size:
+            self.write_chunk(bytes(self.buffer[:self.size]))
+            del self.buffer[:self.size]
+
+    def write_chunk(self, data):
+        write_chunk(self.outfile, b'IDAT', data)
+        self.chunks += 1
+
+    def close(self):
+        self.buffer.extend(self.compressor.flush())
+        for i in range(0, len(self.buffer), self.size):
+            self.write_chunk(bytes(self.buffer[i:i+self.size]))
+        del self.buffer[:]
+
 def write_chunks(out, chunks):
     """Create a PNG file by writing out the chunks."""
 
@@ -962,6 +1068,101 @@ def write_chunks(out, chunks):
     for chunk in chunks:
         write_chunk(out, *chunk)
 
+# Filter types of the scanlines: none, sub, up, average and paeth.
+# http://www.w3.org/TR/PNG/#9Filter-types
+FILTER_TYPES = (0, 1, 2, 3, 4)
+
+# Filter type of :class:`Writer` choosing the filter of each scanline
+ADAPTIVE = 'adaptive'
+
+# Absolute value of each byte taken as a signed byte, the cost of a
+# filtered byte in the minimum sum of absolute differences heuristic
+_signed_abs = [min(x, 256 - x) for x in range(256)]
+
+def _shift(line, fo):
+    """Return the bytes at `fo` bytes on the left of each byte of the
+    line, 0 for the first pixel"""
+    left = array('B', [0]*min(fo, len(line)))
+    left.extend(line[:len(line) - len(left)])
+    return left
+
+def _python_filter(type, line, fo, prev):
+    """Return the bytes of the scanline filtered with the filter type,
+    as a list of bytes or as the line itself for the type 0"""
+    if type == 0:
+        return line
+    if type == 2:
+        return [(x - b) & 0xff for x, b in zip(line, prev)]
+    left = _shift(line, fo)
+    if type == 1:
+        return [(x - a) & 0xff for x, a in zip(line, left)]
+    if type == 3:
+        return [(x - ((a + b) >> 1)) & 0xff
+                for x, a, b in zip(line, left, prev)]
+
+    # http://www.w3.org/TR/PNG/#9Filter-type-4-Paeth
+    out = []
+    append = out.append
+    for x, a, b, c in zip(line, left, prev, _shift(prev, fo)):
+        p = a + b - c
+        pa = abs(p - a)
+        pb = abs(p - b)
+        pc = abs(p - c)
+        if pa <= pb and pa <= pc:
+            append((x - a) & 0xff)
+        elif pb <= pc:
+            append((x - b) & 0xff)
+        else:
+            append((x - c) & 0xff)
+    return out
+
+def _numpy_line(line):
+    """Return the scanline as a NumPy array of 16-bit integers"""
+    if isarray(line) and line.typecode == 'B':
+        line = numpy.frombuffer(tostring(line), dtype=numpy.uint8)
+    return numpy.array(line, dtype=numpy.int16)
+
+def _numpy_filter(type, line, fo, prev):
+    """Same as `_python_filter` on whole rows at once, `line` and `prev`
+    being NumPy arrays of 16-bit integers. Return an array of bytes"""
+    if type == 0:
+        filtered = line
+    elif type == 2:
+        filtered = line - prev
+    else:
+        left = numpy.zeros_like(line)
+        left[fo:] = line[:-fo]
+        if type == 1:
+            filtered = line - left
+        elif type == 3:
+            filtered = line - ((left + prev) >> 1)
+        else:
+            upleft = numpy.zeros_like(prev)
+            upleft[fo:] = prev[:-fo]
+            p = left + prev - upleft
+            pa = numpy.abs(p - left)
+            pb = numpy.abs(p - prev)
+            pc = numpy.abs(p - upleft)
+            filtered = line - numpy.where((pa <= pb) & (pa <= pc), left,
+                                          numpy.where(pb <= pc, prev, upleft))
+    return (filtered & 0xff).astype(numpy.uint8)
+
+def _first_line(type, line, fo, prev):
+    """Return the filter type and previous line to use for the scanline,
+    which is the first one if `prev` is empty"""
+    if prev:
+        return type, prev
+    # We're on the first line.  Some of the filters can be reduced
+    # to simpler cases which makes handling the line "off the top"
+    # of the image simpler.  "up" becomes "none"; "paeth" becomes
+    # "left" (non-trivial, but true). "average" needs to be handled
+    # specially.
+    if type == 2: # "up"
+        type = 0
+    elif type == 4: # "paeth"
+        type = 1
+    return type, array('B', [0]*len(line))
+
 def filter_scanline(type, line, fo, prev=None):
     """Apply a scanline filter to a scanline.  `type` specifies the
     filter type (0 to 4); `line` specifies the current (unfiltered)
@@ -970,82 +1171,51 @@ def filter_scanline(type, line, fo, prev=None):
     filter offset; normally this is size of a pixel in bytes (the number
     of bytes per sample times the number of channels), but when this is
     < 1 (for bit depths < 8) then the filter offset is 1.
+
+    The filters are computed on whole rows by NumPy if it is installed.
     """
 
     assert 0 <= type < 5
 
-    # The output array.  Which, pathetically, we extend one-byte at a
-    # time (fortunately this is linear).
+    type, prev = _first_line(type, line, fo, prev)
     out = array('B', [type])
+    if numpy is not None and type != 0:
+        out.extend(array('B', tostring(_numpy_filter(
+            type, _numpy_line(line), fo, _numpy_line(prev)))))
+    else:
+        out.extend(_python_filter(type, line, fo, prev))
+    return out
 
-    def sub():
-        ai = -fo
-        for x in line:
-            if ai >= 0:
-                x = (x - line[ai]) & 0xff
-            out.append(x)
-            ai += 1
-    def up():
-        for i,x in enumerate(line):
-            x = (x - prev[i]) & 0xff
-            out.append(x)
-    def average():
-        ai = -fo
-        for i,x in enumerate(line):
-            if ai >= 0:
-                x = (x - ((line[ai] + prev[i]) >> 1)) & 0xff
-            else:
-                x = (x - (prev[i] >> 1)) & 0xff
-            out.append(x)
-            ai += 1
-    def paeth():
-        # http://www.w3.org/TR/PNG/#9Filter-type-4-Paeth
-        ai = -fo # also used for ci
-        for i,x in enumerate(line):
-            a = 0
-            b = prev[i]
-            c = 0
-
-            if ai >= 0:
-                a = line[ai]
-                c = prev[ai]
-            p = a + b - c
-            pa = abs(p - a)
-            pb = abs(p - b)
-            pc = abs(p - c)
-            if pa <= pb and pa <= pc:
-                Pr = a
-            elif pb <= pc:
-                Pr = b
-            else:
-                Pr = c
-
-            x = (x - Pr) & 0xff
-            out.append(x)
-            ai += 1
-
-    if not prev:
-        # We're on the first line.  Some of the filters can be reduced
-        # to simpler cases which makes handling the line "off the top"
-        # of the image simpler.  "up" becomes "none"; "paeth" becomes
-        # "left" (non-trivial, but true). "average" needs to be handled
-        # specially.
-        if type == 2: # "up"
-            type = 0
-        elif type == 3:
-            prev = [0]*len(line)
-        elif type == 4: # "paeth"
-            type = 1
-    if type == 0:
-        out.extend(line)
-    elif type == 1:
-        sub()
-    elif type == 2:
-        up()
-    elif type == 3:
-        average()
-    else: # type == 4
-        paeth()
+def adaptive_filter(line, fo, prev=None):
+    """Filter the scanline with the filter type giving the minimum sum
+    of the absolute values of the filtered bytes taken as signed bytes,
+    which usually compresses best.  Return the filtered scanline
+    including its filter type, see :func:`filter_scanline`.
+    """
+
+    candidates = FILTER_TYPES if prev else (0, 1, 3)
+    if numpy is not None:
+        current = _numpy_line(line)
+        previous = _numpy_line(prev) if prev else numpy.zeros_like(current)
+        best = None
+        for type in candidates:
+            filtered = _numpy_filter(type, current, fo, previous)
+            cost = numpy.abs(filtered.view(numpy.int8).astype(numpy.int32)).sum()
+            if best is None or cost < best[0]:
+                best = (cost, type, filtered)
+        out = array('B', [best[1]])
+        out.extend(array('B', tostring(best[2])))
+        return out
+
+    best = None
+    previous = prev or array('B', [0]*len(line))
+    for type in candidates:
+        filtered = _python_filter(type, line, fo, previous)
+        cost = sum(map(_signed_abs.__getitem__, filtered))
+        if best is None or cost < best[0]:
+            best = (cost, type, filtered)
+    out = array('B', [best[1]])
+    out.extend(best[2])
     return out
 
 
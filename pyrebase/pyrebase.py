@@ -4,10 +4,15 @@ try:
     from urllib.parse import urlencode, quote
 except:
     from urllib import urlencode, quote
+import codecs
 import json
-import math
-from random import uniform
+import mimetypes
+import os
+import re
+from json.decoder import scanstring
+from random import randrange
 import time
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
 from sseclient import SSEClient
 import threading
@@ -16,10 +21,88 @@ from oauth2client.service_account import ServiceAccountCredentials
 from gcloud import storage
 
 
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+# Size of the chunks read from the responses downloaded incrementally
+CHUNK_SIZE = 64 * 1024
+
+# Resumable uploads to Firebase Storage: the chunks are multiples of the
+# granularity, and a chunk is retried this number of times
+UPLOAD_GRANULARITY = 256 * 1024
+UPLOAD_CHUNK_SIZE = 4 * UPLOAD_GRANULARITY
+UPLOAD_RETRIES = 3
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Rank of the types of the values in Firebase's order: null, booleans
+# (false then true), numbers, strings, then objects
+VALUE_RANKS = {type(None): 0, bool: 1, int: 3, float: 3, str: 4}
+try:
+    VALUE_RANKS.update({long: 3, unicode: 4})
+except NameError:
+    pass
+
+# Characters used in push keys, in their lexicographic order
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+
 def initialize_app(config):
     return Firebase(config)
 
 
+class ConnectionStats(object):
+    """Counters of the connections opened by a session, and of the requests
+    sent on them: the requests which did not open a connection reused one
+    kept alive in the pool"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @property
+    def reused(self):
+        return max(0, self.requests - self.opened)
+
+    def report(self):
+        return 'HTTP connections: {} requests, {} connections opened, {} reused'.format(
+            self.requests, self.opened, self.reused)
+
+
+class PooledAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter keeping the connections alive in a pool by host, which
+    counts the connections it opens and the requests in a ConnectionStats"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        def counted(pool_class):
+            def _new_conn(pool):
+                stats.count('opened')
+                return pool_class._new_conn(pool)
+            return type('Counted' + pool_class.__name__, (pool_class,), {'_new_conn': _new_conn})
+
+        classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = dict(
+            (scheme, counted(pool_class)) for scheme, pool_class in classes.items())
+
+    def send(self, request, **kwargs):
+        self.stats.count('requests')
+        return super(PooledAdapter, self).send(request, **kwargs)
+
+
 class Firebase():
     """ Firebase Interface """
     def __init__(self, config):
@@ -38,8 +121,18 @@ class Firebase():
             ]
             self.credentials = ServiceAccountCredentials.from_json_keyfile_name(config["serviceAccount"], scopes)
             self.access_token = self.credentials.get_access_token()
+        # One session shared by the auth, database and storage requests, so
+        # that the connections are kept alive and reused: "poolConnections"
+        # is the number of hosts whose connections are kept, "poolMaxsize"
+        # the number of connections kept by host, which is a hard limit
+        # if "poolBlock" is true
+        self.connection_stats = ConnectionStats()
         self.requests = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=3)
+        adapter = PooledAdapter(self.connection_stats,
+                                pool_connections=config.get("poolConnections", 10),
+                                pool_maxsize=config.get("poolMaxsize", 10),
+                                pool_block=config.get("poolBlock", False),
+                                max_retries=config.get("maxRetries", 3))
         for scheme in ('http://', 'https://'):
             self.requests.mount(scheme, adapter)
 
@@ -64,7 +157,7 @@ class Auth():
         request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/verifyPassword?key={0}".format(self.api_key)
         headers = {"content-type": "application/json; charset=UTF-8"}
         data = json.dumps({"email": email, "password": password, "returnSecureToken": True})
-        request_object = requests.post(request_ref, headers=headers, data=data)
+        request_object = self.requests.post(request_ref, headers=headers, data=data)
         request_object.raise_for_status()
         self.current_user = request_object.json()
         return request_object.json()
@@ -73,7 +166,7 @@ class Auth():
         request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/getAccountInfo?key={0}".format(self.api_key)
         headers = {"content-type": "application/json; charset=UTF-8"}
         data = json.dumps({"idToken": id_token})
-        request_object = requests.post(request_ref, headers=headers, data=data)
+        request_object = self.requests.post(request_ref, headers=headers, data=data)
         request_object.raise_for_status()
         return request_object.json()
 
@@ -81,7 +174,7 @@ class Auth():
         request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/getOobConfirmationCode?key={0}".format(self.api_key)
         headers = {"content-type": "application/json; charset=UTF-8"}
         data = json.dumps({"requestType": "VERIFY_EMAIL", "idToken": id_token})
-        request_object = requests.post(request_ref, headers=headers, data=data)
+        request_object = self.requests.post(request_ref, headers=headers, data=data)
         request_object.raise_for_status()
         return request_object.json()
 
@@ -89,7 +182,7 @@ class Auth():
         request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/getOobConfirmationCode?key={0}".format(self.api_key)
         headers = {"content-type": "application/json; charset=UTF-8"}
         data = json.dumps({"requestType": "PASSWORD_RESET", "email": email})
-        request_object = requests.post(request_ref, headers=headers, data=data)
+        request_object = self.requests.post(request_ref, headers=headers, data=data)
         request_object.raise_for_status()
         return request_object.json()
 
@@ -97,7 +190,7 @@ class Auth():
         request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/resetPassword?key={0}".format(self.api_key)
         headers = {"content-type": "application/json; charset=UTF-8"}
         data = json.dumps({"oobCode": reset_code, "newPassword": new_password})
-        request_object = requests.post(request_ref, headers=headers, data=data)
+        request_object = self.requests.post(request_ref, headers=headers, data=data)
         request_object.raise_for_status()
         return request_object.json()
 
@@ -105,13 +198,18 @@ class Auth():
         request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/signupNewUser?key={0}".format(self.api_key)
         headers = {"content-type": "application/json; charset=UTF-8" }
         data = json.dumps({"email": email, "password": password, "returnSecureToken": True})
-        request_object = requests.post(request_ref, headers=headers, data=data)
+        request_object = self.requests.post(request_ref, headers=headers, data=data)
         request_object.raise_for_status()
         return request_object.json()
 
 
 class Database():
-    """ Database Interface """
+    """ Database Interface
+
+    The queries are built with immutable Reference objects returned by
+    `child` and the query methods, so that the database object can be
+    shared by the threads sending requests concurrently.
+    """
     def __init__(self, access_token, api_key, database_url, requests):
 
         if not database_url.endswith('/'):
@@ -124,172 +222,262 @@ class Database():
         self.database_url = url
         self.requests = requests
 
-        self.path = ""
-        self.build_query = {}
         self.last_push_time = 0
         self.last_rand_chars = []
+        self.key_lock = threading.Lock()
+
+        self.root = Reference(self)
+
+    def child(self, *args):
+        return self.root.child(*args)
 
     def order_by_child(self, order):
-        self.build_query["orderBy"] = order
-        return self
+        return self.root.order_by_child(order)
 
     def start_at(self, start):
-        self.build_query["startAt"] = start
-        return self
+        return self.root.start_at(start)
 
     def end_at(self, end):
-        self.build_query["endAt"] = end
-        return self
+        return self.root.end_at(end)
 
     def equal_to(self, equal):
-        self.build_query["equalTo"] = equal
-        return self
+        return self.root.equal_to(equal)
 
     def limit_to_first(self, limit_first):
-        self.build_query["limitToFirst"] = limit_first
-        return self
+        return self.root.limit_to_first(limit_first)
 
     def limit_to_last(self, limit_last):
-        self.build_query["limitToLast"] = limit_last
-        return self
+        return self.root.limit_to_last(limit_last)
 
     def shallow(self):
-        self.build_query["shallow"] = True
-        return self
+        return self.root.shallow()
+
+    def get(self, token=None):
+        return self.root.get(token)
+
+    def push(self, data, token=None):
+        return self.root.push(data, token)
+
+    def set(self, data, token=None):
+        return self.root.set(data, token)
+
+    def update(self, data, token=None):
+        return self.root.update(data, token)
+
+    def remove(self, token=None):
+        return self.root.remove(token)
+
+    def stream(self, stream_handler, token=None, skip_initial=True):
+        return self.root.stream(stream_handler, token, skip_initial)
+
+    def iter_children(self, token=None, chunk_size=CHUNK_SIZE):
+        return self.root.iter_children(token, chunk_size)
+
+    def build_headers(self, token):
+        headers = {"content-type": "application/json; charset=UTF-8" }
+        if not token and self.access_token:
+            headers['Authorization'] = 'Bearer ' + self.access_token.access_token
+        return headers
+
+    def check_token(self, database_url, path, token):
+        if token:
+            return '{0}{1}.json?auth={2}'.format(database_url, path, token)
+        else:
+            return '{0}{1}.json'.format(database_url, path)
+
+    def generate_key(self):
+        """Generate a push key locally, using Firebase's push ID algorithm:
+        8 characters of timestamp followed by 12 random characters, which
+        are incremented when several keys are generated in the same
+        millisecond so that keys stay unique and ordered"""
+        with self.key_lock:
+            now = int(time.time() * 1000)
+            if now == self.last_push_time:
+                # increment the random characters as a base-64 number
+                i = 11
+                while i >= 0 and self.last_rand_chars[i] == 63:
+                    self.last_rand_chars[i] = 0
+                    i -= 1
+                if i >= 0:
+                    self.last_rand_chars[i] += 1
+            else:
+                self.last_push_time = now
+                self.last_rand_chars = [randrange(64) for _ in range(12)]
+            rand_chars = list(self.last_rand_chars)
+
+        time_stamp_chars = [''] * 8
+        for i in range(7, -1, -1):
+            time_stamp_chars[i] = PUSH_CHARS[now & 63]
+            now >>= 6
+        return ''.join(time_stamp_chars) + ''.join(PUSH_CHARS[c] for c in rand_chars)
+
+    def sort(self, origin, by_key):
+        # unpack pyre objects
+        pyres = origin.each()
+        new_list = []
+        for pyre in pyres:
+            new_list.append(pyre.item)
+        # sort
+        data = sorted(dict(new_list).items(), key=lambda item: item[1][by_key])
+        return PyreResponse(convert_to_pyre(data), origin.key())
+
+
+class Reference(object):
+    """
+    Immutable reference to a node of the database, with the parameters of
+    the query of its children: `child` and the query methods return a new
+    reference, so a reference can be shared by threads and reused for
+    several requests. The parameters are a tuple of (name, value) pairs,
+    the last value of a parameter is used.
+    """
+    __slots__ = ('database', 'path', 'query')
+
+    def __init__(self, database, path="", query=()):
+        self.database = database
+        self.path = path
+        self.query = query
+
+    def _with(self, param, value):
+        return Reference(self.database, self.path, self.query + ((param, value),))
+
+    def order_by_child(self, order):
+        return self._with("orderBy", order)
+
+    def start_at(self, start):
+        return self._with("startAt", start)
+
+    def end_at(self, end):
+        return self._with("endAt", end)
+
+    def equal_to(self, equal):
+        return self._with("equalTo", equal)
+
+    def limit_to_first(self, limit_first):
+        return self._with("limitToFirst", limit_first)
+
+    def limit_to_last(self, limit_last):
+        return self._with("limitToLast", limit_last)
+
+    def shallow(self):
+        return self._with("shallow", True)
 
     def child(self, *args):
         new_path = "/".join(args)
         if self.path:
-            self.path += "/{}".format(new_path)
-        else:
-            if new_path.startswith("/"):
-                new_path = new_path[1:]
-            self.path = new_path
-        return self
+            new_path = "{}/{}".format(self.path, new_path)
+        elif new_path.startswith("/"):
+            new_path = new_path[1:]
+        return Reference(self.database, new_path, self.query)
 
     def build_request_url(self, token):
         parameters = {}
         if token:
             parameters['auth'] = token
-        for param in list(self.build_query):
-            if type(self.build_query[param]) is str:
-                parameters[param] = quote('"' + self.build_query[param] + '"')
+        for param, value in self.query:
+            if type(value) is str:
+                parameters[param] = quote('"' + value + '"')
             else:
-                parameters[param] = self.build_query[param]
-        # reset path and build_query for next query
-        request_ref = '{0}{1}.json?{2}'.format(self.database_url, self.path, urlencode(parameters))
-        self.path = ""
-        self.build_query = {}
-        return request_ref
+                parameters[param] = value
+        return '{0}{1}.json?{2}'.format(self.database.database_url, self.path, urlencode(parameters))
 
-    def build_headers(self, token):
-        headers = {"content-type": "application/json; charset=UTF-8" }
-        if not token and self.access_token:
-            headers['Authorization'] = 'Bearer ' + self.access_token.access_token
-        return headers
+    def _request_ref(self, token):
+        return self.database.check_token(self.database.database_url, self.path, token)
 
     def get(self, token=None):
-        build_query = self.build_query
-        query_key = self.path.split("/")[-1]
         request_ref = self.build_request_url(token)
         # headers
-        headers = self.build_headers(token)
+        headers = self.database.build_headers(token)
         # do request
-        request_object = self.requests.get(request_ref, headers=headers)
-        try:
-            request_object.raise_for_status()
-        except HTTPError as e:
-            # raise detailed error message
-            raise HTTPError(e, request_object.text)
-
-        request_dict = request_object.json()
+        request_object = self.database.requests.get(request_ref, headers=headers)
+        raise_detailed_error(request_object)
+
+        return self._response(request_object.json())
+
+    def get_if_modified(self, etag=None, token=None):
+        """Conditional GET of the node: return (None, etag) if the ETag of
+        the node is still `etag`, otherwise the response and the new ETag"""
+        headers = self.database.build_headers(token)
+        headers["X-Firebase-ETag"] = "true"
+        if etag:
+            headers["If-None-Match"] = etag
+        request_object = self.database.requests.get(self.build_request_url(token), headers=headers)
+        new_etag = request_object.headers.get("ETag")
+        if etag and (request_object.status_code == 304 or new_etag == etag):
+            return None, etag
+        raise_detailed_error(request_object)
+        return self._response(request_object.json()), new_etag
+
+    def _response(self, request_dict):
+        build_query = dict(self.query)
+        query_key = self.path.split("/")[-1]
 
         # if primitive or simple query return
         if not isinstance(request_dict, dict):
             return PyreResponse(request_dict, query_key)
-        if not build_query:
-            return PyreResponse(convert_to_pyre(request_dict.items()), query_key)
         # return keys if shallow
         if build_query.get("shallow"):
-            return PyreResponse(request_dict.keys(), query_key)
-        # otherwise sort
-        sorted_response = None
-        if build_query.get("orderBy"):
-            if build_query["orderBy"] == "$key":
-                sorted_response = sorted(request_dict.items(), key=lambda item: item[0])
-            else:
-                sorted_response = sorted(request_dict.items(), key=lambda item: item[1][build_query["orderBy"]])
-        return PyreResponse(convert_to_pyre(sorted_response), query_key)
+            return PyreResponse(list(request_dict.keys()), query_key)
+        # the server filters the children but returns them in a JSON object,
+        # so ordered queries are sorted once here
+        return QueryResult.from_dict(request_dict, query_key, build_query.get("orderBy"))
 
     def push(self, data, token=None):
-        request_ref = self.check_token(self.database_url, self.path, token)
-        self.path = ""
-        headers = self.build_headers(token)
-        request_object = self.requests.post(request_ref, headers=headers, data=json.dumps(data))
+        headers = self.database.build_headers(token)
+        request_object = self.database.requests.post(self._request_ref(token), headers=headers, data=json.dumps(data))
+        raise_detailed_error(request_object)
         return request_object.json()
 
     def set(self, data, token=None):
-        request_ref = self.check_token(self.database_url, self.path, token)
-        self.path = ""
-        headers = self.build_headers(token)
-        request_object = self.requests.put(request_ref, headers=headers, data=json.dumps(data))
+        headers = self.database.build_headers(token)
+        request_object = self.database.requests.put(self._request_ref(token), headers=headers, data=json.dumps(data))
+        raise_detailed_error(request_object)
         return request_object.json()
 
+    def set_if_match(self, data, etag, token=None):
+        """Conditional PUT of the node: set it if its ETag is still `etag`
+        and return the new ETag, raise PreconditionFailed otherwise"""
+        headers = self.database.build_headers(token)
+        headers["X-Firebase-ETag"] = "true"
+        headers["if-match"] = etag
+        request_object = self.database.requests.put(self._request_ref(token), headers=headers, data=json.dumps(data))
+        if request_object.status_code == 412:
+            raise PreconditionFailed(request_object.json(), request_object.headers.get("ETag"),
+                                     request_object.reason, request_object.text)
+        raise_detailed_error(request_object)
+        return request_object.headers.get("ETag")
+
     def update(self, data, token=None):
-        request_ref = self.check_token(self.database_url, self.path, token)
-        self.path = ""
-        headers = self.build_headers(token)
-        request_object = self.requests.patch(request_ref, headers=headers, data=json.dumps(data))
+        headers = self.database.build_headers(token)
+        request_object = self.database.requests.patch(self._request_ref(token), headers=headers, data=json.dumps(data))
+        raise_detailed_error(request_object)
         return request_object.json()
 
     def remove(self, token=None):
-        request_ref = self.check_token(self.database_url, self.path, token)
-        self.path = ""
-        headers = self.build_headers(token)
-        request_object = self.requests.delete(request_ref, headers=headers)
+        headers = self.database.build_headers(token)
+        request_object = self.database.requests.delete(self._request_ref(token), headers=headers)
+        raise_detailed_error(request_object)
         return request_object.json()
 
-    def stream(self, stream_handler, token=None):
+    def stream(self, stream_handler, token=None, skip_initial=True):
         request_ref = self.build_request_url(token)
-        return Stream(request_ref, stream_handler)
-
-    def check_token(self, database_url, path, token):
-        if token:
-            return '{0}{1}.json?auth={2}'.format(database_url, path, token)
-        else:
-            return '{0}{1}.json'.format(database_url, path)
-
-    def generate_key(self):
-        push_chars = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
-        now = int(time.time() * 1000)
-        duplicate_time = now == self.last_push_time
-        self.last_push_time = now
-        time_stamp_chars = [0] * 8
-        for i in reversed(range(0, 8)):
-            time_stamp_chars[i] = push_chars[now % 64]
-            now = math.floor(now / 64)
-        new_id = "".join(time_stamp_chars)
-        if not duplicate_time:
-            for i in range(0, 12):
-                self.last_rand_chars.append(math.floor(uniform(0, 1) * 64))
-        else:
-            for i in range(0, 11):
-                if self.last_rand_chars[i] == 63:
-                    self.last_rand_chars[i] = 0
-                self.last_rand_chars[i] += 1
-        for i in range(0, 12):
-            new_id += push_chars[self.last_rand_chars[i]]
-        return new_id
-
-    def sort(self, origin, by_key):
-        # unpack pyre objects
-        pyres = origin.each()
-        new_list = []
-        for pyre in pyres:
-            new_list.append(pyre.item)
-        # sort
-        data = sorted(dict(new_list).items(), key=lambda item: item[1][by_key])
-        return PyreResponse(convert_to_pyre(data), origin.key())
+        return Stream(request_ref, stream_handler, skip_initial)
+
+    def iter_children(self, token=None, chunk_size=CHUNK_SIZE):
+        """Yield the (key, value) pairs of the children of the node while
+        the response is downloaded, in the order of the response, without
+        buffering the whole body (see ChildrenDecoder)"""
+        headers = self.database.build_headers(token)
+        request_object = self.database.requests.get(self.build_request_url(token), headers=headers, stream=True)
+        try:
+            raise_detailed_error(request_object)
+            decoder = ChildrenDecoder()
+            for chunk in request_object.iter_content(chunk_size):
+                for item in decoder.feed(chunk):
+                    yield item
+            for item in decoder.close():
+                yield item
+        finally:
+            request_object.close()
 
 
 class Storage():
@@ -312,7 +500,11 @@ class Storage():
             self.path = new_path
         return self
 
-    def put(self, file, token=None):
+    def put(self, file, token=None, chunk_size=None, progress=None, retries=UPLOAD_RETRIES):
+        """Upload the file, given by its name or as a file object. With a
+        token, a file larger than `chunk_size` is sent in chunks with a
+        resumable upload (see ResumableUpload), and `progress` is called
+        with the number of bytes sent and the size of the file"""
         # reset path
         path = self.path
         self.path = None
@@ -321,10 +513,21 @@ class Storage():
                 file_object = open(file, 'rb')
             else:
                 file_object = file
-            request_ref = self.storage_bucket + "/o?name={0}".format(path)
-            headers = {"Authorization": "Firebase " + token}
-            request_object = self.requests.put(request_ref, headers=headers, data=file_object)
-            return request_object.json()
+            try:
+                size = file_size(file_object)
+                if chunk_size and size > chunk_size:
+                    upload = ResumableUpload(self.requests, self.storage_bucket, path, file_object, size,
+                                             token, chunk_size, progress, retries)
+                    return upload.run()
+                request_ref = self.storage_bucket + "/o?name={0}".format(path)
+                headers = {"Authorization": "Firebase " + token}
+                request_object = self.requests.put(request_ref, headers=headers, data=file_object)
+                if progress is not None:
+                    progress(size, size)
+                return request_object.json()
+            finally:
+                if file_object is not file:
+                    file_object.close()
         elif self.credentials:
             blob = self.bucket.blob(path)
             if isinstance(file, str):
@@ -363,6 +566,378 @@ class Storage():
         return self.bucket.list_blobs()
 
 
+def file_size(file_object):
+    """Return the number of bytes from the position of the file to its end"""
+    position = file_object.tell()
+    file_object.seek(0, os.SEEK_END)
+    size = file_object.tell() - position
+    file_object.seek(position)
+    return size
+
+
+class ResumableUpload(object):
+    """
+    Upload of a file to Firebase Storage in chunks, with the resumable
+    protocol of the Firebase SDKs: a first request starts an upload session,
+    whose URL receives the chunks at their offsets, the last chunk
+    finalizing the upload.
+
+    A chunk which fails on a network error or a server error is retried
+    after a delay growing exponentially: the session is queried for the
+    number of bytes received, and the upload resumes from there instead of
+    starting from zero. The upload fails after `retries` failures in a row.
+    """
+
+    def __init__(self, requests, storage_bucket, path, file_object, size, token,
+                 chunk_size=UPLOAD_CHUNK_SIZE, progress=None, retries=UPLOAD_RETRIES, delay=1.0):
+        self.requests = requests
+        self.storage_bucket = storage_bucket
+        self.path = path
+        self.file_object = file_object
+        self.size = size
+        self.token = token
+        # the chunks are multiples of the granularity of the server
+        self.chunk_size = max(chunk_size // UPLOAD_GRANULARITY, 1) * UPLOAD_GRANULARITY
+        self.progress = progress
+        self.retries = retries
+        self.delay = delay
+        self.url = None
+        self.failures = 0
+
+    def _headers(self, command, **headers):
+        headers["Authorization"] = "Firebase " + self.token
+        headers["X-Goog-Upload-Protocol"] = "resumable"
+        headers["X-Goog-Upload-Command"] = command
+        return headers
+
+    def _post(self, url, command, data=None, **headers):
+        request_object = self.requests.post(url, headers=self._headers(command, **headers), data=data)
+        if request_object.status_code >= 500 or request_object.status_code == 429:
+            # worth retrying
+            raise requests.exceptions.ConnectionError(
+                "{} {}".format(request_object.status_code, request_object.reason))
+        raise_detailed_error(request_object)
+        return request_object
+
+    def start(self):
+        """Start the upload session"""
+        content_type = mimetypes.guess_type(self.path)[0] or "application/octet-stream"
+        request_ref = "{0}/o?{1}".format(self.storage_bucket, urlencode({"name": self.path}))
+        request_object = self._post(request_ref, "start",
+                                    data=json.dumps({"name": self.path, "contentType": content_type}),
+                                    **{"X-Goog-Upload-Header-Content-Length": str(self.size),
+                                       "X-Goog-Upload-Header-Content-Type": content_type,
+                                       "Content-Type": "application/json"})
+        self.url = request_object.headers["X-Goog-Upload-URL"]
+
+    def query(self):
+        """Return the number of bytes received by the server, and whether
+        the upload has been finalized"""
+        request_object = self._post(self.url, "query")
+        return (int(request_object.headers.get("X-Goog-Upload-Size-Received", 0)),
+                request_object.headers.get("X-Goog-Upload-Status") == "final")
+
+    def metadata(self):
+        """Return the metadata of the uploaded file"""
+        request_ref = "{0}/o/{1}".format(self.storage_bucket, quote(self.path, safe=""))
+        request_object = self.requests.get(request_ref, headers={"Authorization": "Firebase " + self.token})
+        raise_detailed_error(request_object)
+        return request_object.json()
+
+    def run(self):
+        """Upload the file, return the metadata of the uploaded file"""
+        start = self.file_object.tell()
+        offset = 0
+        while True:
+            try:
+                if self.url is None:
+                    self.start()
+                elif self.failures:
+                    offset, final = self.query()
+                    if final:
+                        # the response of the last chunk has been lost
+                        return self.metadata()
+                    self.file_object.seek(start + offset)
+
+                chunk = self.file_object.read(self.chunk_size)
+                last = offset + len(chunk) >= self.size
+                request_object = self._post(self.url, "upload, finalize" if last else "upload", data=chunk,
+                                            **{"X-Goog-Upload-Offset": str(offset)})
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.failures += 1
+                if self.failures > self.retries:
+                    raise
+                time.sleep(self.delay * 2 ** (self.failures - 1))
+                continue
+
+            self.failures = 0
+            offset += len(chunk)
+            if self.progress is not None:
+                self.progress(offset, self.size)
+            if last:
+                return request_object.json()
+
+
+class PreconditionFailed(HTTPError):
+    """Error of a conditional write of a node which has changed, with the
+    current value and ETag of the node"""
+
+    def __init__(self, value, etag, *args):
+        super(PreconditionFailed, self).__init__(*args)
+        self.value = value
+        self.etag = etag
+
+
+def raise_detailed_error(request_object):
+    try:
+        request_object.raise_for_status()
+    except HTTPError as e:
+        # raise detailed error message
+        raise HTTPError(e, request_object.text)
+
+
+def key_order(key):
+    """Return the sort key of a child's key in Firebase's order: the keys
+    which are 32-bit integers first, numerically, then the other keys"""
+    if not (key[:1].isdigit() or key[:1] == "-" and key[1:2].isdigit()):
+        # e.g. a push key, saves raising a ValueError
+        return 1, 0, key
+    try:
+        number = int(key)
+    except ValueError:
+        return 1, 0, key
+    if -2 ** 31 <= number < 2 ** 31 and str(number) == key:
+        return 0, number, ''
+    return 1, 0, key
+
+
+def value_order(value):
+    """Return the sort key of a value in Firebase's order: null, false,
+    true, numbers, strings, then objects"""
+    rank = VALUE_RANKS.get(type(value), 5)
+    if rank >= 3:
+        return (rank, value) if rank < 5 else (5,)
+    if rank == 1 and value:
+        return 2,
+    return rank,
+
+
+def child_value(value, path):
+    """Return the value at the path of `order_by_child` under a child, None
+    if the child does not have it"""
+    if "/" not in path:
+        return value.get(path) if isinstance(value, dict) else None
+    for key in path.split("/"):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def order_function(order_by):
+    """
+    Return the function giving the sort key of a (key, value) child for the
+    orderBy parameter of a query: the children are sorted by the order of
+    their key ("$key"), their value ("$value") or the value of a child, the
+    ties being sorted by key.
+    """
+    if order_by == "$key":
+        return lambda item: (key_order(item[0]),)
+    if order_by == "$value":
+        return lambda item: (value_order(item[1]), key_order(item[0]))
+    return lambda item: (value_order(child_value(item[1], order_by)), key_order(item[0]))
+
+
+class QueryResult(object):
+    """
+    Children of a node returned by a query, as a list of (key, value) pairs
+    which are in the order of the query, if any.
+
+    The pairs are read with `items` without building an object per child;
+    `val` and `each` return the OrderedDict and the Pyre objects of a
+    PyreResponse, built on first use. `limit` and `range` filter the result
+    of an ordered query like limitToFirst/limitToLast and startAt/endAt.
+    """
+    __slots__ = ('_items', 'query_key', 'order_by', '_val', '_orders')
+
+    def __init__(self, items, query_key, order_by=None):
+        self._items = items
+        self.query_key = query_key
+        self.order_by = order_by
+        self._val = None
+        self._orders = None
+
+    @classmethod
+    def from_dict(cls, data, query_key, order_by=None):
+        """Return the result of the children in the dict, sorted by the
+        orderBy parameter if given"""
+        items = list(data.items())
+        if order_by:
+            items.sort(key=order_function(order_by))
+        return cls(items, query_key, order_by)
+
+    def items(self):
+        return iter(self._items)
+
+    __iter__ = items
+
+    def __len__(self):
+        return len(self._items)
+
+    def keys(self):
+        return [key for key, _ in self._items]
+
+    def values(self):
+        return [value for _, value in self._items]
+
+    def key(self):
+        return self.query_key
+
+    def val(self):
+        if self._val is None:
+            self._val = OrderedDict(self._items)
+        return self._val
+
+    def each(self):
+        return convert_to_pyre(self._items)
+
+    def limit(self, count, last=False):
+        """Return the first children, or the last ones"""
+        count = max(count, 0)
+        items = self._items[max(len(self._items) - count, 0):] if last else self._items[:count]
+        return QueryResult(items, self.query_key, self.order_by)
+
+    def range(self, start=None, end=None):
+        """Return the children between `start` and `end` included, compared
+        to their key or value like the orderBy parameter of the query"""
+        if not self.order_by:
+            raise ValueError("range of a query which is not ordered")
+        if self._orders is None:
+            order = order_function(self.order_by)
+            self._orders = [order(item) for item in self._items]
+
+        if self.order_by == "$key":
+            bound = lambda key: key_order(key if isinstance(key, string_types) else str(key))
+        else:
+            bound = value_order
+        low = 0 if start is None else bisect_left(self._orders, (bound(start),))
+        # the sort keys of the children equal to `end` are lower than (end, MAX)
+        high = len(self._items) if end is None else bisect_right(self._orders, (bound(end), (2,)))
+        return QueryResult(self._items[low:high], self.query_key, self.order_by)
+
+
+class ChildrenDecoder(object):
+    """
+    Incremental decoder of the JSON of a node, returning the (key, value)
+    pairs of its children as soon as their JSON has been received: only the
+    JSON of the child being received is buffered, the children already
+    returned are dropped from the buffer.
+
+    A value is decoded once the text received since its start has doubled,
+    so that a large child is not decoded again for each chunk. A node which
+    is not an object is decoded by `close`: an array yields its items which
+    are not null, with their index as key, like the keys of Firebase.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._text = u""
+        self._pos = 0
+        self._pending = []
+        self._pending_size = 0
+        self._state = "start"
+        self._key = None
+        self._attempt = 0
+
+    def feed(self, data):
+        """Add the bytes received, return the list of the children which
+        are complete"""
+        text = self._decoder.decode(data)
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._state == "value" and len(self._text) - self._pos + self._pending_size < 2 * self._attempt:
+            return []   # keep the chunks until the next attempt
+        self._join()
+        return self._parse()
+
+    def _join(self):
+        self._text = self._text[self._pos:] + u"".join(self._pending)
+        self._pos = 0
+        self._pending = []
+        self._pending_size = 0
+
+    def close(self):
+        """Return the last children, raise a ValueError if the JSON is
+        truncated"""
+        self._pending.append(self._decoder.decode(b"", True))
+        self._join()
+        if self._state == "other":
+            value = json.loads(self._text) if self._text.strip() else None
+            if isinstance(value, list):
+                return [(str(i), item) for i, item in enumerate(value) if item is not None]
+            if value is not None:
+                raise ValueError("the node is not an object: {!r}".format(value))
+            return []
+
+        items = self._parse(final=True)
+        if self._state != "end" or self._text[self._skip(self._pos):]:
+            raise ValueError("truncated or invalid JSON object")
+        return items
+
+    def _skip(self, pos):
+        return WHITESPACE.match(self._text, pos).end()
+
+    def _parse(self, final=False):
+        items = []
+        text = self._text
+        while True:
+            pos = self._skip(self._pos)
+            if pos == len(text) or self._state in ("end", "other"):
+                return items
+
+            if self._state == "start":
+                self._state = "key" if text[pos] == "{" else "other"
+                self._pos = pos + 1 if self._state == "key" else pos
+            elif self._state in ("key", "next"):
+                if text[pos] == "}":
+                    self._state, self._pos = "end", pos + 1
+                    continue
+                if self._state == "next":
+                    if text[pos] != ",":
+                        raise ValueError("expected ',' or '}}' at {}".format(pos))
+                    self._state, self._pos = "key", pos + 1
+                    continue
+                if text[pos] != '"':
+                    raise ValueError("expected a key at {}".format(pos))
+                try:
+                    key, end = scanstring(text, pos + 1)
+                except ValueError:
+                    return items    # the key is not complete
+                colon = self._skip(end)
+                if colon == len(text):
+                    return items
+                if text[colon] != ":":
+                    raise ValueError("expected ':' at {}".format(colon))
+                self._key, self._state, self._pos, self._attempt = key, "value", colon + 1, 0
+            else:
+                if not final and len(text) - pos < 2 * self._attempt:
+                    return items
+                try:
+                    value, end = self._json.raw_decode(text, pos)
+                    # a number ending the text may be truncated
+                    complete = final or self._skip(end) < len(text)
+                except ValueError:
+                    if final:
+                        raise
+                    complete = False
+                if not complete:
+                    self._pos, self._attempt = pos, len(text) - pos
+                    return items
+                items.append((self._key, value))
+                self._state, self._pos = "next", end
+
+
 def convert_to_pyre(items):
     pyre_list = []
     for item in items:
@@ -374,18 +949,23 @@ class PyreResponse:
     def __init__(self, pyres, query_key):
         self.pyres = pyres
         self.query_key = query_key
+        self._val = None
 
     def val(self):
         if isinstance(self.pyres, list):
-            # unpack pyres into OrderedDict
-            pyre_list = []
-            for pyre in self.pyres:
-                pyre_list.append((pyre.key(), pyre.val()))
-            return OrderedDict(pyre_list)
+            # unpack pyres into OrderedDict, once
+            if self._val is None:
+                self._val = OrderedDict(self.items())
+            return self._val
         else:
             # return primitive or simple query results
             return self.pyres
 
+    def items(self):
+        if isinstance(self.pyres, list):
+            return [(pyre.key(), pyre.val()) for pyre in self.pyres]
+        return []
+
     def key(self):
         return self.query_key
 
@@ -424,9 +1004,11 @@ class ClosableSSEClient(SSEClient):
 
 
 class Stream:
-    def __init__(self, url, stream_handler):
+    def __init__(self, url, stream_handler, skip_initial=True):
         self.url = url
         self.stream_handler = stream_handler
+        self.skip_initial = skip_initial
+        self.closed = False
         self.sse = None
         self.thread = None
         self.start()
@@ -439,14 +1021,28 @@ class Stream:
 
     def start_stream(self, url, stream_handler):
         self.sse = ClosableSSEClient(url)
+        if self.closed:
+            # closed while connecting
+            self.sse.close()
+            return
+        initial = self.skip_initial
         for msg in self.sse:
             msg_data = json.loads(msg.data)
-            # don't return initial data
-            if msg_data and msg_data['path'] != '/':
-                msg_data["event"] = msg.event
-                stream_handler(msg_data)
+            # keep-alive events have no data
+            if not isinstance(msg_data, dict):
+                continue
+            # don't return initial data, i.e. the first put at the root
+            if initial:
+                initial = False
+                if msg.event == 'put' and msg_data['path'] == '/':
+                    continue
+            msg_data["event"] = msg.event
+            stream_handler(msg_data)
 
     def close(self):
-        self.sse.close()
-        self.thread.join()
+        self.closed = True
+        if self.sse is not None:
+            # otherwise the thread stops once connected
+            self.sse.close()
+            self.thread.join()
         return self
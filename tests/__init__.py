@@ -0,0 +1,19 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def stub_package(name):
+    """Register a package of the project without running its __init__, so
+    that its modules can be tested without the app dependencies (e.g. the
+    'cloud' package connects to Firebase when imported)"""
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [os.path.join(ROOT, name)]
+        sys.modules[name] = package
+    return sys.modules[name]
+
+
+stub_package('cloud')
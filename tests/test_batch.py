@@ -0,0 +1,88 @@
+import unittest
+
+import tests  # noqa
+from cloud import cache
+from cloud.batch import WriteBatch
+
+
+class FakeDatabase(object):
+    """Record the requests sent to the database"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.path = None
+        self.requests = []
+        self.keys = 0
+
+    def child(self, *path):
+        self.path = '/'.join(path)
+        return self
+
+    def update(self, data, token=None):
+        if self.fail:
+            raise IOError('offline')
+        self.requests.append((self.path, data))
+
+    def generate_key(self):
+        self.keys += 1
+        return '-K{}'.format(self.keys)
+
+
+class WriteBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.cache = cache.PathCache(cache.MemoryCache(ttl=None))
+        self.batch = WriteBatch(self.db, 'token', self.cache)
+
+    def test_single_request(self):
+        self.batch.update('u/trips/a', {'name': 'x', 'days': 2})
+        self.batch.remove('u/active')
+        key = self.batch.push('u/trips/a/destinations/d/notes', {'content': 'c'})
+
+        self.assertEqual(self.batch.commit(), [key])
+        self.assertEqual(self.db.requests, [('u', {
+            'trips/a/name': 'x',
+            'trips/a/days': 2,
+            'active': None,
+            'trips/a/destinations/d/notes/' + key: {'content': 'c'},
+        })])
+        self.assertEqual(len(self.batch), 0)
+
+    def test_nested_operations_are_merged(self):
+        self.batch.set('u/trips/a', {'name': 'x'})
+        self.batch.update('u/trips/a/destinations/d', {'day': 1})
+        self.batch.remove('u/trips/a/name')
+        self.batch.set('u/trips/b/name', 'y')
+        self.batch.set('u/trips/b', {'days': 1})
+        self.batch.commit()
+
+        self.assertEqual(self.db.requests, [('u/trips', {
+            'a': {'destinations': {'d': {'day': 1}}},
+            'b': {'days': 1},
+        })])
+
+    def test_empty_batch(self):
+        self.assertEqual(self.batch.commit(), [])
+        self.assertEqual(self.db.requests, [])
+
+    def test_cache_updated(self):
+        self.cache.put('u/trips', {'a': {'name': 'old'}})
+        self.batch.set('u/trips/a/name', 'x')
+        self.batch.remove('u/active')
+        self.batch.commit()
+
+        self.assertIs(self.cache.get('u/trips'), cache.MISSING)
+        self.assertEqual(self.cache.get('u/trips/a/name'), 'x')
+        self.assertIsNone(self.cache.get('u/active'))
+
+    def test_failed_commit_invalidates(self):
+        self.db.fail = True
+        self.cache.put('u/trips/a', {'name': 'old'})
+        self.batch.set('u/trips/a/name', 'x')
+        self.assertRaises(IOError, self.batch.commit)
+        self.assertIs(self.cache.get('u/trips/a'), cache.MISSING)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import tests  # noqa
+from cloud import cache
+
+MISSING = cache.MISSING
+
+
+class MemoryCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        c = cache.MemoryCache(max_size=2, ttl=None)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')          # 'b' becomes the least recently used
+        c.set('c', 3)
+        self.assertEqual(c.get('a'), 1)
+        self.assertIs(c.get('b'), MISSING)
+        self.assertEqual(c.get('c'), 3)
+        self.assertEqual(c.evictions, 1)
+
+    def test_ttl_expiry(self):
+        c = cache.MemoryCache(max_size=2, ttl=10)
+        c.set('a', 1)
+        stored, value = c._entries['a']
+        c._entries['a'] = (stored - 11, value)
+        self.assertIs(c.get('a'), MISSING)
+        self.assertEqual(len(c), 0)
+
+
+class PathCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.PathCache(cache.MemoryCache(max_size=16, ttl=None))
+
+    def test_hit_miss_counters(self):
+        self.assertIs(self.cache.get('u/trips'), MISSING)
+        self.cache.put('u/trips', {'a': 1})
+        self.assertEqual(self.cache.get('u/trips'), {'a': 1})
+        stats = self.cache.stats
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_values_are_copied(self):
+        data = {'name': 'x'}
+        self.cache.put('u/trips/a', data)
+        data['name'] = 'changed'
+        value = self.cache.get('u/trips/a')
+        value['z'] = 3
+        self.assertEqual(self.cache.get('u/trips/a'), {'name': 'x'})
+
+    def test_ordering_is_preserved(self):
+        self.cache.put('u/trips', cache.OrderedDict([('b', 1), ('a', 2)]),
+                       {'orderBy': 'active', 'equalTo': True})
+        value = self.cache.get('u/trips', {'orderBy': 'active', 'equalTo': True})
+        self.assertEqual(list(value.keys()), ['b', 'a'])
+
+    def test_write_invalidates_ancestors_and_descendants(self):
+        self.cache.put('u/trips', {'a': {'name': 'x'}})
+        self.cache.put('u/trips', {'a': 1}, {'orderBy': 'active', 'equalTo': True})
+        self.cache.put('u/trips/a/destinations/d', {'name': 'y'})
+        self.cache.put('u/trips/b', {'name': 'z'})
+        self.cache.write('u/trips/a', {'name': 'w'})
+
+        self.assertIs(self.cache.get('u/trips'), MISSING)
+        self.assertIs(self.cache.get('u/trips', {'orderBy': 'active', 'equalTo': True}), MISSING)
+        self.assertIs(self.cache.get('u/trips/a/destinations/d'), MISSING)
+        self.assertEqual(self.cache.get('u/trips/a'), {'name': 'w'})
+        self.assertEqual(self.cache.get('u/trips/b'), {'name': 'z'})
+
+    def test_remove_caches_none(self):
+        self.cache.write('u/trips/a', None)
+        self.assertIsNone(self.cache.get('u/trips/a'))
+
+    def test_merge(self):
+        self.cache.put('u/trips/a', {'name': 'x', 'days': 2, 'active': True})
+        self.cache.merge('u/trips/a', {'name': 'y', 'days': None})
+        self.assertEqual(self.cache.get('u/trips/a'), {'name': 'y', 'active': True})
+
+    def test_merge_nested_paths(self):
+        self.cache.put('u/trips/a', {'destinations': {'d': {'name': 'x'}}, 'active': True})
+        self.cache.merge('u/trips/a', {'destinations/d/day': 2,
+                                       'destinations/e/name': 'y',
+                                       'active': None})
+        self.assertEqual(self.cache.get('u/trips/a'), {
+            'destinations': {'d': {'name': 'x', 'day': 2}, 'e': {'name': 'y'}}})
+
+    def test_merge_uncached_invalidates(self):
+        self.cache.put('u/trips', {'a': {'name': 'x'}})
+        self.cache.merge('u/trips/a', {'name': 'y'})
+        self.assertIs(self.cache.get('u/trips'), MISSING)
+        self.assertIs(self.cache.get('u/trips/a'), MISSING)
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_persisted_between_sessions(self):
+        c = cache.PathCache(cache.MemoryCache(), cache.DiskCache(self.filename))
+        c.put('u/trips', cache.OrderedDict([('b', 1), ('a', 2)]))
+
+        c = cache.PathCache(cache.MemoryCache(), cache.DiskCache(self.filename))
+        self.assertEqual(list(c.get('u/trips').keys()), ['b', 'a'])
+
+    def test_invalidation_syncs_once(self):
+        disk = cache.DiskCache(self.filename)
+        c = cache.PathCache(cache.MemoryCache(), disk)
+        for i in range(5):
+            c.put('u/trips/{}'.format(i), i)
+
+        syncs = []
+        sync = disk.sync
+        disk.sync = lambda: syncs.append(1) or sync()
+        c.write('u/trips', {})
+        self.assertEqual(len(syncs), 1)
+        self.assertEqual(disk.keys(), ['u/trips'])
+
+
+if __name__ == '__main__':
+    unittest.main()
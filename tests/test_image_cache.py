@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import tests  # noqa
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+try:
+    from cloud.image_cache import ImageCache
+    import requests
+except ImportError:
+    ImageCache = None
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        time.sleep(server.delay)
+        body = server.images.get(self.path.split('?')[0])
+        self.send_response(200 if body is not None else 404)
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        self.wfile.write(body or b'')
+
+
+class ImageServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in of Firebase Storage serving the images by path"""
+
+    daemon_threads = True
+
+    def __init__(self, images):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ImageHandler)
+        self.images = images
+        self.requests = []
+        self.delay = 0
+        threading.Thread(target=self.serve_forever).start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}?alt=media'.format(self.server_address[1], path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@unittest.skipIf(ImageCache is None, 'app dependencies are not installed')
+class ImageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server = ImageServer({'/a.jpg': b'a' * 100, '/b.jpg': b'b' * 100,
+                                   '/c.jpg': b'c' * 100, '/copy.jpg': b'a' * 100})
+        self.addCleanup(self.server.stop)
+        self.session = requests.Session()
+        self.addCleanup(self.session.close)
+        self.now = 0
+
+    def cache(self, max_bytes=250, max_age=None):
+        return ImageCache(self.directory, max_bytes, self.session, max_age=max_age, clock=lambda: self.now)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_downloaded_once(self):
+        cache = self.cache()
+        url = self.server.url('/a.jpg')
+        path = cache.get(url)
+        self.assertEqual(cache.get(url), path)
+        self.assertEqual((self.read(path), os.path.splitext(path)[1]), (b'a' * 100, '.jpg'))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual((cache.hits, cache.misses, cache.bytes_saved), (1, 1, 100))
+        self.assertEqual(cache.stats['hit_rate'], 0.5)
+
+    def test_same_content_shared(self):
+        cache = self.cache()
+        self.assertEqual(cache.get(self.server.url('/a.jpg')), cache.get(self.server.url('/copy.jpg')))
+        self.assertEqual(cache.size, 100)
+
+    def test_least_recently_used_evicted(self):
+        cache = self.cache()
+        a, b, c = [self.server.url(path) for path in ('/a.jpg', '/b.jpg', '/c.jpg')]
+        cache.get(a)
+        cache.get(b)
+        cache.get(a)
+        cache.get(c)
+        self.assertEqual((a in cache, b in cache, c in cache), (True, False, True))
+        self.assertEqual((cache.size, cache.evictions), (200, 1))
+        self.assertEqual(len(os.listdir(self.directory)), 3)    # with the index
+
+    def test_kept_between_sessions(self):
+        url = self.server.url('/a.jpg')
+        path = self.cache().get(url)
+        cache = self.cache()
+        self.assertEqual(cache.get(url), path)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_expired_url_downloaded_again(self):
+        cache = self.cache(max_age=60)
+        url = self.server.url('/a.jpg')
+        path = cache.get(url)
+        self.now = 61
+        self.assertEqual(cache.get(url), path)
+        self.assertEqual((len(self.server.requests), cache.misses), (2, 2))
+
+    def test_concurrent_downloads_shared(self):
+        cache = self.cache()
+        url = self.server.url('/a.jpg')
+        self.server.delay = 0.2
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            paths = list(executor.map(cache.get, [url] * 4))
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_missing_image(self):
+        cache = self.cache()
+        self.assertRaises(requests.HTTPError, cache.get, self.server.url('/missing.jpg'))
+        self.assertEqual(cache.size, 0)
+
+    def test_put_and_open(self):
+        cache = self.cache()
+        url = self.server.url('/uploaded.png')
+        cache.put(url, b'png')
+        data = cache.open(url)
+        self.assertEqual(data[:], b'png')
+        data.close()
+        self.assertEqual(self.server.requests, [])
+
+    def test_prefetch(self):
+        cache = self.cache()
+        urls = [self.server.url('/a.jpg'), self.server.url('/missing.jpg'), None]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cache.prefetch(urls, executor)
+        self.assertIn(urls[0], cache)
+        self.assertEqual(cache.hits, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import tests  # noqa
+from utils import images
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class PrepareImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def save(self, image, name, **kwargs):
+        image.save(self.path(name), **kwargs)
+        return self.path(name)
+
+    def photo(self, size):
+        # a gradient, which is not compressed as well as a plain color
+        image = Image.new('RGB', size)
+        image.putdata([(x % 256, y % 256, (x * y) % 256) for y in range(size[1]) for x in range(size[0])])
+        return image
+
+    def test_not_an_image(self):
+        with open(self.path('note.JPG'), 'wb') as f:
+            f.write(b'text')
+        prepared = images.prepare_image(self.path('note.JPG'))
+        self.assertEqual(prepared, (images.Encoded(b'text', '.jpg'), None, 4))
+
+    @unittest.skipIf(Image is None, 'PIL is not installed')
+    def test_photo_downscaled(self):
+        path = self.save(self.photo((1200, 900)), 'photo.png')
+        prepared = images.prepare_image(path, max_size=400, thumbnail_size=100)
+
+        image = Image.open(io.BytesIO(prepared.image.data))
+        thumbnail = Image.open(io.BytesIO(prepared.thumbnail.data))
+        self.assertEqual((image.format, image.size, prepared.image.ext), ('JPEG', (400, 300), '.jpg'))
+        self.assertEqual(thumbnail.size, (100, 75))
+        self.assertEqual(prepared.original_size, os.path.getsize(path))
+        self.assertLess(len(prepared.image.data) * 5, prepared.original_size)
+
+    @unittest.skipIf(Image is None, 'PIL is not installed')
+    def test_small_image_kept(self):
+        path = self.save(self.photo((80, 60)), 'small.jpg', quality=50)
+        prepared = images.prepare_image(path, max_size=400, thumbnail_size=100)
+        with open(path, 'rb') as f:
+            self.assertEqual(prepared.image.data, f.read())
+        self.assertIsNone(prepared.thumbnail)
+
+    @unittest.skipIf(Image is None, 'PIL is not installed')
+    def test_transparency_kept(self):
+        path = self.save(Image.new('RGBA', (500, 100), (255, 0, 0, 128)), 'logo.png')
+        prepared = images.prepare_image(path, max_size=250, thumbnail_size=50)
+        image = Image.open(io.BytesIO(prepared.image.data))
+        self.assertEqual((image.format, image.mode, image.size), ('PNG', 'RGBA', (250, 50)))
+        self.assertEqual(prepared.thumbnail.ext, '.png')
+
+    @unittest.skipIf(Image is None or not hasattr(Image.Image, 'getexif'), 'PIL 6 is not installed')
+    def test_orientation_applied(self):
+        photo = self.photo((300, 200))
+        exif = photo.getexif()
+        exif[images.ORIENTATION] = 6    # rotated by 90 degrees
+        path = self.save(photo, 'rotated.jpg', exif=exif.tobytes())
+        prepared = images.prepare_image(path, max_size=150, thumbnail_size=50)
+        self.assertEqual(Image.open(io.BytesIO(prepared.image.data)).size, (100, 150))
+
+
+if __name__ == '__main__':
+    unittest.main()
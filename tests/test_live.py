@@ -0,0 +1,100 @@
+import unittest
+
+import tests  # noqa
+
+try:
+    from cloud.live import apply_event, Change, ADDED, CHANGED, REMOVED
+    from models.trip import Trip, Spent, budget_errors
+except (ImportError, SyntaxError):
+    apply_event = None
+
+
+def trip_data():
+    return {
+        'name': 'trip', 'days': 2, 'active': True,
+        'destinations': {
+            'd1': {'name': 'a', 'day': 1,
+                   'notes': {'n1': {'content': 'x'}},
+                   'spents': {'s1': {'content': 'food', 'spent': 10}}},
+            'd2': {'name': 'b', 'day': 2},
+        },
+    }
+
+
+@unittest.skipIf(apply_event is None, 'app dependencies are not installed')
+class ApplyEventTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trip = Trip(_id='t', **trip_data())
+
+    def destination(self, key):
+        return [d for d in self.trip._destinations if d._id == key][0]
+
+    def test_initial_snapshot_fills_header(self):
+        trip = Trip(_id='t', name='trip', days=2, active=True, budget=10)
+        self.assertIsNone(trip._destinations)
+
+        changes = apply_event(trip, 'put', '/', trip_data())
+        self.assertEqual(sorted(changes), [Change(('destinations', 'd1'), ADDED),
+                                           Change(('destinations', 'd2'), ADDED)])
+        self.assertEqual(trip.budget, 10)
+        self.assertEqual(budget_errors(trip), [])
+
+        # the same snapshot again, e.g. after reconnecting
+        self.assertEqual(apply_event(trip, 'put', '/', trip_data()), [])
+
+    def test_spent_added_on_other_device(self):
+        # the multi-location update of TripManager.add_spent
+        changes = apply_event(self.trip, 'patch', '/', {
+            'destinations/d2/spents/s2': {'content': 'taxi', 'spent': 5},
+            'destinations/d2/budget': 5,
+            'budget': 15,
+        })
+        self.assertEqual(changes, [Change(('destinations', 'd2', 'spents', 's2'), ADDED)])
+        self.assertEqual((self.trip.budget, self.destination('d2').budget), (15, 5))
+        self.assertEqual(self.trip.budget_by_day, {1: 10, 2: 5})
+
+    def test_echo_of_local_write(self):
+        spent = Spent(_id='s2', content='taxi', spent=5)
+        self.destination('d1').add_spent(spent)
+        changes = apply_event(self.trip, 'put', '/destinations/d1/spents/s2',
+                              {'content': 'taxi', 'spent': 5})
+        self.assertEqual(changes, [])
+        self.assertEqual(self.trip.budget, 15)
+
+    def test_fields(self):
+        changes = apply_event(self.trip, 'put', '/destinations/d1/spents/s1/spent', 4)
+        self.assertEqual(changes, [Change(('destinations', 'd1', 'spents', 's1'), CHANGED)])
+        self.assertEqual(self.trip.budget, 4)
+
+        apply_event(self.trip, 'patch', '/destinations/d1', {'day': 2, 'transportation': 'bus'})
+        self.assertEqual(self.trip.budget_by_day, {2: 4})
+
+        changes = apply_event(self.trip, 'put', '/destinations/d2/attributions/0', 'x')
+        self.assertEqual(self.destination('d2').attributions, {'0': 'x'})
+        self.assertEqual(changes, [Change(('destinations', 'd2'), CHANGED)])
+
+        self.assertEqual(apply_event(self.trip, 'put', '/name', 'trip'), [])
+        self.assertEqual(apply_event(self.trip, 'put', '/active', False), [Change((), CHANGED)])
+        self.assertFalse(self.trip.active)
+        self.assertEqual(budget_errors(self.trip), [])
+
+    def test_removals(self):
+        changes = apply_event(self.trip, 'put', '/destinations/d1/notes', None)
+        self.assertEqual(changes, [Change(('destinations', 'd1', 'notes', 'n1'), REMOVED)])
+        self.assertEqual(self.destination('d1')._notes, [])
+
+        changes = apply_event(self.trip, 'put', '/destinations/d1', None)
+        self.assertEqual(changes, [Change(('destinations', 'd1'), REMOVED)])
+        self.assertEqual((self.trip.budget, len(self.trip._destinations)), (0, 1))
+
+        self.assertEqual(apply_event(self.trip, 'put', '/', None), [Change((), REMOVED)])
+
+    def test_child_created_by_field(self):
+        changes = apply_event(self.trip, 'put', '/destinations/d3/name', 'c')
+        self.assertEqual(changes, [Change(('destinations', 'd3'), ADDED)])
+        self.assertEqual(self.destination('d3').name, 'c')
+
+
+if __name__ == '__main__':
+    unittest.main()
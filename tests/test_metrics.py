@@ -0,0 +1,67 @@
+import unittest
+
+import tests  # noqa
+from utils.metrics import LatencyHistogram, PhaseTimer, Timer
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_record(self):
+        histogram = LatencyHistogram('test', buckets=[1, 10, 100])
+        for seconds in (0.0005, 0.001, 0.005, 0.05, 0.5):
+            histogram.record(seconds)
+
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.mean, 111.3)
+        self.assertAlmostEqual(histogram.max, 500)
+
+    def test_report(self):
+        histogram = LatencyHistogram('test', buckets=[1, 10])
+        self.assertEqual(histogram.report(), 'test: 0 samples, mean 0.0ms, max 0.0ms')
+
+        histogram.record(0.02)
+        self.assertEqual(histogram.report().splitlines()[1].split(), ['>10ms', '1'])
+
+    def test_timer(self):
+        times = iter([1.0, 1.25])
+        histogram = LatencyHistogram('test')
+        with Timer(histogram, clock=lambda: next(times)) as timer:
+            pass
+
+        self.assertEqual(timer.elapsed, 0.25)
+        self.assertEqual(histogram.count, 1)
+        self.assertAlmostEqual(histogram.total, 250)
+
+
+class PhaseTimerTest(unittest.TestCase):
+
+    def test_phases(self):
+        times = iter([10.0, 10.0, 10.0, 10.1, 10.1, 10.2, 10.6])
+        timer = PhaseTimer('start', clock=lambda: next(times))
+
+        with timer.phase('restore'):
+            pass
+        timer.start('trips')
+        timer.start('account')
+        self.assertFalse(timer.finished)
+
+        timer.wrap('x', lambda: None)   # not recorded until called
+        timer.end('account')
+        timer.end('trips')
+        self.assertTrue(timer.finished)
+        self.assertAlmostEqual(timer.elapsed, 0.6)
+
+        lines = timer.report().splitlines()
+        self.assertEqual(lines[0], 'start: 600.0ms')
+        self.assertEqual(lines[2].split(), ['trips', 'at', '100.0ms', 'took', '500.0ms'])
+
+    def test_wrap(self):
+        timer = PhaseTimer('start')
+        self.assertEqual(timer.wrap('double', lambda x: x * 2)(21), 42)
+        self.assertEqual(list(timer.phases), ['double'])
+        self.assertTrue(timer.finished)
+
+
+if __name__ == '__main__':
+    unittest.main()
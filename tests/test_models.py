@@ -0,0 +1,169 @@
+import unittest
+
+import tests  # noqa
+
+try:
+    from models.trip import Trip, Place, Destination, Note, Spent, budget_errors
+except (ImportError, SyntaxError):
+    Trip = None     # the models are written for Python 2
+
+
+def trip_data():
+    return {
+        'name': 'trip', 'days': 2,
+        'destinations': {
+            'd1': {'name': 'a', 'day': 1,
+                   'notes': {'n1': {'content': 'x'}},
+                   'spents': {'s1': {'content': 'food', 'spent': 10},
+                              's2': {'content': 'taxi', 'spent': 5}}},
+            'd2': {'name': 'b', 'day': 2},
+        },
+    }
+
+
+@unittest.skipIf(Trip is None, 'the models require Python 2')
+class LazyChildrenTest(unittest.TestCase):
+
+    def test_children_built_on_first_access(self):
+        trip = Trip(_id='t', **trip_data())
+        self.assertEqual(trip.budget, 15)
+        self.assertEqual(Trip._destinations.raw(trip), trip_data()['destinations'])
+
+        destinations = sorted(trip._destinations)
+        self.assertIs(trip._destinations[0], trip._destinations[0])
+        self.assertIsNone(Trip._destinations.raw(trip))
+        self.assertEqual([d.name for d in destinations], ['a', 'b'])
+        self.assertEqual(destinations[0].budget, 15)
+        self.assertEqual(sorted(s.spent for s in destinations[0]._spents), [5, 10])
+        self.assertIsNone(destinations[1]._notes)
+
+    def test_full_data(self):
+        expected = dict(trip_data(), _id='t', budget=15)
+
+        # with the raw children
+        self.assertEqual(Trip(_id='t', **trip_data()).full_data(), expected)
+
+        # with the children objects, updated
+        trip = Trip(_id='t', **trip_data())
+        destination = [d for d in trip._destinations if d._id == 'd2'][0]
+        destination._spents = [Spent(_id='s3', content='bed', spent=20)]
+        expected['budget'] = 35
+        expected['destinations']['d1']['budget'] = 15
+        expected['destinations']['d2']['budget'] = 20
+        expected['destinations']['d2']['spents'] = {'s3': {'content': 'bed', 'spent': 20}}
+        self.assertEqual(trip.full_data(), expected)
+
+    def test_set_children(self):
+        trip = Trip(name='new')
+        self.assertIsNone(trip._destinations)
+
+        trip._destinations = [Destination(_id='d', name='a')]
+        self.assertEqual(trip.full_data(with_id=False),
+                         {'name': 'new', 'budget': 0, 'destinations': {'d': {'name': 'a'}}})
+
+        trip.set(destinations={'e': {'name': 'b'}})
+        self.assertEqual([d._id for d in trip._destinations], ['e'])
+
+
+@unittest.skipIf(Trip is None, 'the models require Python 2')
+class BudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trip = Trip(_id='t', **trip_data())
+        self.d1, self.d2 = sorted(self.trip._destinations, key=lambda d: d._id)
+
+    def test_rollups_from_raw_data(self):
+        trip = Trip(_id='t', **trip_data())
+        self.assertEqual(trip.budget_by_day, {1: 15})
+        self.assertEqual(trip.budget_by_transportation, {None: 15})
+        self.assertIsNotNone(Trip._destinations.raw(trip))
+
+    def test_spents(self):
+        spent = Spent(content='bed', spent=30)
+        self.d2.add_spent(spent)
+        self.assertEqual((self.trip.budget, self.d2.budget), (45, 30))
+        self.assertEqual(self.trip.budget_by_day, {1: 15, 2: 30})
+
+        self.d2.update_spent(spent, 25)
+        self.assertEqual((self.trip.budget, self.d2.budget, spent.spent), (40, 25, 25))
+
+        self.d2.remove_spent(spent)
+        self.assertEqual(self.trip.budget_by_day, {1: 15})
+        self.assertEqual(budget_errors(self.trip), [])
+
+    def test_move_destination(self):
+        self.d1.set(day=2, transportation='bus')
+        self.assertEqual(self.trip.budget_by_day, {2: 15})
+        self.assertEqual(self.trip.budget_by_transportation, {'bus': 15})
+        self.assertEqual(self.trip.budget, 15)
+
+    def test_destinations(self):
+        destination = Destination(_id='d3', day=2, spents={'s': {'spent': 7}})
+        self.trip.add_destination(destination)
+        self.assertEqual(self.trip.budget_by_day, {1: 15, 2: 7})
+        destination.add_spent(Spent(spent=1))
+        self.assertEqual(self.trip.budget, 23)
+
+        self.trip.remove_destination(self.d1)
+        self.assertEqual((self.trip.budget, self.trip.budget_by_day), (8, {2: 8}))
+        self.d1.add_spent(Spent(spent=100))     # no longer in the trip
+        self.assertEqual(self.trip.budget, 8)
+        self.assertEqual(budget_errors(self.trip), [])
+
+    def test_consistency_against_recompute(self):
+        import random
+        rand = random.Random(7)
+        destinations = [self.d1, self.d2]
+        for _ in range(500):
+            destination = rand.choice(destinations)
+            action = rand.random()
+            if action < 0.4 or not destination._spents:
+                destination.add_spent(Spent(spent=rand.randint(0, 50)))
+            elif action < 0.6:
+                destination.remove_spent(rand.choice(destination._spents))
+            elif action < 0.8:
+                destination.update_spent(rand.choice(destination._spents), rand.randint(0, 50))
+            else:
+                destination.set(day=rand.randint(1, 3), transportation=rand.choice(['bus', 'car', None]))
+            self.assertEqual(budget_errors(self.trip), [])
+
+        budget, by_day = self.trip.budget, self.trip.budget_by_day
+        self.trip.calculate_budget()
+        self.assertEqual((self.trip.budget, self.trip.budget_by_day), (budget, by_day))
+
+    def test_errors_reported(self):
+        self.d1._spents[0].spent += 1   # bypassing the destination
+        self.assertEqual(len(budget_errors(self.trip)), 4)
+        self.trip.calculate_budget()
+        self.assertEqual(budget_errors(self.trip), [])
+
+
+@unittest.skipIf(Trip is None, 'the models require Python 2')
+class SchemaTest(unittest.TestCase):
+
+    def test_fields(self):
+        self.assertEqual(Destination._fields[:2], ('address', 'attributions'))
+        self.assertEqual(Destination._fields[-4:], ('day', 'time', 'transportation', 'budget'))
+        self.assertFalse(hasattr(Note(content='x'), '__dict__'))
+
+    def test_missing_fields_are_none(self):
+        note = Note(content='x', other='ignored')
+        self.assertIsNone(note.image)
+        self.assertIsNone(note.other)
+        self.assertEqual(note.to_dict(), {'content': 'x'})
+        self.assertRaises(AttributeError, setattr, note, 'other', 1)
+
+    def test_from_dict(self):
+        spent = Spent.from_dict({'content': 'food', 'spent': 3}, '-S')
+        self.assertEqual((spent._id, spent.content, spent.spent), ('-S', 'food', 3))
+
+        spent.set(spent=4, content=None)
+        self.assertEqual(spent.attrs, {'spent': 4})
+
+    def test_place_of_destination(self):
+        destination = Destination(name='a', day=1, latitude=1.5, spents={'s': {'spent': 2}})
+        self.assertEqual(Place(**destination.attrs).attrs, {'name': 'a', 'latitude': 1.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import tests  # noqa
+from cloud.oplog import OperationLog
+
+
+class OperationLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'oplog.json')
+        self.log = OperationLog(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pending_operations_are_persisted(self):
+        self.log.append('set', 'u/trips/a', {'name': 'x'})
+        self.log.append('update', 'u/trips/a', {'days': 2})
+        seq = self.log.append('remove', 'u/active')
+        self.log.ack(seq - 1)
+
+        log = OperationLog(self.filename)
+        self.assertEqual(log.pending(), [(seq, 'remove', 'u/active', None)])
+
+        # new operations continue the sequence
+        self.assertEqual(log.append('remove', 'u/trips/b'), seq + 1)
+
+    def test_file_truncated_when_synchronized(self):
+        seq = self.log.append('set', 'u/trips/a', {'name': 'x'})
+        self.log.ack(seq)
+        self.assertEqual(len(self.log), 0)
+        self.assertEqual(os.path.getsize(self.filename), 0)
+
+    def test_incomplete_line_is_ignored(self):
+        self.log.append('set', 'u/trips/a', {'name': 'x'})
+        with open(self.filename, 'a') as f:
+            f.write('{"seq": 2, "ty')
+        self.assertEqual(len(OperationLog(self.filename)), 1)
+
+    def test_is_pending(self):
+        self.log.append('update', 'u/trips/a', {'destinations/d/day': 1})
+        self.assertTrue(self.log.is_pending('u/trips'))
+        self.assertTrue(self.log.is_pending('u/trips/a/destinations/d'))
+        self.assertFalse(self.log.is_pending('u/trips/b'))
+
+    def test_overlay(self):
+        self.log.append('update', 'u/trips/a', {'name': 'y', 'destinations/d/day': 2})
+        self.log.append('remove', 'u/trips/b')
+        self.log.append('set', 'u/trips/c', {'name': 'z'})
+
+        server = {'a': {'name': 'x', 'destinations': {'d': {'day': 1}}},
+                  'b': {'name': 'w'}}
+        self.assertEqual(self.log.overlay('u/trips', server), {
+            'a': {'name': 'y', 'destinations': {'d': {'day': 2}}},
+            'c': {'name': 'z'},
+        })
+        self.assertEqual(self.log.overlay('u/trips/c/name', None), 'z')
+        self.assertIsNone(self.log.overlay('u/trips/b', {'name': 'w'}))
+
+    def test_overlay_returns_copies(self):
+        self.log.append('set', 'u/trips/c', {'name': 'z'})
+        value = self.log.overlay('u/trips/c', None)
+        value['name'] = 'changed'
+        self.assertEqual(self.log.pending()[0][3], {'name': 'z'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import io
+import random
+import unittest
+from array import array
+
+import tests  # noqa
+import png
+
+
+def gradient(width, height, planes=3):
+    rand = random.Random(1)
+    return [[(x * (p + 1) + y * 2 + rand.randint(0, 3)) % 256 for x in range(width) for p in range(planes)]
+            for y in range(height)]
+
+
+def encode(rows, width, filter_type, **kwargs):
+    f = io.BytesIO()
+    png.Writer(width, len(rows), filter_type=filter_type, **kwargs).write(f, rows)
+    return f.getvalue()
+
+
+def decode(data):
+    return [list(row) for row in png.Reader(bytes=data).read()[2]]
+
+
+class FilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = png.numpy
+        self.addCleanup(setattr, png, 'numpy', self.numpy)
+
+    def test_filters_decoded(self):
+        rows = gradient(40, 12)
+        for filter_type in png.FILTER_TYPES + (png.ADAPTIVE,):
+            self.assertEqual(decode(encode(rows, 40, filter_type)), rows, filter_type)
+
+    def test_filters_of_packed_and_16_bit_rows(self):
+        qr = [[random.Random(y).randint(0, 1) for _ in range(29)] for y in range(29)]
+        self.assertEqual(decode(encode(qr, 29, png.ADAPTIVE, greyscale=True, bitdepth=1)), qr)
+        deep = [[value * 257 for value in row] for row in gradient(10, 6, planes=2)]
+        self.assertEqual(decode(encode(deep, 10, 4, greyscale=True, alpha=True, bitdepth=16)), deep)
+
+    def test_adaptive_smaller(self):
+        rows = gradient(200, 50)
+        self.assertLess(len(encode(rows, 200, png.ADAPTIVE)), len(encode(rows, 200, None)))
+
+    def test_invalid_filter_type(self):
+        self.assertRaises(ValueError, png.Writer, 1, 1, filter_type=5)
+
+    @unittest.skipIf(png.numpy is None, 'NumPy is not installed')
+    def test_numpy_same_as_python(self):
+        rows = [array('B', row) for row in gradient(31, 3, planes=4)]
+        for filter_type in png.FILTER_TYPES:
+            for prev in (None, rows[0]):
+                png.numpy = self.numpy
+                vectorized = png.filter_scanline(filter_type, rows[1], 4, prev)
+                png.numpy = None
+                self.assertEqual(png.filter_scanline(filter_type, rows[1], 4, prev), vectorized)
+        png.numpy = None
+        python = png.adaptive_filter(rows[2], 4, rows[1])
+        png.numpy = self.numpy
+        self.assertEqual(png.adaptive_filter(rows[2], 4, rows[1]), python)
+
+
+class StreamTest(unittest.TestCase):
+
+    def chunks(self, data):
+        return [(tag, len(content)) for tag, content in png.Reader(bytes=data).chunks()]
+
+    def test_fixed_size_idat_chunks(self):
+        rows = gradient(100, 100)
+        data = encode(rows, 100, None, compression=0, idat_size=4096)
+        idat = [length for tag, length in self.chunks(data) if tag == b'IDAT']
+        self.assertEqual(set(idat[:-1]), {4096})
+        self.assertLessEqual(idat[-1], 4096)
+        self.assertEqual(decode(data), rows)
+
+    def test_strategy(self):
+        rows = [[255] * 30 + [0] * 30] * 40
+        for strategy in (png.Z_RLE, png.Z_FILTERED, png.Z_HUFFMAN_ONLY):
+            self.assertEqual(decode(encode(rows, 60, None, greyscale=True, strategy=strategy)), rows)
+
+    def test_rows_streamed(self):
+        # the chunks are written while the rows are produced
+        f = io.BytesIO()
+        written = []
+
+        def rows():
+            for row in gradient(256, 200):
+                written.append(f.tell())
+                yield row
+        png.Writer(256, 200, chunk_limit=4096, idat_size=1024).write(f, rows())
+        self.assertGreater(written[100], 0)
+        self.assertLess(written[100], f.tell() * 3 // 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,437 @@
+import hashlib
+import json
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import tests  # noqa
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+try:
+    from pyrebase import pyrebase
+    import requests
+    from cloud import cache
+    from cloud.base import CollectionManager, ConflictError
+except ImportError:
+    pyrebase = None
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, data, status=200, etag=None):
+        body = b'' if status == 304 else json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None and self.headers.get('X-Firebase-ETag') == 'true':
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def node_path(self):
+        path = self.path.partition('?')[0]
+        return [key for key in path[:-len('.json')].split('/') if key]
+
+    def do_GET(self):
+        # answer with the node at the path, or the path and the query of the
+        # request if the server has no data
+        path, _, query = self.path.partition('?')
+        self.server.requests.append(self.path)
+        if self.server.data is None:
+            self.respond({'path': path, 'query': query})
+            return
+        node = self.server.node(self.node_path())
+        etag = self.server.etag(node)
+        self.respond(node, 304 if self.headers.get('If-None-Match') == etag else 200, etag)
+
+    def do_PUT(self):
+        # conditional write of a node
+        self.server.requests.append(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length).decode('utf-8'))
+        path = self.node_path()
+        etag = self.server.etag(self.server.node(path))
+        if self.headers.get('if-match') not in (None, etag):
+            self.respond(self.server.node(path), 412, etag)
+            return
+        parent = self.server.data
+        for key in path[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[path[-1]] = data
+        self.respond(data, 200, self.server.etag(data))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.respond(json.loads(self.rfile.read(length).decode('utf-8')))
+
+
+class JSONServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in of a Firebase database keeping the connections alive"""
+
+    daemon_threads = True
+
+    def __init__(self, data=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), JSONHandler)
+        self.data = data
+        self.requests = []
+        threading.Thread(target=self.serve_forever).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def node(self, path):
+        node = self.data
+        for key in path:
+            node = node.get(key) if isinstance(node, dict) else None
+        return node
+
+    @staticmethod
+    def etag(node):
+        return hashlib.sha1(json.dumps(node, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def firebase_config(database_url, **kwargs):
+    return dict(apiKey='key', authDomain='', storageBucket='bucket',
+                databaseURL=database_url, **kwargs)
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class GenerateKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = pyrebase.Database(None, None, 'https://example.firebaseio.com', None)
+
+    def test_keys_are_unique_and_ordered(self):
+        keys = [self.db.generate_key() for _ in range(5000)]
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(keys, sorted(keys))
+        self.assertTrue(all(len(key) == 20 for key in keys))
+        self.assertEqual(len(self.db.last_rand_chars), 12)
+
+    def test_increment_carries(self):
+        # a key generated in the same millisecond as the previous one
+        self.db.last_push_time = 1500000000000
+        self.db.last_rand_chars = [5] + [63] * 11
+        time, pyrebase.time.time = pyrebase.time.time, lambda: 1500000000.0
+        try:
+            key = self.db.generate_key()
+        finally:
+            pyrebase.time.time = time
+        self.assertEqual(self.db.last_rand_chars, [6] + [0] * 11)
+        self.assertEqual(key[8:], '5' + '-' * 11)
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = JSONServer()
+        self.firebase = pyrebase.initialize_app(firebase_config(self.server.url, poolMaxsize=2))
+
+    def tearDown(self):
+        self.firebase.requests.close()
+        self.server.stop()
+
+    def test_connections_reused(self):
+        db = self.firebase.database()
+        for i in range(5):
+            self.assertEqual(db.child('trips', str(i)).get().val()['path'], '/trips/{}.json'.format(i))
+
+        stats = self.firebase.connection_stats
+        self.assertEqual((stats.requests, stats.opened, stats.reused), (5, 1, 4))
+        self.assertIn('5 requests', stats.report())
+
+    def test_auth_uses_session(self):
+        # the requests to the identity toolkit are sent to the local server
+        adapter = self.firebase.requests.get_adapter(self.server.url)
+        send, url = adapter.send, self.server.url
+
+        def redirect(request, **kwargs):
+            request.url = url + request.path_url
+            return send(request, **kwargs)
+        adapter.send = redirect
+        self.firebase.requests.mount('https://www.googleapis.com', adapter)
+
+        auth = self.firebase.auth()
+        auth.get_account_info('token')
+        auth.sign_in_with_email_and_password('a@b.c', 'secret')
+
+        self.assertEqual(auth.current_user['email'], 'a@b.c')
+        stats = self.firebase.connection_stats
+        self.assertEqual((stats.requests, stats.opened), (2, 1))
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class ReferenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = pyrebase.Database(None, None, 'https://example.firebaseio.com', None)
+
+    def test_references_are_immutable(self):
+        trips = self.db.child('/u', 'trips')
+        page = trips.order_by_child('$key').limit_to_first(2)
+        self.assertEqual((trips.path, trips.query), ('u/trips', ()))
+        self.assertEqual(trips.child('t').path, 'u/trips/t')
+        self.assertEqual(page.child('t').query, page.query)
+        self.assertRaises(AttributeError, setattr, page, 'other', 1)
+
+        # the request URL is built without resetting the reference
+        for _ in range(2):
+            url, _, query = page.build_request_url('x').partition('?')
+            self.assertEqual(url, 'https://example.firebaseio.com/u/trips.json')
+            self.assertEqual(sorted(query.split('&')),
+                             ['auth=x', 'limitToFirst=2', 'orderBy=%2522%2524key%2522'])
+
+    def test_last_parameter_value_used(self):
+        ref = self.db.child('a').limit_to_first(1).limit_to_first(3)
+        self.assertIn('limitToFirst=3', ref.build_request_url(None))
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class QueryResultTest(unittest.TestCase):
+
+    def test_order_of_values(self):
+        children = {'a': {'v': 'x'}, 'b': {'v': 2}, 'c': {'v': True}, 'd': {},
+                    'e': {'v': False}, 'f': {'v': {'k': 1}}, 'g': {'v': 1.5}, 'h': {'v': 2}}
+        result = pyrebase.QueryResult.from_dict(children, 'n', 'v')
+        self.assertEqual(result.keys(), ['d', 'e', 'c', 'g', 'b', 'h', 'a', 'f'])
+
+        result = pyrebase.QueryResult.from_dict({'a': 3, 'b': None, 'c': 'z'}, 'n', '$value')
+        self.assertEqual(result.keys(), ['b', 'a', 'c'])
+
+    def test_order_of_keys(self):
+        children = dict.fromkeys(['b', '10', '9', '-1', 'a', '2147483648', '007'], 0)
+        result = pyrebase.QueryResult.from_dict(children, 'n', '$key')
+        self.assertEqual(result.keys(), ['-1', '9', '10', '007', '2147483648', 'a', 'b'])
+
+    def test_limit_and_range(self):
+        children = dict(('k{}'.format(i), {'day': i % 4}) for i in range(12))
+        result = pyrebase.QueryResult.from_dict(children, 'n', 'day')
+        self.assertEqual(result.range(1, 2).keys(), ['k1', 'k5', 'k9', 'k10', 'k2', 'k6'])
+        self.assertEqual(result.range(start=3).keys(), ['k11', 'k3', 'k7'])
+        self.assertEqual(result.range(end=0).limit(2).keys(), ['k0', 'k4'])
+        self.assertEqual(result.limit(2, last=True).keys(), ['k3', 'k7'])
+        self.assertEqual(len(result.limit(20)), 12)
+        self.assertEqual(len(result.limit(0, last=True)), 0)
+
+        keys = pyrebase.QueryResult.from_dict(children, 'n', '$key')
+        self.assertEqual(keys.range('k10', 'k2').keys(), ['k10', 'k11', 'k2'])
+        self.assertRaises(ValueError, pyrebase.QueryResult([], 'n').range, 1)
+
+    def test_items_and_val(self):
+        result = pyrebase.QueryResult.from_dict({'b': 2, 'a': 1}, 'n', '$key')
+        self.assertEqual(list(result), [('a', 1), ('b', 2)])
+        self.assertEqual(list(result.val().items()), [('a', 1), ('b', 2)])
+        self.assertIs(result.val(), result.val())
+        self.assertEqual([(item.key(), item.val()) for item in result.each()], [('a', 1), ('b', 2)])
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class ChildrenDecoderTest(unittest.TestCase):
+
+    def decode(self, data, size):
+        decoder = pyrebase.ChildrenDecoder()
+        items = []
+        for i in range(0, len(data), size):
+            items.extend(decoder.feed(data[i:i + size]))
+        return items + decoder.close()
+
+    def test_chunks(self):
+        children = {u'a': 12345, u'b\u00e9:"x': {u'c': [1, 2.5e3, None, True]}, u'z': u'\u20ac'}
+        data = json.dumps(children, indent=1).encode('utf-8')
+        for size in (1, 2, 7, len(data)):
+            items = self.decode(data, size)
+            self.assertEqual(dict(items), children)
+            self.assertEqual(len(items), 3)
+
+    def test_children_returned_once_complete(self):
+        decoder = pyrebase.ChildrenDecoder()
+        self.assertEqual(decoder.feed(b'{"a": {"x": 1}, "b": 12'), [('a', {'x': 1})])
+        self.assertEqual(decoder.feed(b'3, "c": '), [('b', 123)])
+        self.assertEqual(decoder.feed(b'null}'), [('c', None)])
+        self.assertEqual(decoder.close(), [])
+
+    def test_other_nodes(self):
+        self.assertEqual(self.decode(b'null', 2), [])
+        self.assertEqual(self.decode(b' { } ', 2), [])
+        self.assertEqual(self.decode(b'[null, {"a": 1}]', 2), [('1', {'a': 1})])
+        for data in (b'{"a": 1', b'{"a": 1} x', b'3'):
+            self.assertRaises(ValueError, self.decode, data, 2)
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class OrderedQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        children = dict(('d{}'.format(i), {'day': 3 - i % 3, 'name': str(i)}) for i in range(6))
+        children['x'] = {'name': 'no day'}
+        self.server = JSONServer({'u': {'destinations': children}})
+        self.firebase = pyrebase.initialize_app(firebase_config(self.server.url))
+
+    def tearDown(self):
+        self.firebase.requests.close()
+        self.server.stop()
+
+    def test_get_sorted_by_child(self):
+        db = self.firebase.database()
+        result = db.child('u', 'destinations').order_by_child('day').get()
+        self.assertEqual(result.keys(), ['x', 'd2', 'd5', 'd1', 'd4', 'd0', 'd3'])
+        self.assertEqual(result.key(), 'destinations')
+
+    def manager(self):
+        backend = type('Backend', (object,), dict(
+            db=self.firebase.database(), storage=None, token='t', sync=None,
+            cache=cache.PathCache(cache.MemoryCache(ttl=None))))()
+        return CollectionManager(backend, 'u')
+
+    def test_iter_children(self):
+        db = self.firebase.database()
+        items = list(db.child('u', 'destinations').iter_children(chunk_size=16))
+        self.assertEqual(dict(items), self.server.data['u']['destinations'])
+        self.assertEqual(list(db.child('u', 'nothing').iter_children()), [])
+
+        # the node is cached once all the children have been read
+        manager = self.manager()
+        self.assertEqual(len(list(manager.iter_children('destinations'))), 7)
+        self.assertEqual(list(manager.iter_children('destinations')), items)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_conditional_get(self):
+        manager = self.manager()
+        trip = manager.val('destinations', 'd1', etag=True)
+        self.assertEqual(trip, {'day': 2, 'name': '1'})
+
+        # served from the cache as it has not changed
+        self.assertEqual(manager.val('destinations', 'd1', etag=True), trip)
+        self.assertEqual(len(self.server.requests), 2)
+
+        self.server.data['u']['destinations']['d1']['day'] = 5
+        self.assertEqual(manager.val('destinations', 'd1', etag=True), {'day': 5, 'name': '1'})
+        self.assertEqual(manager.val('destinations', 'd1'), {'day': 5, 'name': '1'})
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_compare_and_set(self):
+        manager, other = self.manager(), self.manager()
+        _, etag = manager.val_with_etag('destinations', 'd1')
+        _, other_etag = other.val_with_etag('destinations', 'd1')
+
+        manager.compare_and_set({'day': 1}, etag, 'destinations', 'd1')
+        self.assertEqual(self.server.data['u']['destinations']['d1'], {'day': 1})
+        self.assertEqual(len(self.server.requests), 3)
+
+        # the other device did not read the change
+        with self.assertRaises(ConflictError) as context:
+            other.compare_and_set({'day': 4}, other_etag, 'destinations', 'd1')
+        self.assertEqual(context.exception.value, {'day': 1})
+        self.assertEqual(other.val('destinations', 'd1'), {'day': 1})
+        self.assertEqual(self.server.data['u']['destinations']['d1'], {'day': 1})
+
+        # which can then be written without reading again
+        other.compare_and_set({'day': 4}, context.exception.etag, 'destinations', 'd1')
+        self.assertEqual(self.server.data['u']['destinations']['d1'], {'day': 4})
+        self.assertEqual(len(self.server.requests), 5)
+
+    def test_check_unchanged(self):
+        manager = self.manager()
+        value, etag = manager.val_with_etag('destinations', 'd1')
+        self.assertEqual((value, etag), ({'day': 2, 'name': '1'}, self.server.etag(value)))
+        self.assertIs(manager.check_unchanged(etag, 'destinations', 'd1'), True)
+
+        # changed by another device after it was read
+        self.server.data['u']['destinations']['d1']['day'] = 5
+        with self.assertRaises(ConflictError) as context:
+            manager.check_unchanged(etag, 'destinations', 'd1')
+        self.assertEqual(context.exception.value, {'day': 5, 'name': '1'})
+        self.assertEqual(manager.val('destinations', 'd1'), {'day': 5, 'name': '1'})
+        self.assertIs(manager.check_unchanged(context.exception.etag, 'destinations', 'd1'), True)
+
+        # offline, the node is written without check
+        offline = pyrebase.initialize_app(firebase_config('http://127.0.0.1:1'))
+        self.addCleanup(offline.requests.close)
+        manager._backend.db = offline.database()
+        self.assertIs(manager.check_unchanged(etag, 'destinations', 'd1'), False)
+
+    def test_list_by(self):
+        manager = self.manager()
+
+        # the filters are sent to the server, which does not apply them here
+        result = manager.list_by('day', None, 'destinations', start=2, limit=3)
+        self.assertEqual(sorted(self.server.requests[-1].partition('?')[2].split('&')),
+                         ['auth=t', 'limitToFirst=3', 'orderBy=%2522day%2522', 'startAt=2'])
+        self.assertEqual(result.range(start=2).limit(3).keys(), ['d1', 'd4', 'd0'])
+
+        # the cached result is in the same order
+        cached = manager.list_by('day', None, 'destinations', start=2, limit=3)
+        self.assertEqual(cached.keys(), result.keys())
+        self.assertEqual(len(self.server.requests), 1)
+
+        result = manager.list_by('day', 3, 'destinations')
+        self.assertIn('equalTo=3', self.server.requests[-1])
+        self.assertEqual([(key, value['name']) for key, value in result.range(3, 3)],
+                         [('d0', '0'), ('d3', '3')])
+        self.assertEqual(manager.list_by('day', None, 'nothing').keys(), [])
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class ConcurrentQueriesTest(unittest.TestCase):
+    """Queries sent by a thread pool with a single database object"""
+
+    THREADS = 16
+    QUERIES = 2000
+
+    def setUp(self):
+        self.server = JSONServer()
+        self.firebase = pyrebase.initialize_app(firebase_config(self.server.url, poolMaxsize=self.THREADS))
+
+    def tearDown(self):
+        self.firebase.requests.close()
+        self.server.stop()
+
+    def test_stress(self):
+        db = self.firebase.database()
+        trips = db.child('users', 'u', 'trips')
+
+        def query(i):
+            ref = trips.child(str(i))
+            if i % 2:
+                ref = ref.order_by_child('$key').limit_to_first(i)
+            return i, ref.get(token='t{}'.format(i)).val()
+
+        pool = ThreadPoolExecutor(max_workers=self.THREADS)
+        try:
+            results = list(pool.map(query, range(self.QUERIES)))
+        finally:
+            pool.shutdown()
+
+        # each request was sent with its own path and query
+        for i, echo in results:
+            self.assertEqual(echo['path'], '/users/u/trips/{}.json'.format(i))
+            query = sorted(echo['query'].split('&'))
+            if i % 2:
+                self.assertEqual(query, ['auth=t{}'.format(i), 'limitToFirst={}'.format(i),
+                                         'orderBy=%2522%2524key%2522'])
+            else:
+                self.assertEqual(query, ['auth=t{}'.format(i)])
+
+        stats = self.firebase.connection_stats
+        self.assertEqual(stats.requests, self.QUERIES)
+        self.assertLessEqual(stats.opened, self.THREADS)
+
+
+if __name__ == '__main__':
+    unittest.main()
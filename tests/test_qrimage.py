@@ -0,0 +1,43 @@
+import random
+import unittest
+
+import tests  # noqa
+import png
+from utils import qrimage
+
+
+def matrix(size, seed=1):
+    rand = random.Random(seed)
+    return [[rand.random() < 0.5 for _ in range(size)] for _ in range(size)]
+
+
+def read_pixels(data):
+    width, height, rows, info = png.Reader(bytes=data).read()
+    return (width, height), [list(row) for row in rows], info
+
+
+class EncodeQRTest(unittest.TestCase):
+
+    def test_dark_modules_black(self):
+        qr = matrix(25)
+        size, rows, info = read_pixels(qrimage.encode_qr(qr))
+        self.assertEqual((size, info['bitdepth'], info['greyscale']), ((25, 25), 1, True))
+        self.assertEqual(rows, [[0 if module else 1 for module in row] for row in qr])
+
+    def test_scale_and_border(self):
+        qr = [[True, False], [False, True]]
+        size, rows, _ = read_pixels(qrimage.encode_qr(qr, scale=3, border=1))
+        self.assertEqual(size, (12, 12))
+        self.assertEqual(rows[0], [1] * 12)
+        self.assertEqual(rows[3:6], [[1] * 3 + [0] * 3 + [1] * 6] * 3)
+        self.assertEqual(rows[6:9], [[1] * 6 + [0] * 3 + [1] * 3] * 3)
+        self.assertEqual(rows[9:], [[1] * 12] * 3)
+
+    def test_memoized_by_key(self):
+        data = qrimage.encode_qr(matrix(21), key='http://example.com/u/t?trip')
+        self.assertIs(qrimage.encode_qr(matrix(21, seed=2), key='http://example.com/u/t?trip'), data)
+        self.assertIsNot(qrimage.encode_qr(matrix(21), key='http://example.com/u/t?trip', scale=2), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import tests  # noqa
+
+try:
+    import config
+    from cloud.share_manager import ShareManager, parse_share_url
+    from models.trip import Trip, Destination, Note
+    from tests.test_trip_manager import FakeBackend, FakeDatabase
+except ImportError:
+    ShareManager = None
+
+
+@unittest.skipIf(ShareManager is None, 'app dependencies are not installed')
+class ShareManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase({'u': {'trips': {
+            't1': {'name': 'Tour', 'destinations': {
+                'd1': {'name': 'Museum', 'day': 1, 'notes': {'n1': {'content': 'Open at 9'}}},
+                'd2': {'name': 'Park', 'day': 2}}},
+            't2': {'name': 'Other', 'destinations': {'d3': {'name': 'Beach', 'day': 1}}}}}})
+        backend = FakeBackend(self.db)
+        self.addCleanup(shutil.rmtree, backend.image_cache.directory)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.manifest = os.path.join(self.directory, 'qrcodes.json')
+        self.manager = ShareManager(backend, manifest=self.manifest)
+
+    def url(self, *path):
+        kind = ('trip', 'destination', 'note')[len(path) - 2]
+        return config.BACKEND_URL + '/' + '/'.join(path) + '?' + kind
+
+    def test_parse_share_url(self):
+        self.assertEqual(parse_share_url(self.url('u', 't1', 'd1')), ('destination', ('u', 't1', 'd1', None)))
+        for url in ('http://example.com/u/t1?trip', config.BACKEND_URL + '/u/t1?note',
+                    config.BACKEND_URL + '/u//d1?destination'):
+            self.assertRaises(ValueError, parse_share_url, url)
+
+    def test_scanned_again(self):
+        url = self.url('u', 't1', 'd1', 'n1')
+        note = self.manager.get_by_url(url)
+        self.assertIsInstance(note, Note)
+        self.assertEqual((note._id, note.content), ('n1', 'Open at 9'))
+        self.manager.get_by_url(url)
+        self.assertEqual(len(self.db.requests), 1)
+        self.assertIs(self.manager.get_by_url(url, validation='note'), True)
+
+    def test_concurrent_scans_share_a_request(self):
+        calls = []
+
+        def val(*path):
+            calls.append(path)
+            time.sleep(0.2)
+            return {'name': 'Tour'}
+        self.manager.val = val
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            trips = list(executor.map(self.manager.get_by_url, [self.url('u', 't1')] * 4))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(trip.name for trip in trips), {'Tour'})
+        self.assertEqual(len(set(id(trip) for trip in trips)), 4)
+
+    def test_get_by_urls(self):
+        urls = [self.url('u', 't1', 'd1'), self.url('u', 't1', 'd2'), self.url('u', 't1', 'd1', 'n1'),
+                self.url('u', 't2', 'd3'), self.url('u', 't1', 'd9'), 'invalid']
+        objects = self.manager.get_by_urls(urls)
+
+        self.assertEqual([type(obj) for obj in objects[:4]], [Destination, Destination, Note, Destination])
+        self.assertEqual([obj.name for obj in objects[:2]], ['Museum', 'Park'])
+        self.assertEqual(objects[3]._id, 'd3')
+        self.assertIsInstance(objects[4], ValueError)
+        self.assertIsInstance(objects[5], ValueError)
+        # the destinations of the first trip are read with the trip
+        self.assertEqual(sorted(path for _, path, _ in self.db.requests),
+                         ['u/trips/t1', 'u/trips/t2/destinations/d3'])
+
+        self.assertIsInstance(self.manager.get_by_urls([self.url('u', 't1')])[0], Trip)
+        self.assertEqual(len(self.db.requests), 2)
+
+    def test_qrcode_uploaded_once(self):
+        uploads = []
+        put = self.manager.put
+
+        def count_put(file, *path, **kwargs):
+            uploads.append('/'.join(path))
+            return put(file, *path, **kwargs)
+        self.manager.put = count_put
+
+        url = self.url('u', 't1')
+        qr = [[True, False], [False, True]]
+        image = self.manager.upload_qrcode('t1', qr, url)
+        self.assertEqual((image, uploads), ('url/shared/t1.png', ['shared/t1.png']))
+        self.assertEqual(self.manager.upload_qrcode('t1', None, url), image)
+
+        # the manifest is kept between sessions, the same code is not uploaded
+        manager = ShareManager(self.manager._backend, manifest=self.manifest)
+        manager.put = count_put
+        self.assertEqual(manager.upload_qrcode('t1', qr, url + '&v=2'), image)
+        self.assertEqual(manager.upload_qrcode('t1', None, url + '&v=2'), image)
+        self.assertEqual(len(uploads), 1)
+
+        manager.upload_qrcode('t1', [[False, True], [True, False]], url + '&v=3')
+        self.assertEqual(len(uploads), 2)
+        with open(self.manager.image_cache.get(image), 'rb') as f:
+            self.assertEqual(f.read()[:4], b'\x89PNG')
+
+
+if __name__ == '__main__':
+    unittest.main()
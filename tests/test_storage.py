@@ -0,0 +1,166 @@
+import io
+import json
+import threading
+import unittest
+
+import tests  # noqa
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+try:
+    from pyrebase import pyrebase
+    import requests
+except ImportError:
+    pyrebase = None
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, data=None, **headers):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name.replace('_', '-'), value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        self.respond(200, {'name': server.name, 'size': len(server.received)})
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.commands.append('put')
+        self.server.received = body
+        self.respond(200, {'name': 'simple', 'size': len(body)})
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        command = self.headers['X-Goog-Upload-Command']
+        server.commands.append(command)
+
+        if command == 'start':
+            server.name = json.loads(body.decode('utf-8'))['name']
+            server.received, server.final = b'', False
+            self.respond(200, X_Goog_Upload_URL=server.url + '/upload')
+        elif command == 'query':
+            self.respond(200, X_Goog_Upload_Size_Received=str(len(server.received)),
+                         X_Goog_Upload_Status='final' if server.final else 'active')
+        elif int(self.headers['X-Goog-Upload-Offset']) != len(server.received):
+            self.respond(400)
+        else:
+            failure = server.failures.pop(0) if server.failures else None
+            if failure == 'before':
+                # the connection drops before the chunk is received
+                self.close_connection = True
+                return
+            server.received += body
+            server.final = 'finalize' in command
+            if failure == 'after':
+                # the chunk is received, not the response
+                self.close_connection = True
+            elif failure == 'error':
+                self.respond(503)
+            elif server.final:
+                self.respond(200, {'name': server.name, 'size': len(server.received)})
+            else:
+                self.respond(200, X_Goog_Upload_Status='active')
+
+
+class UploadServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in of Firebase Storage receiving a resumable upload,
+    failing the chunk requests listed in `failures`"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), UploadHandler)
+        self.commands = []
+        self.failures = []
+        self.received = b''
+        self.final = False
+        threading.Thread(target=self.serve_forever).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def handle_error(self, request, client_address):
+        pass
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@unittest.skipIf(pyrebase is None, 'pyrebase dependencies are not installed')
+class ResumableUploadTest(unittest.TestCase):
+
+    CHUNK = pyrebase.UPLOAD_GRANULARITY if pyrebase else 0
+
+    def setUp(self):
+        self.server = UploadServer()
+        self.session = requests.Session()
+        self.data = bytes(bytearray(i % 251 for i in range(3 * self.CHUNK + 100)))
+        self.progress = []
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+
+    def upload(self, retries=3):
+        upload = pyrebase.ResumableUpload(self.session, self.server.url + '/v0/b/bucket', 'u/photo.jpg',
+                                          io.BytesIO(self.data), len(self.data), 'token', self.CHUNK,
+                                          lambda sent, size: self.progress.append(sent),
+                                          retries=retries, delay=0)
+        return upload.run()
+
+    def test_chunks(self):
+        self.assertEqual(self.upload(), {'name': 'u/photo.jpg', 'size': len(self.data)})
+        self.assertEqual(self.server.received, self.data)
+        self.assertEqual(self.server.commands, ['start', 'upload', 'upload', 'upload', 'upload, finalize'])
+        self.assertEqual(self.progress, [self.CHUNK, 2 * self.CHUNK, 3 * self.CHUNK, len(self.data)])
+
+    def test_only_failed_chunks_retried(self):
+        self.server.failures = [None, 'before', 'after', 'error']
+        self.assertEqual(self.upload()['size'], len(self.data))
+        self.assertEqual(self.server.received, self.data)
+        self.assertEqual(self.server.commands,
+                         ['start', 'upload', 'upload', 'query', 'upload', 'query', 'upload',
+                          'query', 'upload, finalize'])
+
+    def test_lost_response_of_last_chunk(self):
+        self.server.failures = [None, None, None, 'after']
+        self.assertEqual(self.upload(), {'name': 'u/photo.jpg', 'size': len(self.data)})
+        self.assertEqual(self.server.commands[-2:], ['upload, finalize', 'query'])
+
+    def test_too_many_failures(self):
+        self.server.failures = ['before'] * 3
+        self.assertRaises(requests.exceptions.ConnectionError, self.upload, retries=2)
+
+    def test_storage_put(self):
+        storage = pyrebase.Storage(None, 'bucket', self.session)
+        storage.storage_bucket = self.server.url + '/v0/b/bucket'
+
+        storage.child('u', 'small.png').put(io.BytesIO(b'png'), 'token', chunk_size=self.CHUNK)
+        self.assertEqual(self.server.commands, ['put'])
+
+        result = storage.child('u', 'photo.jpg').put(io.BytesIO(self.data), 'token', chunk_size=self.CHUNK,
+                                                     progress=lambda sent, size: self.progress.append(size))
+        self.assertEqual(result['size'], len(self.data))
+        self.assertEqual(set(self.progress), {len(self.data)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+import json
+import threading
+import unittest
+
+import tests  # noqa
+from cloud.cache import apply_update, normalize_path
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from Queue import Queue, Empty
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from queue import Queue, Empty
+
+try:
+    from cloud.streams import StreamManager, Backoff, diff, parse_events
+except ImportError:
+    StreamManager = None
+
+
+def node_at(root, path):
+    for key in path.split('/') if path else ():
+        root = root.get(key) if isinstance(root, dict) else None
+    return root
+
+
+class SSEHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def write_chunk(self, text):
+        body = text.encode('utf-8')
+        self.wfile.write(('%x\r\n' % len(body)).encode('ascii') + body + b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        server = self.server
+        path = normalize_path(self.path.split('?')[0][:-len('.json')])
+        if server.refuse:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            self.close_connection = True
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        queue = Queue()
+        with server.lock:
+            server.requests.append(self.path)
+            server.clients.append((path, queue))
+            snapshot = node_at(server.data, path)
+        self.write_chunk(server.message('put', '/', snapshot))
+        try:
+            while True:
+                message = queue.get()
+                if message is None:
+                    break
+                self.write_chunk(message)
+            self.write_chunk('')    # end of the stream
+        finally:
+            with server.lock:
+                server.clients.remove((path, queue))
+            self.close_connection = True
+
+
+class SSEServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in of the streaming REST API of a Firebase database:
+    GET <path>.json sends the node and then its changes as events"""
+
+    daemon_threads = True
+
+    def __init__(self, data=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), SSEHandler)
+        self.data = data or {}
+        self.lock = threading.Lock()
+        self.clients = []
+        self.requests = []
+        self.refuse = False
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def handle_error(self, request, client_address):
+        pass    # the clients close their streams
+
+    @staticmethod
+    def message(event, path, data):
+        return 'event: {}\ndata: {}\n\n'.format(event, json.dumps({'path': path, 'data': data}))
+
+    def write(self, event, path, data):
+        """Write the data like a put or patch request, and send the event to
+        the streams of the related nodes"""
+        path = normalize_path(path)
+        with self.lock:
+            update = {path: data} if event == 'put' else dict(
+                (normalize_path(path, key), value) for key, value in data.items())
+            if path or event == 'patch':
+                self.data = apply_update(self.data, update)
+            else:
+                self.data = data
+            for client_path, queue in self.clients:
+                if path == client_path or path.startswith(client_path + '/') or not client_path:
+                    queue.put(self.message(event, '/' + path[len(client_path):].lstrip('/'), data))
+                elif client_path.startswith(path + '/') or not path:
+                    queue.put(self.message('put', '/', node_at(self.data, client_path)))
+
+    def drop(self):
+        """End the streams, like a network failure"""
+        with self.lock:
+            for _, queue in self.clients:
+                queue.put(None)
+
+
+@unittest.skipIf(StreamManager is None, 'app dependencies are not installed')
+class DiffTest(unittest.TestCase):
+
+    def test_diff(self):
+        old = {'a': {'x': 1, 'y': 2}, 'b': 1, 'c': {}}
+        new = {'a': {'x': 1, 'y': 3, 'z': {'k': 0}}, 'c': None}
+        self.assertEqual(sorted(diff(old, new)), [('/a/y', 3), ('/a/z', {'k': 0}), ('/b', None)])
+        self.assertEqual(diff(old, old), [])
+        self.assertEqual(diff(None, 1), [('/', 1)])
+
+    def test_parse_events(self):
+        chunks = ['event: put\r\ndata: {"path"', ': "/"}\r\n\r\n: comment\n',
+                  'event: keep-alive\ndata: null\n', '\n']
+        self.assertEqual(list(parse_events(chunks)),
+                         [('put', '{"path": "/"}'), ('keep-alive', 'null')])
+
+    def test_backoff(self):
+        backoff = Backoff(base=1, max_delay=10, random=lambda: 1.0)
+        self.assertEqual([backoff.delay(n) for n in range(5)], [1, 2, 4, 8, 10])
+        self.assertEqual(Backoff(random=lambda: 0.0).delay(3), 0)
+
+
+@unittest.skipIf(StreamManager is None, 'app dependencies are not installed')
+class StreamManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SSEServer({'u': {'trips': {'t1': {'name': 'a', 'days': 1},
+                                                 't2': {'name': 'b'}}}})
+        threading.Thread(target=self.server.serve_forever).start()
+        self.manager = StreamManager(self.server.url, token=lambda: 'token',
+                                     backoff=Backoff(base=0.01, max_delay=0.05), timeout=5)
+        self.events = Queue()
+
+    def tearDown(self):
+        self.manager.close()
+        self.server.drop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def subscribe(self, path, name, **kwargs):
+        return self.manager.subscribe(path, lambda message: self.events.put((name, message)), **kwargs)
+
+    def next_event(self):
+        try:
+            name, message = self.events.get(timeout=5)
+        except Empty:
+            self.fail('no event received')
+        return name, message['event'], message['path'], message['data']
+
+    def assertNoEvent(self):
+        self.assertRaises(Empty, self.events.get, timeout=0.2)
+
+    def test_listeners_share_a_connection(self):
+        self.subscribe('u/trips/t1', 't1')
+        self.assertEqual(self.next_event(), ('t1', 'put', '/', {'name': 'a', 'days': 1}))
+
+        # the stream of t1 is merged into the stream of the trips
+        self.subscribe('/u/trips', 'trips', initial=False)
+        self.subscribe('u/trips/t2', 't2')
+        self.assertEqual(self.next_event(), ('t2', 'put', '/', {'name': 'b'}))
+        self.assertEqual(len(self.manager.connections), 1)
+        self.assertEqual(self.server.requests[-1], '/u/trips.json?auth=token')
+
+        self.server.write('patch', 'u/trips/t1', {'days': 2})
+        self.assertEqual(sorted([self.next_event(), self.next_event()]),
+                         [('t1', 'patch', '/', {'days': 2}),
+                          ('trips', 'patch', '/t1', {'days': 2})])
+
+        # a put above a listener is delivered as the changes of its node
+        self.server.write('put', 'u/trips', {'t1': {'name': 'a', 'days': 2}, 't2': {'name': 'c'}})
+        events = sorted(self.next_event() for _ in range(2))
+        self.assertEqual(events, [('t2', 'put', '/name', 'c'),
+                                  ('trips', 'put', '/', {'t1': {'name': 'a', 'days': 2},
+                                                         't2': {'name': 'c'}})])
+        self.assertNoEvent()
+
+    def test_resume_after_disconnection(self):
+        subscription = self.subscribe('u/trips/t1', 't1')
+        self.next_event()
+
+        # the trip is changed while the stream is down
+        self.server.refuse = True
+        self.server.drop()
+        self.server.write('put', 'u/trips/t1/name', 'x')
+        self.server.write('put', 'u/trips/t1/days', 1)
+        self.server.refuse = False
+
+        # only the change is delivered, not the snapshot sent on reconnection
+        self.assertEqual(self.next_event(), ('t1', 'put', '/name', 'x'))
+        self.assertNoEvent()
+        connection = self.manager.connections[0]
+        self.assertGreaterEqual(connection.reconnects, 1)
+
+        self.server.write('put', 'u/trips/t1/days', 3)
+        self.assertEqual(self.next_event(), ('t1', 'put', '/days', 3))
+
+        self.assertEqual(subscription.events, 3)
+        self.assertEqual(subscription.lag.count, 3)
+        self.assertIn('/u/trips/t1: 3 events', self.manager.report())
+
+    def test_unsubscribe(self):
+        subscription = self.subscribe('u/trips/t1', 't1')
+        self.next_event()
+        connection = self.manager.connections[0]
+
+        subscription.close()
+        self.assertEqual(self.manager.connections, [])
+        self.server.write('put', 'u/trips/t1/name', 'x')
+        self.assertNoEvent()
+        connection.join(5)
+        self.assertFalse(connection._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,340 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import tests  # noqa
+from cloud import cache
+
+try:
+    import requests
+    from pyrebase.pyrebase import PyreResponse, convert_to_pyre
+    from cloud.base import ConflictError
+    from cloud.image_cache import ImageCache
+    from cloud.trip_manager import TripManager
+    from models.trip import Trip, Destination, Note, Spent
+except ImportError:
+    TripManager = None
+
+
+class FakeDatabase(object):
+    """In-memory database answering the queries of pyrebase's Database"""
+
+    def __init__(self, data=None):
+        self.data = data if data is not None else {}
+        self.path = ''
+        self.query = {}
+        self.requests = []
+        self.keys = 0
+        self.offline = False
+
+    def child(self, *path):
+        self.path = '/'.join(p for p in (self.path,) + path if p)
+        return self
+
+    def shallow(self):
+        self.query['shallow'] = True
+        return self
+
+    def order_by_child(self, key):
+        self.query['orderBy'] = key
+        return self
+
+    def start_at(self, start):
+        self.query['startAt'] = start
+        return self
+
+    def limit_to_first(self, limit):
+        self.query['limitToFirst'] = limit
+        return self
+
+    def _node(self, path):
+        node = self.data
+        for part in path.split('/'):
+            node = node.get(part) if isinstance(node, dict) else None
+        return node
+
+    def get(self, token=None):
+        path, query = self.path, self.query
+        self.path, self.query = '', {}
+        self.requests.append(('get', path, query))
+
+        node = self._node(path)
+        if not isinstance(node, dict):
+            return PyreResponse(node, path.split('/')[-1])
+        if query.get('shallow'):
+            return PyreResponse(list(node), path.split('/')[-1])
+
+        items = sorted(node.items())
+        if 'startAt' in query:
+            items = [item for item in items if item[0] >= query['startAt']]
+        if 'limitToFirst' in query:
+            items = items[:query['limitToFirst']]
+        return PyreResponse(convert_to_pyre(items), path.split('/')[-1])
+
+    def etag(self, path):
+        return str(hash(json.dumps(self._node(path), sort_keys=True)))
+
+    def get_if_modified(self, etag=None, token=None):
+        path = self.path
+        if self.offline:
+            self.path, self.query = '', {}
+            raise requests.exceptions.ConnectionError('offline')
+        response = self.get(token)
+        self.requests[-1] = ('get', path, {'etag': True})
+        if etag == self.etag(path):
+            return None, etag
+        return response, self.etag(path)
+
+    def iter_children(self, token=None):
+        response = self.get(token)
+        return iter(response.items())
+
+    def update(self, data, token=None):
+        path, self.path = self.path, ''
+        self.requests.append(('update', path, data))
+        self.data = cache.apply_update(self.data, dict(
+            ('/'.join(p for p in (path, key) if p), value) for key, value in data.items()))
+
+    def set(self, data, token=None):
+        path = self.path
+        self.update({'': data})
+        self.requests[-1] = ('set', path, data)
+
+    def remove(self, token=None):
+        path = self.path
+        self.update({'': None})
+        self.requests[-1] = ('remove', path, None)
+
+    def generate_key(self):
+        self.keys += 1
+        return '-K{:03d}'.format(self.keys)
+
+
+class FakeStorage(object):
+    """Storage uploading the files whose data does not start with 'fail'"""
+
+    def __init__(self):
+        self.path = []
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def child(self, *path):
+        self.path.extend(path)
+        return self
+
+    def put(self, file, token=None, chunk_size=None, progress=None):
+        path, self.path = '/'.join(self.path), []
+        data = file.read()
+        if data.startswith(b'fail'):
+            raise IOError('upload failed')
+        with self.lock:
+            self.files[path] = data
+        if progress is not None:
+            progress(len(data), len(data))
+        return {'name': path}
+
+    def get_url(self):
+        path, self.path = '/'.join(self.path), []
+        return 'url/' + path
+
+
+class FakeBackend(object):
+
+    def __init__(self, db):
+        self.db = db
+        self.uploads = ThreadPoolExecutor(max_workers=2)
+        self._storage = threading.local()
+        self.uid = 'u'
+        self.token = 'token'
+        self.cache = cache.PathCache(cache.MemoryCache(ttl=None))
+        self.image_cache = ImageCache(tempfile.mkdtemp(), 1024, session=None)
+        self.sync = None
+
+    @property
+    def storage(self):
+        # one object by thread, like BackEndClient.storage
+        if not hasattr(self._storage, 'storage'):
+            self._storage.storage = FakeStorage()
+        return self._storage.storage
+
+
+@unittest.skipIf(TripManager is None, 'app dependencies are not installed')
+class TripManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.manager = TripManager(FakeBackend(self.db))
+        self.addCleanup(shutil.rmtree, self.manager.image_cache.directory)
+
+    def add_trips(self, count):
+        return [self.manager.add_trip(Trip(name='trip {}'.format(i), days=1))
+                for i in range(count)]
+
+    def test_header_written_with_trip(self):
+        trip = self.manager.add_trip(Trip(name='x', days=2))
+
+        self.assertEqual(len(self.db.requests), 1)
+        self.assertEqual(self.db.data['u']['trip_headers'][trip._id], {'name': 'x', 'days': 2})
+
+        self.manager.delete_trip(trip)
+        self.assertFalse(self.db.data['u']['trips'])
+        self.assertFalse(self.db.data['u']['trip_headers'])
+
+    def test_pages_newest_first(self):
+        trips = self.add_trips(5)
+        destination = Destination(name='d', day=1)
+        self.manager.add_destination(trips[0], destination)
+        self.db.requests = []
+
+        page, cursor = self.manager.get_trips_page(page_size=2)
+        self.assertEqual([t.name for t in page], ['trip 4', 'trip 3'])
+        page, cursor = self.manager.get_trips_page(cursor, page_size=2)
+        self.assertEqual([t.name for t in page], ['trip 2', 'trip 1'])
+        page, cursor = self.manager.get_trips_page(cursor, page_size=2)
+        self.assertEqual([t.name for t in page], ['trip 0'])
+        self.assertIsNone(cursor)
+
+        # only the keys of the trips and the headers are downloaded
+        self.assertTrue(all(query.get('shallow') or path == 'u/trip_headers'
+                            for _, path, query in self.db.requests))
+
+        # the destinations are loaded on demand
+        self.assertIsNone(page[0]._destinations)
+        self.assertEqual([d.name for d in self.manager.load_destinations(page[0])], ['d'])
+
+    def test_missing_header_is_backfilled(self):
+        self.db.data = {'u': {'trips': {'-A': {'name': 'old', 'days': 3,
+                                               'destinations': {'d': {'spents': {'s': {'spent': 5}}}}}}}}
+
+        page, cursor = self.manager.get_trips_page()
+        self.assertEqual([(t.name, t.budget) for t in page], [('old', 5)])
+        self.assertIsNone(page[0]._destinations)
+        self.assertEqual(self.db.data['u']['trip_headers']['-A'], {'name': 'old', 'days': 3, 'budget': 5})
+
+    def test_active_trip(self):
+        trip = self.add_trips(2)[0]
+        self.manager.set_active_trip(trip)
+        self.assertEqual(self.manager.get_active_trip().name, 'trip 0')
+
+        self.manager.set_active_trip(trip, active=False)
+        self.assertIsNone(self.manager.get_active_trip())
+        self.assertFalse(self.db.data['u']['trip_headers'][trip._id]['active'])
+
+    def test_update_checked(self):
+        trip = self.add_trips(1)[0]
+        self.manager.set_active_trip(trip)
+        active = self.manager.get_active_trip()
+
+        active.name = 'renamed'
+        self.manager.update_trip(active, check=True)
+        self.assertEqual(self.db.data['u']['trip_headers'][trip._id]['name'], 'renamed')
+        self.assertEqual(self.db.data['u']['trips'][trip._id]['name'], 'renamed')
+
+    def test_update_conflict(self):
+        trip = self.add_trips(1)[0]
+        self.manager.read_header(trip)
+
+        # another device renames the trip after it was read
+        self.db.data['u']['trip_headers'][trip._id]['name'] = 'other'
+        self.db.data['u']['trips'][trip._id]['name'] = 'other'
+
+        trip.days = 5
+        self.assertRaises(ConflictError, self.manager.update_trip, trip, check=True)
+        self.assertEqual(self.db.data['u']['trip_headers'][trip._id], {'name': 'other', 'days': 1})
+        self.assertEqual(self.db.data['u']['trips'][trip._id]['days'], 1)
+        self.assertEqual((trip.name, trip.days), ('other', 1))
+
+        # checked against the header saved by the other device
+        trip.days = 5
+        self.manager.update_trip(trip, check=True)
+        self.assertEqual(self.db.data['u']['trip_headers'][trip._id], {'name': 'other', 'days': 5})
+
+    def test_update_unchecked_offline(self):
+        trip = self.add_trips(1)[0]
+        self.manager.read_header(trip)
+        self.db.offline = True
+        trip.days = 5
+        self.manager.update_trip(trip, check=True)
+        self.assertEqual(self.db.data['u']['trip_headers'][trip._id]['days'], 5)
+
+        # the header was not read again
+        self.db.offline = False
+        trip.days = 6
+        self.manager.update_trip(trip, check=True)
+        self.assertEqual(self.db.data['u']['trips'][trip._id]['days'], 6)
+
+    def test_spents_update_budgets(self):
+        trip = self.manager.add_trip(Trip(name='x', days=1, destinations={}))
+        destination = self.manager.add_destination(trip, Destination(name='d', day=1))
+        trip.add_destination(destination)
+        self.db.requests = []
+
+        spent = Spent(content='food', spent=10)
+        self.manager.add_spent(trip, destination, spent)
+        self.manager.update_spent(trip, destination, spent, 12)
+        self.assertEqual(len(self.db.requests), 2)
+        self.assertEqual(self.db.data['u']['trip_headers'][trip._id]['budget'], 12)
+        self.assertEqual(self.db.data['u']['trips'][trip._id]['budget'], 12)
+        self.assertEqual(self.db.data['u']['trips'][trip._id]['destinations'][destination._id]['budget'], 12)
+
+        self.manager.delete_destination(trip, destination)
+        self.assertEqual((trip.budget, trip._destinations), (0, []))
+        self.assertEqual(self.db.data['u']['trip_headers'][trip._id]['budget'], 0)
+
+    def test_trips_yielded(self):
+        trips = self.add_trips(3)
+        self.manager.add_destination(trips[1], Destination(name='d', day=1))
+        self.db.requests = []
+
+        loaded = self.manager.get_user_trips()
+        first = next(loaded)
+        self.assertIn(first.name, ['trip 0', 'trip 1', 'trip 2'])
+        self.assertEqual(sorted(t.name for t in [first] + list(loaded)), ['trip 0', 'trip 1', 'trip 2'])
+        self.assertEqual([d.name for d in self.manager.trip_destinations(trips[1])], ['d'])
+
+        # read from the cache once all the trips have been read
+        self.assertEqual(len(list(self.manager.get_user_trips())), 3)
+        self.assertEqual([request[1] for request in self.db.requests],
+                         ['u/trips', 'u/trips/{}/destinations'.format(trips[1]._id)])
+
+    def test_upload_images(self):
+        # files which are not images are uploaded as they are
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        uploads = []
+        for i, (name, data) in enumerate([('a.jpg', b'a'), ('b.png', b'fail'), ('c.jpg', b'cc'), ('d.png', b'd')]):
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+            uploads.append((Note(_id='n{}'.format(i)), os.path.join(directory, name)))
+        notes = [note for note, _ in uploads]
+        progress = []
+
+        self.assertRaises(IOError, self.manager.upload_images, uploads, progress=lambda *args: progress.append(args))
+        self.assertEqual([note.image for note in notes], ['url/u/trips/n0.jpg', None,
+                                                           'url/u/trips/n2.jpg', 'url/u/trips/n3.png'])
+        self.assertEqual(notes[2].thumbnail, notes[2].image)
+        self.assertEqual(max(progress), (4, 4))
+        with open(self.manager.image_cache.get('url/u/trips/n2.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), b'cc')
+
+    def test_failed_write_is_undone(self):
+        trip = Trip(_id='t', name='x', destinations={'d': {'day': 1, 'spents': {'s': {'spent': 5}}}})
+        destination = trip._destinations[0]
+
+        def fail(*args, **kwargs):
+            raise IOError('offline')
+        self.db.update = fail
+
+        self.assertRaises(IOError, self.manager.add_spent, trip, destination, Spent(spent=3))
+        self.assertRaises(IOError, self.manager.update_spent, trip, destination,
+                          destination._spents[0], 1)
+        self.assertEqual((trip.budget, destination.budget, len(destination._spents)), (5, 5, 1))
+        self.assertEqual(destination._spents[0].spent, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -128,6 +128,11 @@ class MyScreen(Screen):
         """Implement this method to dispatch properties to cause the view updated"""
         pass
 
+    def on_trip_changes(self, changes):
+        """Called with the changes of the active trip made on other devices
+        (see cloud.live.Change), updates the view by default"""
+        self.reload()
+
 
 class ListHeader(BoxLayout):
     """Represent the header of a list view"""
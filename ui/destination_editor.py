@@ -3,7 +3,7 @@ from kivy.logger import Logger
 from kivy.properties import ObjectProperty, StringProperty
 
 from .common import MyScreen
-from .popup import Alert, QRDetectorPopup
+from .popup import Alert, QRDetectorPopup, error_alert
 
 from models.trip import Destination, Place
 from utils.places import place_picker
@@ -36,19 +36,25 @@ class DestinationEditor(MyScreen):
 
         if app.destination:
             # update current destination
-            trip_manager.update_destination(app.trip, destination)
-        else:
-            # create a new destination
-            app.destination = trip_manager.add_destination(app.trip, destination)
+            app.backend.run(trip_manager.update_destination, app.trip, destination,
+                            on_success=lambda _: app.screen_manager.back(),
+                            on_error=error_alert(self.title))
+            return
+
+        def on_success(destination):
+            app.destination = destination
 
-            if app.trip._destinations is None:
-                app.trip._destinations = []
-            app.trip._destinations.append(app.destination)
+            app.trip.add_destination(app.destination)
 
             app.destinations.append(app.destination)
             app.destinations.sort()
 
-        app.screen_manager.back()
+            app.screen_manager.back()
+
+        # create a new destination
+        app.backend.run(trip_manager.add_destination, app.trip, destination,
+                        on_success=on_success,
+                        on_error=error_alert(self.title))
 
     def pick_place(self):
 
@@ -77,17 +83,17 @@ class DestinationEditor(MyScreen):
             except Exception as e:
                 Logger.info("Invalid URL detected %s", url)
 
-        def callback(*args):
-            try:
-                destination = share_manager.get_by_url(args[1])
-                if not isinstance(destination, Destination):
-                    raise ValueError, 'Not a destination url'
+        def on_success(destination):
+            if not isinstance(destination, Destination):
+                Alert(title=self.title, text="Invalid URL")
+                return
 
-                self.place_data = Place(**destination.attrs).attrs
+            self.place_data = Place(**destination.attrs).attrs
 
-            except Exception as e:
-                Logger.exception('scan_qrcode')
-                Alert(title=self.title, text="Invalid URL")
+        def callback(*args):
+            app.backend.run(share_manager.get_by_url, args[1],
+                            on_success=on_success,
+                            on_error=lambda e: Alert(title=self.title, text="Invalid URL"))
 
         QRDetectorPopup(title="QR Tagging",
                         text="Scan QR code for a travel destination",
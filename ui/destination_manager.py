@@ -2,7 +2,7 @@ from kivy.app import App
 from kivy.logger import Logger
 
 from .common import MyScreen, ListItem
-from .popup import Alert, ConfirmPopup, QRPopup, SpinnerPopup, SelectorPopup
+from .popup import Alert, ConfirmPopup, QRPopup, SpinnerPopup, SelectorPopup, error_alert
 
 from utils.gmap import map_intent, geo_uri
 
@@ -43,15 +43,18 @@ class DestinationListItem(ListItem):
                 data = {attr: converter(args[1])}
                 self.item.set(**data)
 
-                trip_manager.update_destination(app.trip, self.item)
+            except Exception as e:
+                Logger.exception('update destination')
+                Alert(title=app.name, text=str(e))
+                return
 
+            def on_success(_):
                 app.destinations.sort()
-
                 screen.reload()
 
-            except Exception as e:
-                Logger.exception('update destination')
-                Alert(title=app.name, text=str(e))
+            app.backend.run(trip_manager.update_destination, app.trip, self.item,
+                            on_success=on_success,
+                            on_error=error_alert(app.name))
 
         SelectorPopup(title="Update Destination", text=prompt,
                       options=options, initial=current,
@@ -62,14 +65,15 @@ class DestinationListItem(ListItem):
 
         app = App.get_running_app()
         share_manager = app.backend.share_manager
+        url = share_manager.share_url(app.trip, destination=self.item)
 
         def callback(qr):
-            return share_manager.upload_qrcode(self.item._id, qr)
+            return share_manager.upload_qrcode(self.item._id, qr, url)
 
         # Popup shows a QR code encoding the share url to the destination
         QRPopup(title="QR Tagging",
                 text="Share your destination with other users",
-                data=share_manager.share_url(app.trip, destination=self.item),
+                data=url,
                 share_callback=callback)
 
     def remove(self):
@@ -81,21 +85,17 @@ class DestinationListItem(ListItem):
             screen = app.current_screen()
             trip_manager = app.backend.trip_manager
 
-            try:
-                # remove the trip from cloud
-                trip_manager.delete_destination(app.trip, self.item)
-
-                # remove from the local data
-                app.trip._destinations.remove(self.item)
-
-                # also remove the destination from the list view
+            def on_success(_):
+                # remove the destination from the list view, the trip
+                # manager has removed it from the trip
                 app.destinations.remove(self.item)
 
                 screen.reload()
 
-            except Exception as e:
-                Logger.exception('delete_destination')
-                Alert(title=self.name, text=str(e))
+            # remove the trip from cloud
+            app.backend.run(trip_manager.delete_destination, app.trip, self.item,
+                            on_success=on_success,
+                            on_error=error_alert(app.name))
 
         ConfirmPopup(title="Delete Confirmation",
                      text="Do you want to remove '{}'?".format(self.item.name),
@@ -147,15 +147,14 @@ class DestinationManager(MyScreen):
         def callback(*args):
             """Callback when user confirms to delete"""
 
-            try:
-                # set the trip as inactive
-                trip_manager.set_active_trip(app.trip, active=False)
+            def on_success(_):
                 app.active_trip = None
                 app.screen_manager.back()
 
-            except Exception as e:
-                Logger.exception('inactive trip')
-                Alert(title=self.name, text=str(e))
+            # set the trip as inactive
+            app.backend.run(trip_manager.set_active_trip, app.trip, active=False,
+                            on_success=on_success,
+                            on_error=error_alert(self.title))
 
         ConfirmPopup(title="Return Home",
                      text="Do you want to finish '{}'?".format(app.trip.name),
@@ -3,19 +3,36 @@ from kivy.logger import Logger
 from kivy.properties import ListProperty
 
 from .common import MyScreen, ListItem
-from .popup import Alert, ImagePopup, InputPopup, SpinnerPopup, ConfirmPopup, ImageChooserPopup
+from .popup import Alert, ImagePopup, InputPopup, SpinnerPopup, ConfirmPopup, ImageChooserPopup, error_alert
 
 from models.trip import Note
 
 
+def prefetch_images(destination):
+    """Download the images of the notes of the destination to the image
+    cache, so that they are shown without waiting"""
+    app = App.get_running_app()
+    urls = [note.thumbnail or note.image for note in destination._notes or []]
+    app.backend.image_cache.prefetch(urls, app.backend.executor)
+
+
 class NoteListItem(ListItem):
     """Represent an item in the note list"""
 
     def view(self):
         """View image of the note, or upload another one"""
         try:
-            ImagePopup(title="Note", message=self.item.content,
-                       source=self.item.image if self.item.image else '')
+            # the thumbnail is enough for the popup
+            source = self.item.thumbnail or self.item.image or ''
+            popup = ImagePopup(title="Note", message=self.item.content)
+            if not source:
+                return
+
+            # show the file of the image cache, or the url if it cannot be downloaded
+            app = App.get_running_app()
+            app.backend.run(app.backend.image_cache.get, source,
+                            on_success=lambda path: setattr(popup, 'source', path),
+                            on_error=lambda e: setattr(popup, 'source', source))
 
         except Exception as e:
             Logger.exception('upload_image')
@@ -44,15 +61,18 @@ class NoteListItem(ListItem):
             file_path = args[1]
 
             app = App.get_running_app()
+            screen = app.current_screen()
             trip_manager = app.backend.trip_manager
+            trip, destination, note = app.trip, app.destination, self.item
 
-            try:
-                self.item.image = trip_manager.upload_image(self.item, file_path)
-                app.current_screen().update_note(self.item)
+            def upload():
+                """Upload the image and save its url to the note"""
+                note.image = trip_manager.upload_image(note, file_path)
+                trip_manager.update_note(trip, destination, note)
 
-            except Exception as e:
-                Logger.exception('upload_image')
-                Alert(title="Upload Image", text=str(e))
+            app.backend.run(upload,
+                            on_success=lambda _: screen.reload(),
+                            on_error=error_alert("Upload Image"))
 
         ImageChooserPopup(title="Choose Note Image",
                           text="Please choose an image for your note",
@@ -77,11 +97,19 @@ class DestinationNotes(MyScreen):
             app.destination._notes = []
 
         self.notes = app.destination._notes
+        prefetch_images(app.destination)
+
+    def on_trip_changes(self, changes):
+        """Show the notes changed on other devices"""
+        app = App.get_running_app()
+        path = ('destinations', app.destination._id)
+        if any(change.path[:2] == path for change in changes):
+            self.show_notes()
 
-    def on_pre_leave(self, *args):
-        """Update the notes of the tracked destination"""
+    def show_notes(self):
+        """Update the list view from the notes of the destination"""
         app = App.get_running_app()
-        app.destination._notes = self.notes
+        self.notes = app.destination._notes or []
 
     def reload(self):
         """force updating list view"""
@@ -100,17 +128,11 @@ class DestinationNotes(MyScreen):
             if content is None:
                 return
 
-            try:
-                # add to the cloud
-                note = Note(content=content)
-                trip_manager.add_note(app.trip, app.destination, note)
-
-                # update the local list
-                self.notes.append(note)
-
-            except Exception as e:
-                Logger.exception('add_note')
-                Alert(title=self.title, text=str(e))
+            # add to the destination and the cloud, then update the list view
+            note = Note(content=content)
+            app.backend.run(trip_manager.add_note, app.trip, app.destination, note,
+                            on_success=lambda _: self.show_notes(),
+                            on_error=error_alert(self.title))
 
         # input dialog for user enter a note
         InputPopup(title="Add Note",
@@ -127,16 +149,11 @@ class DestinationNotes(MyScreen):
             app = App.get_running_app()
             trip_manager = app.backend.trip_manager
 
-            try:
-                # remove the note from the cloud
-                trip_manager.remove_note(app.trip, app.destination, note)
-
-                # update the local list
-                self.notes.remove(note)
-
-            except Exception as e:
-                Logger.exception('remove_note')
-                Alert(title=self.title, text=str(e))
+            # remove the note from the destination and the cloud, then
+            # update the list view
+            app.backend.run(trip_manager.remove_note, app.trip, app.destination, note,
+                            on_success=lambda _: self.show_notes(),
+                            on_error=error_alert(self.title))
 
         ConfirmPopup(title="Delete Note",
                      text="Do you want to remove this note?",
@@ -148,9 +165,6 @@ class DestinationNotes(MyScreen):
         app = App.get_running_app()
         trip_manager = app.backend.trip_manager
 
-        try:
-            trip_manager.update_note(app.trip, app.destination, note)
-            self.reload()
-        except Exception as e:
-            Logger.exception('update_note')
-            Alert(title=self.title, text=str(e))
+        app.backend.run(trip_manager.update_note, app.trip, app.destination, note,
+                        on_success=lambda _: self.reload(),
+                        on_error=error_alert(self.title))
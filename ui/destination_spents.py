@@ -3,7 +3,7 @@ from kivy.logger import Logger
 from kivy.properties import ListProperty
 
 from .common import MyScreen, ListItem
-from .popup import Alert, ImagePopup, InputPopup, SpinnerPopup, ConfirmPopup, ImageChooserPopup
+from .popup import Alert, ImagePopup, InputPopup, SpinnerPopup, ConfirmPopup, ImageChooserPopup, error_alert
 
 from models.trip import Spent
 
@@ -26,9 +26,7 @@ class SpentListItem(ListItem):
                 if spent < 0:
                     raise Exception
 
-                self.item.set(spent=spent)
-                app.current_screen().update_spent(self.item)
-                app.current_screen().reload()
+                app.current_screen().update_spent(self.item, spent)
 
             except:
                 Alert(title='Update Spent', text="Please input an integral amount")
@@ -61,10 +59,17 @@ class DestinationSpents(MyScreen):
 
         self.spents = app.destination._spents
 
-    def on_pre_leave(self, *args):
-        """Update the spents of the tracked destination"""
+    def on_trip_changes(self, changes):
+        """Show the spents changed on other devices"""
         app = App.get_running_app()
-        app.destination._spents = self.spents
+        path = ('destinations', app.destination._id)
+        if any(change.path[:2] == path for change in changes):
+            self.show_spents()
+
+    def show_spents(self):
+        """Update the list view from the spents of the destination"""
+        app = App.get_running_app()
+        self.spents = app.destination._spents or []
 
     def reload(self):
         """force updating list view"""
@@ -83,17 +88,11 @@ class DestinationSpents(MyScreen):
             if content is None:
                 return
 
-            try:
-                # add to the cloud
-                spent = Spent(content=content, spent=0)
-                trip_manager.add_spent(app.trip, app.destination, spent)
-
-                # update the local list
-                self.spents.append(spent)
-
-            except Exception as e:
-                Logger.exception('add_spent')
-                Alert(title=self.title, text=str(e))
+            # add to the destination and the cloud, then update the list view
+            spent = Spent(content=content, spent=0)
+            app.backend.run(trip_manager.add_spent, app.trip, app.destination, spent,
+                            on_success=lambda _: self.show_spents(),
+                            on_error=error_alert(self.title))
 
         # input dialog for user enter a spent
         InputPopup(title="Add Spent",
@@ -110,29 +109,22 @@ class DestinationSpents(MyScreen):
             app = App.get_running_app()
             trip_manager = app.backend.trip_manager
 
-            try:
-                # remove the spent from the cloud
-                trip_manager.remove_spent(app.trip, app.destination, spent)
-
-                # update the local list
-                self.spents.remove(spent)
-
-            except Exception as e:
-                Logger.exception('remove_spent')
-                Alert(title=self.title, text=str(e))
+            # remove the spent from the destination and the cloud, then
+            # update the list view
+            app.backend.run(trip_manager.remove_spent, app.trip, app.destination, spent,
+                            on_success=lambda _: self.show_spents(),
+                            on_error=error_alert(self.title))
 
         ConfirmPopup(title="Delete Spent",
                      text="Do you want to remove this spent?",
                      on_confirmed=callback)
 
-    def update_spent(self, spent):
-        """Update a spent for the current destination"""
+    def update_spent(self, spent, amount):
+        """Update the amount of a spent for the current destination"""
 
         app = App.get_running_app()
         trip_manager = app.backend.trip_manager
 
-        try:
-            trip_manager.update_spent(app.trip, app.destination, spent)
-        except Exception as e:
-            Logger.exception('update_spent')
-            Alert(title=self.title, text=str(e))
+        app.backend.run(trip_manager.update_spent, app.trip, app.destination, spent, amount,
+                        on_success=lambda _: self.reload(),
+                        on_error=error_alert(self.title))
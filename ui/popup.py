@@ -1,6 +1,7 @@
 #
 # Common Popups
 #
+from kivy.app import App
 from kivy.logger import Logger
 from kivy.properties import StringProperty, BooleanProperty, ObjectProperty, ListProperty
 from kivy.uix.popup import Popup
@@ -24,6 +25,11 @@ class Alert(Popup):
         self.open()
 
 
+def error_alert(title):
+    """Return a callback showing the error of a background call in an Alert"""
+    return lambda error: Alert(title=title, text=str(error))
+
+
 class ConfirmPopup(Popup):
     """Represent a pop up that shows a message for confirmation"""
     text = StringProperty('No messages')
@@ -210,12 +216,21 @@ class QRPopup(Popup):
         on Android"""
 
         if kwargs.get("confirmed", False) and self.share_callback:
-            url = self.share_callback(self.ids.qr_widget.qr.get_matrix())
-            try:
-                tagging.share(self.title, url)
-            except NotImplementedError:
-                Alert(title="Sharing Not Supported",
-                      text="QR Code for this destination is available at " + str(url))
+            title = self.title
+
+            def share(url):
+                """Share the url of the uploaded QR code"""
+                try:
+                    tagging.share(title, url)
+                except NotImplementedError:
+                    Alert(title="Sharing Not Supported",
+                          text="QR Code for this destination is available at " + str(url))
+
+            # upload the QR code out of the UI thread
+            App.get_running_app().backend.run(self.share_callback,
+                                              self.ids.qr_widget.qr.get_matrix(),
+                                              on_success=share,
+                                              on_error=error_alert(title))
 
         super(QRPopup, self).dismiss(*args, **kwargs)
 
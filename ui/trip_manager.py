@@ -2,9 +2,10 @@ from kivy.app import App
 from kivy.logger import Logger
 
 from .common import MyScreen, ListItem
-from .popup import Alert, InputPopup, QRPopup, ConfirmPopup
+from .popup import Alert, InputPopup, QRPopup, ConfirmPopup, error_alert
 from .trip_tracker import TripTracker
 
+from cloud.base import ConflictError
 from models.trip import Trip
 
 
@@ -39,13 +40,28 @@ class TripListItem(ListItem):
                 data = {attr: input_converter(args[1])}
                 self.item.set(**data)
 
-                trip_manager.update_trip(self.item)
-
-                screen.reload()
-
             except Exception as e:
                 Logger.exception('update trip')
                 Alert(title=app.name, text=str(e))
+                return
+
+            def on_error(error):
+                """Show the trip saved by another device, which update_trip
+                has set to the item"""
+                if isinstance(error, ConflictError):
+                    screen.reload()
+                error_alert(app.name)(error)
+
+            app.backend.run(trip_manager.update_trip, self.item, check=True,
+                            on_success=lambda _: screen.reload(),
+                            on_error=on_error)
+
+        # read the header again with its ETag, so that saving it checks
+        # that it has not been changed by another device meanwhile
+        app = App.get_running_app()
+        screen = app.current_screen()
+        app.backend.run(app.backend.trip_manager.read_header, self.item,
+                        on_success=lambda _: screen.reload())
 
         InputPopup(title="Update Trip", text=prompt,
                    initial=current, input_filter=input_filter,
@@ -56,14 +72,15 @@ class TripListItem(ListItem):
 
         app = App.get_running_app()
         share_manager = app.backend.share_manager
+        url = share_manager.share_url(self.item)
 
         def callback(qr):
-            return share_manager.upload_qrcode(self.item._id, qr)
+            return share_manager.upload_qrcode(self.item._id, qr, url)
 
         # Popup shows a QR code encoding the share url to the trip
         QRPopup(title="QR Tagging",
                 text="Share your trip with other users",
-                data=share_manager.share_url(self.item),
+                data=url,
                 share_callback=callback)
 
     def start(self):
@@ -78,7 +95,8 @@ class TripListItem(ListItem):
 
         # Set the trip as active
         trip_manager = app.backend.trip_manager
-        trip_manager.set_active_trip(self.item)
+        app.backend.run(trip_manager.set_active_trip, self.item,
+                        on_error=error_alert("Start Trip"))
         app.active_trip = self.item
 
         # Logger.info("Start Trip: %s", str(app.active_trip.__dict__))
@@ -93,20 +111,18 @@ class TripListItem(ListItem):
             screen = app.current_screen()
             trip_manager = app.backend.trip_manager
 
-            try:
-                # remove the trip from cloud
-                trip_manager.delete_trip(self.item)
-
-                # also remove from the local list
+            def on_success(_):
+                """Also remove the trip from the local list"""
                 app.trips.remove(self.item)
                 if app.trip == self.item:
                     app.trip = None
 
                 screen.reload()
 
-            except Exception as e:
-                Logger.exception('delete_trip')
-                Alert(title=self.name, text=str(e))
+            # remove the trip from cloud
+            app.backend.run(trip_manager.delete_trip, self.item,
+                            on_success=on_success,
+                            on_error=error_alert(app.name))
 
         ConfirmPopup(title="Delete Confirmation",
                      text="Do you want to remove '{}'?".format(self.item.name),
@@ -134,18 +150,15 @@ class TripManager(MyScreen):
             app = App.get_running_app()
             trip_manager = app.backend.trip_manager
 
-            try:
-                # create new trip
-                trip = Trip(name=args[1], days=1)
-                # add to data cloud
-                trip_manager.add_trip(trip)
-                # update the local data
-                app.trips.append(trip)
-
+            def on_success(trip):
+                """Update the local data, newest trip first"""
+                app.trips.insert(0, trip)
                 self.reload()
 
-            except Exception as e:
-                Logger.exception('add trip')
-                Alert(title=app.name, text=str(e))
+            # create new trip and add to data cloud
+            trip = Trip(name=args[1], days=1)
+            app.backend.run(trip_manager.add_trip, trip,
+                            on_success=on_success,
+                            on_error=error_alert(app.name))
 
         InputPopup(title="Add Trip", text="Enter name of your trip", on_value=callback)
@@ -3,7 +3,7 @@ from kivy.logger import Logger
 from kivy.properties import ObjectProperty
 
 from .common import MyScreen, ListItem
-from .popup import Alert, ActionsPopup, SpinnerPopup, InputPopup, ConfirmPopup, QRPopup
+from .popup import Alert, ActionsPopup, SpinnerPopup, InputPopup, ConfirmPopup, QRPopup, error_alert
 
 from utils import iso_date, iso_date_string, today
 from utils.gmap import map_intent, geo_uri, navigation_uri
@@ -63,14 +63,12 @@ class TrackedDestinationListItem(ListItem):
         app = App.get_running_app()
         trip_tracker = app.backend.trip_tracker
 
-        try:
-            self.item.set(**kwargs)
-            trip_tracker.update_destination(self.item)
-        except Exception as e:
-            Logger.exception('update_destination')
-            Alert(title="Update Error", text=str(e))
+        screen = app.current_screen()
 
-        app.current_screen().reload()
+        self.item.set(**kwargs)
+        app.backend.run(trip_tracker.update_destination, self.item,
+                        on_success=lambda _: screen.reload(),
+                        on_error=error_alert("Update Error"))
 
     def show_info(self):
         """Popup show details of the place of this destination"""
@@ -117,14 +115,15 @@ class DestinationActionsPopup(ActionsPopup):
 
         app = App.get_running_app()
         share_manager = app.backend.share_manager
+        url = share_manager.share_url(app.active_trip, destination=self.item)
 
         def callback(qr):
-            return share_manager.upload_qrcode(self.item._id, qr)
+            return share_manager.upload_qrcode(self.item._id, qr, url)
 
         # Popup shows a QR code encoding the share url to the destination
         QRPopup(title="QR Tagging",
                 text="Share your destination with other users",
-                data=share_manager.share_url(app.active_trip, destination=self.item),
+                data=url,
                 share_callback=callback)
 
     def recommend(self):
@@ -157,6 +156,12 @@ class TripTracker(MyScreen):
         self.ids.listview.adapter.data = app.active_trip._destinations
         self.reload()
 
+    def on_trip_changes(self, changes):
+        """Show the destinations changed on other devices"""
+        app = App.get_running_app()
+        self.ids.listview.adapter.data = app.active_trip._destinations or []
+        self.reload()
+
     def reload(self):
         """force updating list view"""
         adapter = self.ids.listview.adapter
@@ -173,24 +178,21 @@ class TripTracker(MyScreen):
             trip_manager = app.backend.trip_manager
             trip_tracker = app.backend.trip_tracker
 
-            try:
-                # Update budget base on actual spents
-                app.active_trip.recalculate_budget()
-
-                trip_manager.update_trip(app.active_trip, full_data=True)
-                trip_tracker.remove()
+            active_trip = app.active_trip
 
+            def on_success(_):
                 for i, trip in enumerate(app.trips):
-                    if trip._id == app.active_trip._id:
-                        app.trips[i] = app.active_trip
-                        app.active_trip = None
+                    if trip._id == active_trip._id:
+                        app.trips[i] = active_trip
                         break
 
+                app.active_trip = None
                 app.screen_manager.back()
 
-            except Exception as e:
-                Logger.exception('return_home')
-                Alert(title=self.title, text=str(e))
+            # save the trip and stop tracking it in one request
+            app.backend.run(trip_tracker.finish_trip, trip_manager, active_trip,
+                            on_success=on_success,
+                            on_error=error_alert(self.title))
 
         ConfirmPopup(title="Finish Trip",
                      text="Are you sure to finish this trip?",
@@ -205,14 +207,13 @@ class TripTracker(MyScreen):
             app = App.get_running_app()
             trip_tracker = app.backend.trip_tracker
 
-            try:
-                trip_tracker.remove()
+            def on_success(_):
                 app.active_trip = None
                 app.screen_manager.back()
 
-            except Exception as e:
-                Logger.exception('cancel_trip')
-                Alert(title=self.title, text=str(e))
+            app.backend.run(trip_tracker.remove,
+                            on_success=on_success,
+                            on_error=error_alert(self.title))
 
         ConfirmPopup(title="Cancel Trip",
                      text="Are you sure to cancel this trip?",
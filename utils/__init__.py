@@ -1,5 +1,7 @@
 from datetime import datetime
-import png, io
+import io
+
+from .qrimage import encode_qr
 
 #
 # Format/Converter functions
@@ -25,19 +27,9 @@ def today():
 # QR helper functions
 #
 
-def png_qr(qr_matrix):
-
-    data = map(lambda row: map(lambda x: 0 if x else 1, row), qr_matrix)
-    size = len(data)
-
-    f = io.BytesIO()
-    w = png.Writer(size, size, greyscale=True, bitdepth=1)
-    w.write(f, data)
-    content = f.getvalue()
-    f.close()
-
-    return io.BytesIO(content)
-
+def png_qr(qr_matrix, scale=1, border=0, key=None):
+    """Return a file of the PNG image of the QR code, see qrimage.encode_qr"""
+    return io.BytesIO(encode_qr(qr_matrix, scale, border, key))
 
 
 #
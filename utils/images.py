@@ -0,0 +1,100 @@
+"""
+Preprocessing of the photos of the notes before their upload: a photo is
+downscaled to a maximum size and recompressed, and a thumbnail is made for
+the views which only show a preview of the photo.
+"""
+import io
+import os
+from collections import namedtuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None    # the photos are uploaded as they are
+
+import config
+
+
+# Data of an image to upload, and the extension of the file for its format
+Encoded = namedtuple('Encoded', 'data ext')
+
+# A photo ready to be uploaded: the image, its thumbnail (None if the image
+# is used as its thumbnail) and the size of the original file in bytes
+PreparedImage = namedtuple('PreparedImage', 'image thumbnail original_size')
+
+# Extensions of the formats the photos are encoded to
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png'}
+
+# EXIF tag of the orientation of the camera
+ORIENTATION = 0x0112
+
+
+def read_file(file_path):
+    """Return the file as it is"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    return PreparedImage(Encoded(data, os.path.splitext(file_path)[1].lower()), None, len(data))
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def downscale(image, max_size):
+    """Return a copy of the image whose width and height are not greater
+    than max_size, keeping its aspect ratio"""
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    return image
+
+
+def encode(image, fmt, quality=config.IMAGE_QUALITY):
+    """Return the image encoded in the format, JPEG or PNG"""
+    f = io.BytesIO()
+    if fmt == 'JPEG':
+        image.convert('RGB').save(f, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(f, 'PNG', optimize=True)
+    return Encoded(f.getvalue(), EXTENSIONS[fmt])
+
+
+def prepare_image(file_path, max_size=config.IMAGE_MAX_SIZE,
+                  thumbnail_size=config.THUMBNAIL_SIZE, quality=config.IMAGE_QUALITY):
+    """
+    Return the PreparedImage of the photo: the photo downscaled to max_size
+    and its thumbnail, encoded in PNG if the photo is transparent or in
+    JPEG otherwise, the camera's orientation being applied.
+
+    The original file is kept if it is not larger than the image encoded
+    again, and it is uploaded as it is if it cannot be decoded (or if PIL
+    is not installed).
+    """
+    if Image is None:
+        return read_file(file_path)
+    try:
+        image = Image.open(file_path)
+        fmt = 'PNG' if has_alpha(image) else 'JPEG'
+        size = image.size
+        if image.format == 'JPEG':
+            # decode a JPEG photo at the smallest scale above max_size
+            image.draft('RGB', (max_size, max_size))
+        image.load()
+    except IOError:
+        return read_file(file_path)
+
+    # rotate the photo as the camera was held
+    orientation = image.getexif().get(ORIENTATION, 1) if hasattr(image, 'getexif') else 1
+    if orientation != 1 and hasattr(ImageOps, 'exif_transpose'):
+        image = ImageOps.exif_transpose(image)
+
+    original_size = os.path.getsize(file_path)
+    main = downscale(image, max_size)
+    encoded = encode(main, fmt, quality)
+    if (image.format == fmt and orientation == 1 and max(size) <= max_size and
+            original_size <= len(encoded.data)):
+        encoded = Encoded(read_file(file_path).image.data, EXTENSIONS[fmt])
+
+    thumbnail = None
+    if max(main.size) > thumbnail_size:
+        thumbnail = encode(downscale(main, thumbnail_size), fmt, quality)
+    return PreparedImage(encoded, thumbnail, original_size)
@@ -0,0 +1,128 @@
+"""Helpers for measuring the performance of the application"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+
+# Upper bounds (in milliseconds) of the buckets of a latency histogram
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class LatencyHistogram(object):
+    """Count latencies into buckets of increasing upper bounds"""
+
+    def __init__(self, name, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record a latency given in seconds"""
+        ms = seconds * 1000.0
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+            self.total += ms
+            self.max = max(self.max, ms)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def report(self):
+        """Return the histogram as a text, one line per non-empty bucket"""
+        lines = ['{}: {} samples, mean {:.1f}ms, max {:.1f}ms'.format(
+            self.name, self.count, self.mean, self.max)]
+        bounds = ['<={}ms'.format(b) for b in self.buckets] + ['>{}ms'.format(self.buckets[-1])]
+        for bound, count in zip(bounds, self.counts):
+            if count:
+                lines.append('  {:>9} {}'.format(bound, count))
+        return '\n'.join(lines)
+
+
+class Timer(object):
+    """Context manager recording the elapsed time into a histogram"""
+
+    def __init__(self, histogram, clock=time.time):
+        self.histogram = histogram
+        self.clock = clock
+
+    def __enter__(self):
+        self.start = self.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = self.clock() - self.start
+        self.histogram.record(self.elapsed)
+
+
+class PhaseTimer(object):
+    """
+    Record when the phases of a process (e.g. the start up of the app) begin
+    and end relative to the beginning of the process. Phases may run
+    concurrently in several threads.
+    """
+
+    def __init__(self, name, clock=time.time):
+        self.name = name
+        self.clock = clock
+        self.origin = clock()
+        self.phases = OrderedDict()     # name -> [start, end]
+        self._lock = threading.Lock()
+
+    def start(self, phase):
+        with self._lock:
+            self.phases[phase] = [self.clock() - self.origin, None]
+
+    def end(self, phase):
+        with self._lock:
+            self.phases[phase][1] = self.clock() - self.origin
+
+    def phase(self, phase):
+        """Return a context manager recording the given phase"""
+        timer = self
+
+        class Phase(object):
+            def __enter__(self):
+                timer.start(phase)
+
+            def __exit__(self, *exc):
+                timer.end(phase)
+
+        return Phase()
+
+    def wrap(self, phase, function):
+        """Return a function recording the given phase when called"""
+        def timed(*args, **kwargs):
+            with self.phase(phase):
+                return function(*args, **kwargs)
+        return timed
+
+    @property
+    def finished(self):
+        """True if all the started phases have ended"""
+        with self._lock:
+            return all(end is not None for _, end in self.phases.values())
+
+    @property
+    def elapsed(self):
+        """Time from the beginning of the process to the end of its last phase"""
+        with self._lock:
+            return max([end for _, end in self.phases.values() if end is not None] or [0.0])
+
+    def report(self):
+        """Return the phases as a text, one line per phase with its start
+        time and its duration"""
+        lines = ['{}: {:.1f}ms'.format(self.name, self.elapsed * 1000)]
+        with self._lock:
+            for phase, (start, end) in self.phases.items():
+                took = '{:8.1f}ms'.format((end - start) * 1000) if end is not None else ' running'
+                lines.append('  {:<20} at {:8.1f}ms took {}'.format(phase, start * 1000, took))
+        return '\n'.join(lines)
@@ -0,0 +1,85 @@
+"""
+PNG encoder dedicated to the QR codes: a QR code is a 1-bit greyscale
+image whose rows are packed into bytes at once, instead of being encoded
+pixel by pixel by the general-purpose png.Writer.
+"""
+import binascii
+import io
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import png
+
+# Number of encoded QR codes kept by encode_qr, by key
+MEMO_SIZE = 32
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def pack_row(bits):
+    """Return the bytes of a row of 1-bit pixels given as a string of
+    '0' (black) and '1' (white), padded to a whole byte"""
+    padded = -len(bits) % 8
+    size = (len(bits) + padded) // 4
+    return binascii.unhexlify('%0*x' % (size, int(bits + '0' * padded, 2)))
+
+
+def qr_rows(qr_matrix, scale=1, border=0):
+    """Return the scanlines of the image of the QR code, i.e. the filter
+    type 0 followed by the packed row: each module is `scale` pixels wide
+    and high, with a quiet zone of `border` white modules around it"""
+    dark, light = '0' * scale, '1' * scale
+    margin = light * border
+    blank = b'\0' + pack_row(light * (len(qr_matrix[0]) + 2 * border))
+
+    quiet = [blank * (scale * border)]
+    scanlines = {}
+    rows = []
+    for row in qr_matrix:
+        bits = margin + ''.join([dark if module else light for module in row]) + margin
+        scanline = scanlines.get(bits)
+        if scanline is None:
+            scanline = scanlines[bits] = (b'\0' + pack_row(bits)) * scale
+        rows.append(scanline)
+    return quiet + rows + quiet
+
+
+def write_qr(out, qr_matrix, scale=1, border=0, level=6):
+    """Write the PNG image of the QR code, a matrix of modules which are
+    True for the dark ones, to the file. The default level compresses the
+    repeated rows of a scaled code better and much faster than level 9"""
+    size = (len(qr_matrix) + 2 * border) * scale
+    png.write_chunks(out, [
+        (b'IHDR', struct.pack('!2I5B', size, size, 1, 0, 0, 0, 0)),
+        (b'IDAT', zlib.compress(b''.join(qr_rows(qr_matrix, scale, border)), level)),
+        (b'IEND', b''),
+    ])
+
+
+def encode_qr(qr_matrix, scale=1, border=0, key=None):
+    """
+    Return the data of the PNG image of the QR code (see write_qr).
+
+    The image is encoded once for a key, e.g. the URL encoded by the QR
+    code: the most recently used images are kept by their key.
+    """
+    if key is not None:
+        with _memo_lock:
+            data = _memo.pop((key, scale, border), None)
+            if data is not None:
+                _memo[(key, scale, border)] = data
+                return data
+
+    out = io.BytesIO()
+    write_qr(out, qr_matrix, scale, border)
+    data = out.getvalue()
+
+    if key is not None:
+        with _memo_lock:
+            _memo[(key, scale, border)] = data
+            while len(_memo) > MEMO_SIZE:
+                _memo.popitem(last=False)
+    return data